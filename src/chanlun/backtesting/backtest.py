@@ -1,15 +1,18 @@
+import bisect
 import copy
 import datetime
 import gc
 import hashlib
 import os
 import pickle
+import shutil
+import tempfile
 import time
 import traceback
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from multiprocessing import get_context
 from pathlib import Path
-from typing import Dict, List
+from typing import List, Union
 
 import empyrical as ep
 import numpy as np
@@ -26,13 +29,20 @@ from chanlun.backtesting.backtest_klines import BackTestKlines
 from chanlun.backtesting.backtest_trader import BackTestTrader
 from chanlun.backtesting.base import POSITION, Strategy
 from chanlun.backtesting.klines_generator import KlinesGenerator
-from chanlun.backtesting.optimize import OptimizationSetting
+from chanlun.backtesting.optimize import (
+    OptimizationSetting,
+    SearchStrategy,
+    get_search_strategy,
+)
 from chanlun.cl_interface import ICL
+from chanlun.config import get_data_path
 from chanlun.exchange.exchange import (
     convert_currency_kline_frequency,
     convert_futures_kline_frequency,
     convert_stock_kline_frequency,
 )
+from chanlun.file_db import fdb
+from chanlun.profiler import profiler
 
 
 class BackTest:
@@ -47,6 +57,13 @@ class BackTest:
         self._resources = set()
         # 性能监控
         self._perf_stats = {}
+        # 是否统计回测各阶段的耗时（数据获取、周期转换、缠论计算、策略开平仓、执行操作、持仓记录），运行完成后输出统计表格
+        self.profile = False
+        # 回测断点保存的间隔（循环次数），None 不保存；断点保存在 save_file 同名的 _checkpoint 目录，运行完成后删除
+        self.checkpoint_interval = None
+        # 是否合并所有回测代码的K线时间作为循环时间，并且每次循环只对有新K线的代码执行策略（停牌的代码不执行）
+        # 默认 False，只按照 base_code 的K线时间循环，每次循环对所有代码执行策略；开启后循环次数与策略执行时机会变化，回测结果会不同
+        self.loop_all_codes = False
         # 内存管理阈值
         self.memory_threshold = 0.8  # 80% 内存使用率阈值
 
@@ -214,9 +231,11 @@ class BackTest:
         next_frequency: str = None,
         begin_start_dt: datetime.datetime = None,
         loop_callback_fun: object = None,
+        resume: bool = False,
     ):
         """
         执行回测
+        @param resume: 是否从上次保存的断点（需设置 checkpoint_interval）恢复，继续执行回测
         """
         if next_frequency is None:
             next_frequency = self.frequencys[-1]
@@ -224,17 +243,30 @@ class BackTest:
         self.next_frequency = next_frequency
 
         self.datas.load_data_to_cache = self.load_data_to_cache
-        self.datas.init(self.base_code, next_frequency)
+        self.datas.init(
+            self.base_code,
+            next_frequency,
+            self.codes if self.loop_all_codes else None,
+        )
 
         if begin_start_dt is not None:
             self.log.info(f"起始数据回放位置：{begin_start_dt}")
             for _f, _dts in self.datas.loop_datetime_list.items():
-                _dts = [_d for _d in _dts if _d >= begin_start_dt]
+                self.datas.loop_index[_f] = bisect.bisect_left(_dts, begin_start_dt)
+
+        if resume:
+            self.load_checkpoint()
 
         _st = time.time()
+        _loop_num = 0
+        if self.profile:
+            profiler.enable()
+        _run_frame = profiler.start("run")
 
         while True:
+            _frame = profiler.start("next")
             is_ok = self.datas.next(next_frequency)
+            profiler.stop(_frame)
             if is_ok is False:
                 break
             # 更新持仓盈亏与资金变化
@@ -244,7 +276,9 @@ class BackTest:
                 self.log.error(f"执行记录持仓信息 : {self.datas.now_date} 异常")
                 self.log.error(traceback.format_exc())
 
-            for code in self.codes:
+            # 开启 loop_all_codes 的，只对当前时间有新K线的代码执行策略，停牌的代码不执行
+            for code in self.datas.trade_codes(self.codes):
+                _frame = profiler.start("strategy", code)
                 try:
                     self.strategy.on_bt_loop_start(self)
                     self.trader.run(code, is_filter=self.strategy.is_filter_opts())
@@ -252,6 +286,9 @@ class BackTest:
                     self.log.error(f"执行 {code} : {self.datas.now_date} 异常")
                     self.log.error(traceback.format_exc())
                     # raise e
+                finally:
+                    profiler.stop(_frame)
+            _frame = profiler.start("filter_opts")
             try:
                 # 如果有开启操作二次过滤，则调用一下进行执行
                 self.trader.buffer_opts = self.strategy.filter_opts(
@@ -259,33 +296,163 @@ class BackTest:
                 )
                 self.trader.run_buffer_opts()
             except Exception:
-                self.log.error(f"执行 {code} 操作二次过滤 : {self.datas.now_date} 异常")
+                self.log.error(f"执行操作二次过滤 : {self.datas.now_date} 异常")
                 self.log.error(traceback.format_exc())
+            finally:
+                profiler.stop(_frame)
             if loop_callback_fun:
                 loop_callback_fun(self)
 
+            _loop_num += 1
+            if self.checkpoint_interval and _loop_num % self.checkpoint_interval == 0:
+                try:
+                    self.save_checkpoint()
+                except Exception:
+                    self.log.error(f"保存回测断点 : {self.datas.now_date} 异常")
+                    self.log.error(traceback.format_exc())
+
         # 清空持仓
         self.trader.end()
         self.trader.datas = None
         # 调用策略的清理方法
         self.strategy.clear()
         _et = time.time()
+        profiler.stop(_run_frame)
 
         self.log.info(f"运行完成，执行时间：{_et - _st}")
+        if self.profile:
+            self.profile_report()
+            profiler.disable()
+        # 运行完成，删除断点
+        if self._checkpoint_path() is not None:
+            shutil.rmtree(self._checkpoint_path(), ignore_errors=True)
         return True
 
-    def run_by_code(self, code: str):
+    def _checkpoint_path(self) -> Union[Path, None]:
+        """
+        回测断点的保存目录，没有设置 save_file 的不保存断点
+        """
+        if self.save_file is None:
+            return None
+        return Path(self.save_file.split(".pkl")[0] + "_checkpoint")
+
+    def save_checkpoint(self):
+        """
+        保存回测断点：回放位置、交易对象的数据（save_to_pkl）、策略对象，缠论数据对象单独保存为快照文件
+        每次保存的快照写入新的 gen_<序号> 目录，状态文件先写入临时文件再替换，替换完成后才删除旧的快照目录
+        中途异常不会破坏上一次的断点
+        """
+        path = self._checkpoint_path()
+        if path is None:
+            return False
+        path.mkdir(parents=True, exist_ok=True)
+        _st = time.time()
+        gen_dirs = [
+            _p for _p in path.glob("gen_*") if _p.is_dir() and _p.name[4:].isdigit()
+        ]
+        generation = max([int(_p.name[4:]) for _p in gen_dirs], default=0) + 1
+        gen_dir = f"gen_{generation}"
+        (path / gen_dir).mkdir()
+        cl_files = {}
+        for key, cd in self.datas.cl_datas.items():
+            key_md5 = hashlib.md5(key.encode("UTF-8")).hexdigest()
+            cl_files[key] = f"{gen_dir}/{key_md5}.snap"
+            fdb.dump_cl_snapshot(path / cl_files[key], cd)
+        state = {
+            "generation": generation,
+            "now_date": self.datas.now_date,
+            "loop_index": dict(self.datas.loop_index),
+            "trader": self.trader.save_to_pkl(None),
+            "strategy": self.strategy,
+            "cl_files": cl_files,
+        }
+        tmp_file = path / f"state.pkl.{os.getpid()}.tmp"
+        try:
+            with open(tmp_file, "wb") as fp:
+                pickle.dump(state, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, path / "state.pkl")
+        finally:
+            if tmp_file.exists():
+                tmp_file.unlink()
+        # 状态文件替换完成，删除之前的快照目录
+        for _p in gen_dirs:
+            shutil.rmtree(_p, ignore_errors=True)
+        self.log.info(
+            f"保存回测断点：{self.datas.now_date}，耗时 {time.time() - _st:.2f} 秒"
+        )
+        return True
+
+    def load_checkpoint(self):
+        """
+        从保存的断点中恢复交易对象、策略对象、缠论数据与回放位置，没有断点返回 False
+        快照无法读取的缠论数据，在后续获取时重新计算
+        """
+        path = self._checkpoint_path()
+        if path is None or (path / "state.pkl").is_file() is False:
+            self.log.info("没有找到回测断点，从头开始执行回测")
+            return False
+        with open(path / "state.pkl", "rb") as fp:
+            state = pickle.load(fp)
+        self.trader.load_from_pkl(None, state["trader"])
+        self.strategy = state["strategy"]
+        self.trader.set_strategy(self.strategy)
+        for key, filename in state["cl_files"].items():
+            try:
+                cd = fdb.load_cl_snapshot(path / filename)
+            except Exception:
+                cd = None
+            if cd is not None:
+                self.datas.cl_datas[key] = cd
+        for _f, _i in state["loop_index"].items():
+            if _f in self.datas.loop_index.keys():
+                self.datas.loop_index[_f] = _i
+        self.datas.now_date = state["now_date"]
+        if self.next_frequency in self.datas.loop_index.keys():
+            self.datas.bar.update(self.datas.loop_index[self.next_frequency])
+        self.log.info(f"从回测断点恢复：{state['now_date']}")
+        return True
+
+    def profile_report(self):
+        """
+        输出开启 profile 后的回测各阶段耗时统计，并保存火焰图使用的折叠调用栈文件
+        统计结果（按代码区分）保存在 _perf_stats 中
+        """
+        self._perf_stats = {
+            "stages": profiler.stats(),
+            "codes": profiler.stats(by_code=True),
+        }
+        profiler.print_report()
+        if self.save_file is not None:
+            folded_file = self.save_file.split(".pkl")[0] + "_profile.folded"
+        else:
+            folded_file = str(get_data_path() / "backtest_profile.folded")
+        profiler.save_folded(folded_file)
+        self.log.info(f"回测耗时统计火焰图数据：{folded_file}")
+        return self._perf_stats
+
+    def run_by_code(self, code: str, is_save: bool = True):
+        """
+        多进程回测中，子进程执行单个代码的回测，返回精简的回测结果汇总（见 process_summary）
+        is_save 为 True 会将单个代码的回测结果保存到 *_process_.pkl 文件，下次执行可直接加载
+        """
         # 修改回测类中的属性，进行回测
         # 保存文件更改
-        new_file = (
-            self.save_file.split(".pkl")[0]
-            + "_"
-            + code.lower().replace(".", "_").replace("/", "_")
-            + "_process_.pkl"
-        )
-        # 默认如果之前的回测文件还有保存，可以直接返回，如果设置 重新运行，则不返回
-        if self._process_re_again is False and Path(new_file).exists():
-            return new_file
+        new_file = None
+        if self.save_file is not None:
+            new_file = (
+                self.save_file.split(".pkl")[0]
+                + "_"
+                + code.lower().replace(".", "_").replace("/", "_")
+                + "_process_.pkl"
+            )
+        # 默认如果之前的回测文件还有保存，可以直接加载返回，如果设置 重新运行，则不加载
+        if (
+            self._process_re_again is False
+            and new_file is not None
+            and Path(new_file).exists()
+        ):
+            self.load(new_file)
+            return self.process_summary()
 
         self.save_file = new_file
         # 运行币种修改为参数指定的
@@ -294,15 +461,86 @@ class BackTest:
         # 开始运行
         self.run(self.next_frequency)
         # 结果保存
-        self.save()
-        # 运行完成，返回回测保存的地址
-        return self.save_file
+        if is_save:
+            self.save()
+        # 运行完成，返回回测结果汇总
+        return self.process_summary()
+
+    def process_summary(self) -> dict:
+        """
+        多进程回测中，单个代码回测结果的汇总，只包含合并需要的数据，资金历史转换为日期与金额数组，减少进程间传输的数据量
+        """
+        bh_dates = np.array(list(self.trader.balance_history.keys()), dtype=str)
+        bh_values = np.array(
+            list(self.trader.balance_history.values()), dtype=np.float64
+        )
+        sort_idx = np.argsort(bh_dates, kind="stable")
+        return {
+            "base_code": self.base_code,
+            "results": self.trader.results,
+            "positions_history": self.trader.positions_history,
+            "hold_profit_history": self.trader.hold_profit_history,
+            "orders": self.trader.orders,
+            "balance_history": (bh_dates[sort_idx], bh_values[sort_idx]),
+            "fee_total": self.trader.fee_total,
+        }
+
+    @staticmethod
+    def _merge_balance_history(
+        dates_a: np.ndarray,
+        values_a: np.ndarray,
+        dates_b: np.ndarray,
+        values_b: np.ndarray,
+    ):
+        """
+        合并两个资金历史（日期升序），在合并后的日期上，各自用之前最近的一个值填充（之前没有记录的为 0）后相加
+        """
+        dates = np.union1d(dates_a, dates_b)
+        values = np.zeros(len(dates), dtype=np.float64)
+        for _dates, _values in ((dates_a, values_a), (dates_b, values_b)):
+            if len(_dates) == 0:
+                continue
+            idx = np.searchsorted(_dates, dates, side="right") - 1
+            values += np.where(idx >= 0, _values[np.maximum(idx, 0)], 0)
+        return dates, values
+
+    def _save_shared_klines(self):
+        """
+        多进程回测前，将所有代码的K线数据一次性读取并保存为共享文件，子进程以只读内存映射的方式读取，不再各自查询数据库
+        只在使用缓存（load_data_to_cache）时生效，返回共享目录，不使用返回 None
+        """
+        if self.load_data_to_cache is False:
+            return None
+        shared_path = get_data_path() / "backtest_klines"
+        shared_path.mkdir(parents=True, exist_ok=True)
+        shared_path = tempfile.mkdtemp(prefix="klines_", dir=shared_path)
+        codes = list(dict.fromkeys([self.base_code] + list(self.codes)))
+        _st = time.time()
+        self.datas.save_shared_klines(codes, shared_path)
+        self.log.info(f"共享K线数据保存完成，耗时 {time.time() - _st:.2f} 秒：{shared_path}")
+        self.datas.shared_klines_path = shared_path
+        return shared_path
+
+    def _remove_shared_klines(self, shared_path: str):
+        """
+        删除多进程回测使用的共享K线数据
+        """
+        self.datas.shared_klines_path = None
+        self.datas._shared_manifest = None
+        if shared_path is not None:
+            shutil.rmtree(shared_path, ignore_errors=True)
 
     def run_process(
-        self, next_frequency: str = None, max_workers: int = None, re_again=False
+        self,
+        next_frequency: str = None,
+        max_workers: int = None,
+        re_again=False,
+        save_process_file: bool = True,
     ):
         """
         多进程执行回测模式
+        @param re_again: 是否忽略之前保存的单个代码回测文件，重新执行回测
+        @param save_process_file: 是否将每个代码的回测结果保存到 *_process_.pkl 文件中（结果会直接通过进程返回合并，不依赖这些文件）
         """
         if self.mode != "signal":
             raise Exception(f"多进程回测，不支持 {self.mode} 回测模式")
@@ -314,69 +552,70 @@ class BackTest:
         self._process_re_again = re_again
 
         start = time.time()
-        with ProcessPoolExecutor(
-            max_workers, mp_context=get_context("spawn")
-        ) as executor:
-            results = list(executor.map(self.run_by_code, self.codes))
-            end = time.time()
-            cost: int = int(end - start)
-            self.log.info(f"多进程回测完成，耗时{cost}秒")
-
-            # 记录 资金变动历史
-            balance_history = {}
-            # 回测结果合并
-            for f in tqdm(results, desc="结果汇总"):
-                BT = BackTest()
-                BT.load(f)
-                # 汇总结果
-                for mmd, res in BT.trader.results.items():
-                    for _k, _v in res.items():
-                        self.trader.results[mmd][_k] += _v
-                # 历史持仓合并
-                for _code, _poss in BT.trader.positions_history.items():
-                    self.trader.positions_history[_code] = _poss
-                # 持仓盈亏合并
-                for _dt, _hold_profits in BT.trader.hold_profit_history.items():
-                    if _dt not in self.trader.hold_profit_history.keys():
-                        self.trader.hold_profit_history[_dt] = 0
-                    self.trader.hold_profit_history[_dt] += _hold_profits
-                # 合并订单记录
-                for _code, _orders in BT.trader.orders.items():
-                    self.trader.orders[_code] = _orders
-                # 资金历史记录
-                balance_history[BT.base_code] = BT.trader.balance_history
-                # 手续费合并
-                self.trader.fee_total += BT.trader.fee_total
-
-                # 释放内存
-                BT.trader = None
-                BT.strategy = None
-                BT.datas = None
-                del BT
-                gc.collect()
-
-                # 整理并汇总资金变动历史
-            try:
-                bh_df = pd.DataFrame(balance_history.values())
-                bh_df = bh_df.T.sort_index().fillna(method="ffill").fillna(0)
-                self.trader.balance_history = bh_df.sum(axis=1)
-            except Exception:
-                self.log.error("合并资金历史记录异常")
-                self.log.error(traceback.format_exc())
-
-                self.log.info("合并回测结果完成，可调用 save 方法进行保存")
-            except Exception as e:
-                self.log.error("多进程回测执行异常")
-                self.log.error(traceback.format_exc())
-                raise e
-            finally:
-                # 确保资源被释放
-                gc.collect()
+        # 资金变动历史（日期与金额数组）
+        bh_dates = np.array([], dtype=str)
+        bh_values = np.array([], dtype=np.float64)
+        shared_path = self._save_shared_klines()
+        try:
+            with ProcessPoolExecutor(
+                max_workers, mp_context=get_context("spawn")
+            ) as executor:
+                futures = [
+                    executor.submit(self.run_by_code, code, save_process_file)
+                    for code in self.codes
+                ]
+                # 子进程完成一个，合并一个回测结果
+                for future in tqdm(
+                    as_completed(futures), total=len(futures), desc="结果汇总"
+                ):
+                    res = future.result()
+                    # 汇总结果
+                    for mmd, mmd_res in res["results"].items():
+                        for _k, _v in mmd_res.items():
+                            self.trader.results[mmd][_k] += _v
+                    # 历史持仓合并
+                    self.trader.positions_history.update(res["positions_history"])
+                    # 持仓盈亏合并
+                    for _dt, _hold_profits in res["hold_profit_history"].items():
+                        self.trader.hold_profit_history[_dt] = (
+                            self.trader.hold_profit_history.get(_dt, 0)
+                            + _hold_profits
+                        )
+                    # 合并订单记录
+                    self.trader.orders.update(res["orders"])
+                    # 资金历史记录
+                    bh_dates, bh_values = self._merge_balance_history(
+                        bh_dates, bh_values, *res["balance_history"]
+                    )
+                    # 手续费合并
+                    self.trader.fee_total += res["fee_total"]
+        except Exception as e:
+            self.log.error("多进程回测执行异常")
+            self.log.error(traceback.format_exc())
+            raise e
+        finally:
+            self._remove_shared_klines(shared_path)
+            # 确保资源被释放
+            gc.collect()
+
+        # 整理并汇总资金变动历史
+        self.trader.balance_history = pd.Series(bh_values, index=bh_dates)
+
+        end = time.time()
+        cost: int = int(end - start)
+        self.log.info(f"多进程回测完成，耗时{cost}秒")
+        self.log.info("合并回测结果完成，可调用 save 方法进行保存")
         return True
 
-    def run_params(self, new_cl_setting: dict):
+    def run_params(
+        self,
+        new_cl_setting: dict,
+        start_datetime: str = None,
+        end_datetime: str = None,
+    ):
         """
         参数优化，执行不同的参数配置
+        start_datetime / end_datetime 不传则使用回测配置的时间，参数搜索时会用较短的回测时间进行快速筛选
 
         注意事项：如果有修改过 Strategy 策略文件，并需要重新进行参数优化的，需要手动将 notebook/data/bk/_optimization_*.pkl 文件删除
         注意事项：如果有修改过 Strategy 策略文件，并需要重新进行参数优化的，需要手动将 notebook/data/bk/_optimization_*.pkl 文件删除
@@ -390,7 +629,9 @@ class BackTest:
             else:
                 copy_cl_config[k] = v
         # 生成一个唯一的key，用于避免重复执行相同配置的回测
-        key = f"{self.base_code}_{self.market}_{self.codes}_{self.frequencys}_{self.start_datetime}_{self.end_datetime}_{type(self.strategy)}_{copy_cl_config}"
+        start_datetime = start_datetime or self.start_datetime
+        end_datetime = end_datetime or self.end_datetime
+        key = f"{self.base_code}_{self.market}_{self.codes}_{self.frequencys}_{start_datetime}_{end_datetime}_{type(self.strategy)}_{copy_cl_config}"
         key = hashlib.md5(key.encode(encoding="UTF-8")).hexdigest()
         # 保存到新的文件中，进行落地
         new_save_file = f"./data/bk/_optimization_{key}.pkl"
@@ -411,9 +652,9 @@ class BackTest:
                 # 回测的周期，这里设置里，在策略中才能取到对应周期的数据
                 "frequencys": self.frequencys,
                 # 回测开始的时间
-                "start_datetime": self.start_datetime,
+                "start_datetime": start_datetime,
                 # 回测的结束时间
-                "end_datetime": self.end_datetime,
+                "end_datetime": end_datetime,
                 # mode 为 trade 生效，初始账户资金
                 "init_balance": self.init_balance,
                 # mode 为 trade 生效，交易手续费率
@@ -426,6 +667,9 @@ class BackTest:
         )
 
         BT.load_data_to_cache = self.load_data_to_cache
+        BT.datas.shared_klines_path = self.datas.shared_klines_path
+        # 缠论配置相同的参数组合，共用磁盘保存的缠论计算结果
+        BT.datas.share_cl_data = True
 
         BT.log.info(
             f"执行参数优化，参数配置：{new_cl_setting}，落地文件：{new_save_file}"
@@ -465,6 +709,7 @@ class BackTest:
         next_frequency: str = None,
         evaluate: str = "profit_rate",
         load_data_to_cache: bool = True,
+        search: Union[str, SearchStrategy] = None,
     ):
         """
         运行参数优化
@@ -473,60 +718,88 @@ class BackTest:
         @param next_frequency: 回测每次循环的周期
         @param evaluate: 评价的指标 允许 profit_rate /  max_profit_rate
         @param load_data_to_cache: 批量优化，如果使用加载数据到内存中的做法，会占用太多内存，这里可以设置为 False，直接读取数据到方式执行
+        @param search: 参数搜索策略，默认穷举所有参数组合，可选 random / halving / genetic 或者 optimize.py 中的搜索策略对象
         """
-        cl_settings: List[Dict] = optimization_setting.generate_cl_settings()
+        search = get_search_strategy(search)
 
-        self.log.info("开始执行穷举算法优化")
-        self.log.info(f"参数优化空间：{len(cl_settings)}")
+        self.log.info(f"开始执行参数优化，搜索策略：{search}")
+        self.log.info(f"参数优化空间：{optimization_setting.total_num()}")
 
         self.next_frequency = next_frequency  # 每次循环的周期
         self.load_data_to_cache = load_data_to_cache
         self.evaluate = evaluate
 
         start = time.perf_counter()
+        shared_path = self._save_shared_klines()
 
-        with ProcessPoolExecutor(
-            max_workers, mp_context=get_context("spawn")
-        ) as executor:
-            results = list(executor.map(self.run_params, cl_settings))
-            results.sort(reverse=True, key=lambda _r: _r["end_balance"])
-
-            end = time.perf_counter()
-            cost: int = int((end - start))
-            self.log.info(f"穷举算法优化完成，耗时{cost}秒")
+        try:
+            with ProcessPoolExecutor(
+                max_workers, mp_context=get_context("spawn")
+            ) as executor:
+
+                def evaluate_fun(cl_settings: List[dict], fidelity: float):
+                    start_datetime, end_datetime = self._fidelity_datetime(fidelity)
+                    self.log.info(
+                        f"回测 {len(cl_settings)} 个参数组合，回测时间：{start_datetime} ~ {end_datetime}"
+                    )
+                    return list(
+                        executor.map(
+                            self.run_params,
+                            cl_settings,
+                            [start_datetime] * len(cl_settings),
+                            [end_datetime] * len(cl_settings),
+                        )
+                    )
+
+                results = search.search(optimization_setting, evaluate_fun)
+        except Exception as e:
+            self.log.error("参数优化执行异常")
+            self.log.error(traceback.format_exc())
+            raise e
+        finally:
+            self._remove_shared_klines(shared_path)
+            gc.collect()
+        results.sort(reverse=True, key=lambda _r: _r["end_balance"])
+
+        end = time.perf_counter()
+        cost: int = int((end - start))
+        self.log.info(f"参数优化完成，耗时{cost}秒")
+        for r in results:
             try:
-                for r in results:
-                    try:
-                        BT = BackTest()
-                        BT.load(r["save_file"])
-                        print("* * " * 10)
-                        print(f'参数：{r["params"]}')
-                        print(f'落地文件：{r["save_file"]}')
-                        BT.result(True)
-                    except Exception:
-                        self.log.error(f"处理优化结果异常：{r['save_file']}")
-                        self.log.error(traceback.format_exc())
-                        continue
-                    finally:
-                        # 确保每次循环后释放资源
-                        if "BT" in locals():
-                            BT.trader = None
-                            BT.strategy = None
-                            BT.datas = None
-                            del BT
-                            gc.collect()
+                BT = BackTest()
+                BT.load(r["save_file"])
+                print("* * " * 10)
+                print(f'参数：{r["params"]}')
+                print(f'落地文件：{r["save_file"]}')
+                BT.result(True)
             except Exception:
-                self.log.error("处理优化结果集异常")
+                self.log.error(f"处理优化结果异常：{r['save_file']}")
                 self.log.error(traceback.format_exc())
-
-                return results
-            except Exception as e:
-                self.log.error("参数优化执行异常")
-                self.log.error(traceback.format_exc())
-                raise e
+                continue
             finally:
-                # 确保资源被释放
-                gc.collect()
+                # 确保每次循环后释放资源
+                if "BT" in locals():
+                    BT.trader = None
+                    BT.strategy = None
+                    BT.datas = None
+                    del BT
+                    gc.collect()
+
+        return results
+
+    def _fidelity_datetime(self, fidelity: float):
+        """
+        参数搜索中，按照比例获取回测的时间范围（保留结束时间，只回测最近 fidelity 比例的时间），1 则为回测配置的时间
+        """
+        if fidelity >= 1:
+            return self.start_datetime, self.end_datetime
+        start_dt = self.datas.start_date
+        end_dt = self.datas.end_date
+        start_dt = end_dt - (end_dt - start_dt) * fidelity
+        return (
+            start_dt.strftime("%Y-%m-%d %H:%M:%S"),
+            end_dt.strftime("%Y-%m-%d %H:%M:%S"),
+        )
 
     def show_charts(
         self,
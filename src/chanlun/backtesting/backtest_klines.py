@@ -2,9 +2,11 @@
 import datetime
 import hashlib
 import json
+import pathlib
 import time
 from typing import Dict, List, Union
 
+import numpy as np
 import pandas as pd
 import pytz
 from tqdm.auto import tqdm
@@ -13,6 +15,8 @@ from chanlun import cl, fun
 from chanlun.backtesting.base import MarketDatas
 from chanlun.cl_interface import ICL
 from chanlun.exchange.exchange_db import ExchangeDB
+from chanlun.file_db import fdb
+from chanlun.profiler import profiler
 
 
 class BackTestKlines(MarketDatas):
@@ -70,17 +74,34 @@ class BackTestKlines(MarketDatas):
         self.load_kline_nums = 10000  # 每次重新加载的K线数量
         self.cl_data_kline_max_nums = 50000  # 缠论数据中最大保存的k线数量
         self.del_volume_zero = False  # 是否删除成交量为 0 的K线数据
+        # 是否使用磁盘共享的缠论数据，首次计算与重新计算时，缠论配置与K线数据一致的直接读取之前保存的计算结果（参数优化中开启）
+        self.share_cl_data = False
 
         # 保存k线数据
         self.all_klines: Dict[str, pd.DataFrame] = {}
+        # k线数据的时间（UTC 时间的 ns 整数数组），用于二分查找当前时间对应的位置
+        self.all_klines_dates: Dict[str, np.ndarray] = {}
+        # 小周期每根K线所属的大周期K线时间，key 为 code-小周期-大周期
+        self.bucket_dates: Dict[str, Union[np.ndarray, None]] = {}
+        # 每个代码大周期正在合成中的K线，key 为 code-大周期
+        self.merge_states: Dict[str, dict] = {}
+
+        # 多进程回测时，共享K线数据的目录（由 save_shared_klines 生成），设置后优先从共享数据中读取，不再查询数据库
+        self.shared_klines_path: Union[str, None] = None
+        self._shared_manifest: Union[dict, None] = None
 
         # 每个周期缓存的k线数据，避免多次请求重复计算
         self.cache_klines: Dict[str, Dict[str, pd.DataFrame]] = {}
 
         self.ex = ExchangeDB(self.market)
 
-        # 用于循环的日期列表
+        # 用于循环的日期列表，loop_index 为下次循环的位置
         self.loop_datetime_list: Dict[str, list] = {}
+        self.loop_index: Dict[str, int] = {}
+        # 每个循环时间有新K线的代码（代码数组, 按时间排序的代码序号, 每个时间的起止位置）
+        self.loop_codes: Dict[str, tuple] = {}
+        # 当前循环时间有新K线的代码，None 表示不区分
+        self.now_trade_codes: Union[set, None] = None
 
         # 进度条
         self.bar: Union[tqdm, None] = None
@@ -95,38 +116,97 @@ class BackTestKlines(MarketDatas):
             "query_db_klines": 0,
         }
 
-    def init(self, base_code: str, frequency: Union[str, list]):
-        # 初始化，获取循环的日期列表
+    def init(
+        self, base_code: str, frequency: Union[str, list], codes: List[str] = None
+    ):
+        """
+        初始化，获取循环的日期列表
+        传入 codes 则合并所有代码（包括 base_code）的K线时间作为循环时间，并记录每个时间有新K线的代码，
+        回测中通过 trade_codes 只对有新K线的代码执行策略（停牌的代码不执行）
+        """
         self.base_code = base_code
         if frequency is None:
             frequency = [self.frequencys[-1]]
         if isinstance(frequency, str):
             frequency = [frequency]
+        loop_codes = list(dict.fromkeys([base_code] + list(codes or [])))
+        self.loop_index = {}
+        self.loop_codes = {}
+        self.now_trade_codes = None
         for _f in frequency:
-            klines = self.ex.klines(
-                base_code,
-                _f,
-                start_date=fun.datetime_to_str(self.start_date),
-                end_date=fun.datetime_to_str(self.end_date),
-                args={"limit": None},
-            )
-            if klines is None:
-                self.loop_datetime_list[_f] = []
+            code_dates = [self._loop_dates(_c, _f) for _c in loop_codes]
+            tz = code_dates[0].tz
+            all_dates = np.unique(np.concatenate([_d.asi8 for _d in code_dates]))
+            all_dates_index = pd.DatetimeIndex(all_dates)
+            if tz is not None:
+                all_dates_index = all_dates_index.tz_localize("UTC").tz_convert(tz)
+            self.loop_datetime_list[_f] = all_dates_index.to_list()
+            self.loop_index[_f] = 0
+            if codes is None:
                 continue
-            self.loop_datetime_list[_f] = list(klines["date"].to_list())
-            self.loop_datetime_list[_f].sort()
+
+            # 每根K线在循环时间中可以获取到的位置（后对齐的K线，需要到下一个循环时间才能获取到）
+            side_offset = 1 if self.market in ["currency", "futures", "us"] else 0
+            time_idx = np.concatenate(
+                [np.searchsorted(all_dates, _d.asi8) + side_offset for _d in code_dates]
+            )
+            code_idx = np.concatenate(
+                [np.full(len(_d), _i, dtype=np.int64) for _i, _d in enumerate(code_dates)]
+            )
+            order = np.argsort(time_idx, kind="stable")
+            # 第 i 个循环时间有新K线的代码为 code_idx[order][bounds[i]:bounds[i+1]]
+            bounds = np.searchsorted(time_idx[order], np.arange(len(all_dates) + 1))
+            self.loop_codes[_f] = (np.array(loop_codes), code_idx[order], bounds)
 
         self.bar = tqdm(
             total=len(list(self.loop_datetime_list.values())[-1]),
             desc=f"Run {base_code}",
         )
 
+    def _loop_dates(self, code: str, frequency: str) -> pd.DatetimeIndex:
+        """
+        获取代码回测时间区间内的K线时间
+        """
+        if self.load_data_to_cache and frequency in self.frequencys:
+            # 使用缓存的，直接读取全部的K线，后续回测中也会使用
+            klines = self._get_all_klines(code, frequency)
+        else:
+            klines = self._load_shared_klines(code, frequency)
+            if klines is None:
+                klines = self.ex.klines(
+                    code,
+                    frequency,
+                    start_date=fun.datetime_to_str(self.start_date),
+                    end_date=fun.datetime_to_str(self.end_date),
+                    args={"limit": None},
+                )
+        if klines is None or len(klines) == 0:
+            return pd.DatetimeIndex([], tz=self.tz)
+        dates = pd.DatetimeIndex(klines["date"]).sort_values()
+        start_date = pd.Timestamp(self.start_date)
+        end_date = pd.Timestamp(self.end_date)
+        if dates.tz is not None and start_date.tz is None:
+            start_date = start_date.tz_localize(dates.tz)
+            end_date = end_date.tz_localize(dates.tz)
+        return dates[(dates >= start_date) & (dates <= end_date)]
+
+    def trade_codes(self, codes: List[str]) -> List[str]:
+        """
+        当前循环时间有新K线的代码（没有传入 codes 初始化的，返回所有代码）
+        """
+        if self.now_trade_codes is None:
+            return codes
+        return [_c for _c in codes if _c in self.now_trade_codes]
+
     def clear_all_cache(self):
         """
         清除所有可用缓存，释放内存
         """
         self.cache_klines = {}
         self.all_klines = {}
+        self.all_klines_dates = {}
+        self.bucket_dates = {}
+        self.merge_states = {}
         self.cache_cl_datas = {}
         self.cl_datas = {}
         return True
@@ -134,12 +214,19 @@ class BackTestKlines(MarketDatas):
     def next(self, frequency: str = ""):
         if frequency == "" or frequency is None:
             frequency = self.frequencys[-1]
-        if len(self.loop_datetime_list[frequency]) == 0:
+        loop_i = self.loop_index[frequency]
+        if loop_i >= len(self.loop_datetime_list[frequency]):
             self.clear_all_cache()
             return False
-        self.now_date = self.loop_datetime_list[frequency].pop(0)
-        # for _f, loop_dt_list in self.loop_datetime_list.items():
-        #     self.loop_datetime_list[_f] = [d for d in loop_dt_list if d >= self.now_date]
+        self.now_date = self.loop_datetime_list[frequency][loop_i]
+        self.loop_index[frequency] = loop_i + 1
+        if frequency in self.loop_codes.keys():
+            codes, code_idx, bounds = self.loop_codes[frequency]
+            self.now_trade_codes = set(
+                codes[code_idx[bounds[loop_i] : bounds[loop_i + 1]]].tolist()
+            )
+        else:
+            self.now_trade_codes = None
         # 清除之前的 cl_datas 、klines 缓存，重新计算
         self.cache_cl_datas = {}
         self.cache_klines = {}
@@ -158,6 +245,7 @@ class BackTestKlines(MarketDatas):
 
     def get_cl_data(self, code, frequency, cl_config: dict = None) -> ICL:
         _time = time.time()
+        _frame = profiler.start("get_cl_data", code)
         try:
             # 根据回测配置，可自定义不同周期所使用的缠论配置项
             if cl_config is None:
@@ -183,8 +271,8 @@ class BackTestKlines(MarketDatas):
             if key not in self.cl_datas.keys():
                 # 第一次进行计算
                 klines = self.klines(code, frequency)
-                self.cl_datas[key] = cl.CL(code, frequency, cl_config).process_klines(
-                    klines
+                self.cl_datas[key] = self._new_cl_data(
+                    code, frequency, cl_config, klines
                 )
             else:
                 # 更新计算
@@ -202,7 +290,9 @@ class BackTestKlines(MarketDatas):
 
                 if len(klines) > 0:
                     if len(cd.get_klines()) == 0:
-                        self.cl_datas[key].process_klines(klines)
+                        self.cl_datas[key] = self._new_cl_data(
+                            code, frequency, cl_config, klines
+                        )
                     else:
                         # 判断是追加更新还是从新计算
                         cl_end_time = cd.get_klines()[-1].date
@@ -210,9 +300,9 @@ class BackTestKlines(MarketDatas):
                         if cl_end_time > kline_start_time:
                             self.cl_datas[key].process_klines(klines)
                         else:
-                            self.cl_datas[key] = cl.CL(
-                                code, frequency, cl_config
-                            ).process_klines(klines)
+                            self.cl_datas[key] = self._new_cl_data(
+                                code, frequency, cl_config, klines
+                            )
 
             # 回测单次循环周期内，计算过后进行缓存，避免多次计算
             self.cache_cl_datas[key] = self.cl_datas[key]
@@ -228,8 +318,21 @@ class BackTestKlines(MarketDatas):
 
             return self.cache_cl_datas[key]
         finally:
+            profiler.stop(_frame)
             self._use_times["get_cl_data"] += time.time() - _time
 
+    def _new_cl_data(
+        self, code: str, frequency: str, cl_config: dict, klines: pd.DataFrame
+    ) -> ICL:
+        """
+        使用K线数据重新计算缠论数据，开启 share_cl_data 则优先使用磁盘共享的计算结果
+        """
+        if self.share_cl_data and len(klines) > 0:
+            return fdb.get_backtest_cl_data(
+                self.market, code, frequency, cl_config, klines
+            )
+        return cl.CL(code, frequency, cl_config).process_klines(klines)
+
     def klines(self, code, frequency) -> pd.DataFrame:
         if (
             code in self.cache_klines.keys()
@@ -239,43 +342,27 @@ class BackTestKlines(MarketDatas):
             return self.cache_klines[code][frequency]
 
         _time = time.time()
+        _frame = profiler.start("klines", code)
         klines = {}
         if self.load_data_to_cache:
             # 使用缓存
             for _f in self.frequencys:
-                key = "%s-%s" % (code, _f)
-                if key not in self.all_klines.keys():
-                    # 从数据库获取日期区间的所有行情
-                    all_klines = self.ex.klines(
-                        code,
-                        _f,
-                        start_date=self._cal_start_date_by_frequency(
-                            self.start_date, _f
-                        ),
-                        end_date=fun.datetime_to_str(self.end_date),
-                        args={"limit": None},
-                    )
-                    self.all_klines[key] = all_klines.sort_values("date").reset_index(
-                        drop=True
-                    )
+                self._get_all_klines(code, _f)
 
+            # 后对其的，不能包含当前日期
+            side = "left" if self.market in ["currency", "futures", "us"] else "right"
+            now_value = pd.Timestamp(self.now_date).value
             for _f in self.frequencys:
                 key = "%s-%s" % (code, _f)
-                if self.market in [
-                    "currency",
-                    "futures",
-                    "us",
-                ]:  # 后对其的，不能包含当前日期
-                    kline = self.all_klines[key][
-                        self.all_klines[key]["date"] < self.now_date
-                    ][-self.load_kline_nums : :]
-                else:
-                    kline = self.all_klines[key][
-                        self.all_klines[key]["date"] <= self.now_date
-                    ][-self.load_kline_nums : :]
+                # 数据已按时间排序，二分查找当前时间的位置，只截取需要的K线
+                end = int(
+                    np.searchsorted(self.all_klines_dates[key], now_value, side=side)
+                )
+                start = max(end - self.load_kline_nums, 0)
+                kline = self.all_klines[key].iloc[start:end]
                 if self.del_volume_zero and len(kline) > 0:
                     kline = kline[kline["volume"] != 0]
-                kline = kline.sort_values("date").reset_index(drop=True)
+                kline = kline.reset_index(drop=True)
                 klines[_f] = kline
         else:
             # 使用数据库按需查询
@@ -290,6 +377,7 @@ class BackTestKlines(MarketDatas):
                     klines[_f] = klines[_f][klines[_f]["volume"] != 0]
                 klines[_f].sort_values("date", inplace=True)
 
+        profiler.stop(_frame)
         self._use_times["klines"] += time.time() - _time
 
         # 转换周期k线，去除未来数据
@@ -310,15 +398,123 @@ class BackTestKlines(MarketDatas):
         self.cache_klines[code] = klines
         return klines[frequency]
 
+    def _get_all_klines(self, code: str, frequency: str) -> pd.DataFrame:
+        """
+        获取缓存中代码周期的所有K线，没有则查询并缓存
+        """
+        key = "%s-%s" % (code, frequency)
+        if key not in self.all_klines.keys():
+            self.all_klines[key] = self._query_all_klines(code, frequency)
+            self.all_klines_dates[key] = pd.DatetimeIndex(
+                self.all_klines[key]["date"]
+            ).asi8
+        return self.all_klines[key]
+
+    def _query_all_klines(self, code: str, frequency: str) -> pd.DataFrame:
+        """
+        获取日期区间的所有行情（包括回测开始前用于计算的数据），按时间排序
+        有共享数据的直接读取，否则从数据库获取
+        """
+        klines = self._load_shared_klines(code, frequency)
+        if klines is not None:
+            return klines
+        with profiler.stage("query_db_klines", code):
+            klines = self.ex.klines(
+                code,
+                frequency,
+                start_date=self._cal_start_date_by_frequency(self.start_date, frequency),
+                end_date=fun.datetime_to_str(self.end_date),
+                args={"limit": None},
+            )
+        return klines.sort_values("date").reset_index(drop=True)
+
+    def save_shared_klines(self, codes: List[str], path: Union[str, pathlib.Path]):
+        """
+        将代码各个周期回测所需的所有K线，保存到目录中的 npy 文件，用于多进程回测时共享数据
+
+        每个代码周期保存时间（UTC 时间的 ns 整数）与 开高低收量 两个数组，以及记录列名与时区的 manifest.json
+        子进程设置 shared_klines_path 后，以只读的内存映射方式读取，不需要再查询数据库，多个进程共用系统的文件缓存
+        """
+        path = pathlib.Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        manifest = {}
+        for code in codes:
+            for _f in self.frequencys:
+                key = "%s-%s" % (code, _f)
+                klines = self._query_all_klines(code, _f)
+                dates = pd.DatetimeIndex(klines["date"])
+                columns = [
+                    c
+                    for c in ["open", "high", "low", "close", "volume", "position"]
+                    if c in klines.columns
+                ]
+                file = hashlib.md5(key.encode(encoding="UTF-8")).hexdigest()
+                np.save(path / f"{file}_dates.npy", dates.asi8)
+                np.save(
+                    path / f"{file}_values.npy",
+                    klines[columns].to_numpy(dtype=np.float64),
+                )
+                manifest[key] = {
+                    "file": file,
+                    "columns": columns,
+                    "rows": len(klines),
+                    "tz": None if dates.tz is None else str(dates.tz),
+                }
+        with open(path / "manifest.json", "w", encoding="utf-8") as fp:
+            json.dump(manifest, fp)
+        return path
+
+    def _load_shared_klines(self, code: str, frequency: str) -> Union[pd.DataFrame, None]:
+        """
+        从共享数据中读取K线，没有设置共享目录或者没有对应数据的返回 None
+        """
+        if self.shared_klines_path is None:
+            return None
+        path = pathlib.Path(self.shared_klines_path)
+        if self._shared_manifest is None:
+            with open(path / "manifest.json", "r", encoding="utf-8") as fp:
+                self._shared_manifest = json.load(fp)
+        info = self._shared_manifest.get("%s-%s" % (code, frequency))
+        if info is None:
+            return None
+
+        # 空数组无法进行内存映射
+        mmap_mode = "r" if info["rows"] > 0 else None
+        dates = np.load(path / f'{info["file"]}_dates.npy', mmap_mode=mmap_mode)
+        values = np.load(path / f'{info["file"]}_values.npy', mmap_mode=mmap_mode)
+        # 数值列直接使用映射的数组，不进行复制
+        klines = pd.DataFrame(values, columns=info["columns"], copy=False)
+        dates = pd.DatetimeIndex(np.asarray(dates).view("M8[ns]"))
+        if info["tz"] is not None:
+            dates = dates.tz_localize("UTC").tz_convert(info["tz"])
+        klines.insert(0, "date", dates)
+        klines.insert(0, "code", code)
+        return klines
+
     def convert_klines(self, code: str, klines: Dict[str, pd.DataFrame]):
         """
         转换 kline，去除未来的 kline数据
         :return:
         """
         _time = time.time()
+        _frame = profiler.start("convert_klines", code)
         for i in range(len(self.frequencys), 1, -1):
             min_f = self.frequencys[i - 1]
             max_f = self.frequencys[i - 2]
+            merge_kline = self._merge_last_kline(code, min_f, max_f, klines[min_f])
+            if merge_kline is not None:
+                if len(klines[max_f]) > 0:
+                    # 去除合成中及之后的大周期K线，用合成的K线代替
+                    cut = np.searchsorted(
+                        pd.DatetimeIndex(klines[max_f]["date"]).asi8,
+                        merge_kline["date"].iloc[0].value,
+                    )
+                    klines[max_f] = pd.concat(
+                        [klines[max_f].iloc[:cut], merge_kline], ignore_index=True
+                    )
+                continue
+
+            # 无法增量合成的，使用周期转换方法重新计算
             new_kline = self.ex.convert_kline_frequency(klines[min_f][-120::], max_f)
             if new_kline is None:
                 continue
@@ -343,9 +539,139 @@ class BackTestKlines(MarketDatas):
                         f"{code} K线数据异常，有大于最后时间的数据存在 {_last_dt}"
                     )
 
+        profiler.stop(_frame)
         self._use_times["convert_klines"] += time.time() - _time
         return klines
 
+    def _get_bucket_dates(self, code: str, min_f: str, max_f: str) -> Union[np.ndarray, None]:
+        """
+        计算小周期每根K线所属的大周期K线时间（UTC 时间的 ns 整数），不属于任何大周期K线的为 -1
+
+        使用行情对象的周期转换方法（各个市场的交易时间规则），对全部的小周期数据转换一次
+        转换前将开盘价与收盘价替换为K线的位置，转换后的开盘价与收盘价就是每根大周期K线包含的第一根与最后一根小周期K线位置
+        无法计算的返回 None
+        """
+        key = "%s-%s-%s" % (code, min_f, max_f)
+        if key in self.bucket_dates.keys():
+            return self.bucket_dates[key]
+
+        min_klines = self.all_klines["%s-%s" % (code, min_f)]
+        bucket_dates = None
+        try:
+            probe = min_klines.copy()
+            positions = np.arange(len(probe), dtype=np.float64)
+            for col in ["open", "close", "high", "low"]:
+                probe[col] = positions
+            period_klines = self.ex.convert_kline_frequency(probe, max_f)
+            if period_klines is not None and len(period_klines) > 0:
+                bucket_dates = np.full(len(min_klines), -1, dtype=np.int64)
+                starts = period_klines["open"].to_numpy(dtype=np.int64)
+                ends = period_klines["close"].to_numpy(dtype=np.int64)
+                dates = pd.DatetimeIndex(period_klines["date"]).asi8
+                # 每根大周期K线包含的小周期K线必须是连续不重叠的
+                if np.all(starts <= ends) and np.all(starts[1:] > ends[:-1]):
+                    for _s, _e, _d in zip(starts, ends, dates):
+                        bucket_dates[_s : _e + 1] = _d
+                    if self.market in ["currency", "currency_spot"] and max_f != "d":
+                        # 数字货币的周期转换会去除成交量为 0 的K线
+                        bucket_dates[min_klines["volume"].to_numpy() == 0] = -1
+                else:
+                    bucket_dates = None
+        except Exception:
+            bucket_dates = None
+
+        self.bucket_dates[key] = bucket_dates
+        return bucket_dates
+
+    def _merge_last_kline(
+        self, code: str, min_f: str, max_f: str, min_klines: pd.DataFrame
+    ) -> Union[pd.DataFrame, None]:
+        """
+        根据小周期的最后一根K线，增量合成大周期正在进行中的K线
+
+        保存合成中的大周期K线状态（之前K线的合并结果 + 最后一根K线），小周期新增K线或最后一根K线有变化，只需要合并一次
+        小周期K线不连续、或找不到所属的大周期K线，根据小周期K线重新合成；无法增量合成的返回 None
+        """
+        if (
+            self.load_data_to_cache is False
+            or len(min_klines) == 0
+            or "%s-%s" % (code, min_f) not in self.all_klines.keys()
+        ):
+            return None
+        bucket_dates = self._get_bucket_dates(code, min_f, max_f)
+        if bucket_dates is None:
+            return None
+        all_dates = self.all_klines_dates["%s-%s" % (code, min_f)]
+
+        def find_buckets(dates: np.ndarray) -> np.ndarray:
+            # 查找K线所属的大周期K线时间，找不到的为 -1
+            pos = np.minimum(np.searchsorted(all_dates, dates), len(all_dates) - 1)
+            return np.where(all_dates[pos] == dates, bucket_dates[pos], -1)
+
+        cols = ["open", "high", "low", "close", "volume"]
+        if "position" in min_klines.columns:
+            cols.append("position")
+
+        def merge(pre: Union[list, None], k: list) -> list:
+            if pre is None:
+                return k
+            merged = [pre[0], max(pre[1], k[1]), min(pre[2], k[2]), k[3], pre[4] + k[4]]
+            return merged + k[5:]
+
+        last_date = min_klines["date"].iat[-1].value
+        last_k = [float(min_klines[c].iat[-1]) for c in cols]
+        bucket = int(find_buckets(np.array([last_date]))[0])
+        if bucket < 0:
+            return None
+
+        state_key = "%s-%s" % (code, max_f)
+        state = self.merge_states.get(state_key)
+        pre_date = min_klines["date"].iat[-2].value if len(min_klines) >= 2 else None
+        if state is not None and state["last_date"] == last_date:
+            # 最后一根K线有更新
+            state["last_k"] = last_k
+        elif (
+            state is not None
+            and pre_date == state["last_date"]
+            and last_date > state["last_date"]
+        ):
+            # 新增一根K线，之前的最后一根合并到之前K线中
+            if bucket != state["bucket"]:
+                state["pre_k"] = None
+            elif find_buckets(np.array([pre_date]))[0] == bucket:
+                prev_k = [float(min_klines[c].iat[-2]) for c in cols]
+                state["pre_k"] = merge(state["pre_k"], prev_k)
+            state["bucket"] = bucket
+            state["last_date"] = last_date
+            state["last_k"] = last_k
+        else:
+            # 重新合成，找到与最后一根K线属于同一根大周期K线的小周期K线
+            buckets = find_buckets(pd.DatetimeIndex(min_klines["date"]).asi8)
+            not_same = np.flatnonzero((buckets != bucket) & (buckets != -1))
+            start = not_same[-1] + 1 if len(not_same) > 0 else 0
+            same = buckets[start:-1] == bucket
+            pre_k = None
+            for k in (
+                min_klines[cols].iloc[start:-1][same].to_numpy(dtype=np.float64).tolist()
+            ):
+                pre_k = merge(pre_k, k)
+            state = {
+                "bucket": bucket,
+                "pre_k": pre_k,
+                "last_date": last_date,
+                "last_k": last_k,
+            }
+            self.merge_states[state_key] = state
+
+        k = merge(state["pre_k"], state["last_k"])
+        tz = min_klines["date"].dt.tz
+        date = pd.Timestamp(state["bucket"])
+        if tz is not None:
+            date = date.tz_localize("UTC").tz_convert(tz)
+        merge_kline = {"code": code, "date": date}
+        merge_kline.update(dict(zip(cols, k)))
+        return pd.DataFrame({c: [v] for c, v in merge_kline.items()})
+
     def _cal_start_date_by_frequency(self, start_date: datetime, frequency) -> str:
         """
         按照周期，计算行情获取的开始时间
@@ -1,13 +1,16 @@
 import copy
 import datetime
 import time
-from typing import Dict, List, Tuple
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
 
 from chanlun import fun
 from chanlun.backtesting import futures_contracts
 from chanlun.backtesting.base import POSITION, MarketDatas, Operation, Strategy, Trader
 from chanlun.db import db
 from chanlun.file_db import fdb
+from chanlun.profiler import profiler
 
 
 class BackTestTrader(Trader):
@@ -81,6 +84,10 @@ class BackTestTrader(Trader):
             "position_record": 0,
         }
 
+        # 持仓表，持仓数据的数组，用于批量计算持仓盈亏，持仓有变动（version 不一致）时重新生成
+        self._positions_table: Union[dict, None] = None
+        self._positions_version = 0
+
         # TODO 期货合约信息
         # https://www.jiaoyixingqiu.com/shouxufei
         # http://www.hongyuanqh.com/download/20241213/%E4%BF%9D%E8%AF%81%E9%87%91%E6%A0%87%E5%87%8620241213.pdf
@@ -267,6 +274,7 @@ class BackTestTrader(Trader):
         self.hold_profit_history = save_infos["hold_profit_history"]
         self.balance_history = save_infos["balance_history"]
         self.orders = save_infos["orders"]
+        self.positions_changed()
 
         return True
 
@@ -328,9 +336,11 @@ class BackTestTrader(Trader):
             if pos.code != code or pos.amount == 0:
                 continue
             _time = time.time()
+            _frame = profiler.start("strategy_close")
             opts = self.strategy.close(
                 code=code, mmd=pos.mmd, pos=pos, market_data=self.datas
             )
+            profiler.stop(_frame)
             self.add_times("strategy_close", time.time() - _time)
 
             if opts is False or opts is None:
@@ -356,7 +366,9 @@ class BackTestTrader(Trader):
         ]  # 只获取有持仓的记录
 
         _time = time.time()
+        _frame = profiler.start("strategy_open")
         opts = self.strategy.open(code=code, market_data=self.datas, poss=poss)
+        profiler.stop(_frame)
         self.add_times("strategy_open", time.time() - _time)
 
         for opt in opts:
@@ -399,20 +411,149 @@ class BackTestTrader(Trader):
                 )
         return True
 
+    def positions_changed(self):
+        """
+        持仓有变动（开平仓、加载持仓等），下次更新持仓盈亏时重新生成持仓表
+        修改持仓对象的属性（POSITION.table_fields）会自动重新生成，
+        不通过 execute 直接增加或删除 self.positions 中的持仓，需要调用此方法
+        """
+        self._positions_version += 1
+        return True
+
+    def _get_positions_table(self) -> Union[dict, None]:
+        """
+        获取当前持仓的持仓表（持仓数据的数组），持仓没有变动时复用之前生成的持仓表
+        没有持仓返回 None
+        """
+        if (
+            self._positions_table is not None
+            and self._positions_table["version"]
+            == (self._positions_version, POSITION.fields_version)
+        ):
+            return self._positions_table
+
+        poss = [_p for _p in self.positions.values() if _p.amount != 0]
+        if len(poss) == 0:
+            self._positions_table = None
+            return None
+        codes = list(dict.fromkeys([_p.code for _p in poss]))
+        code_idx = {_c: _i for _i, _c in enumerate(codes)}
+        margin_rates = np.ones(len(codes))
+        symbol_sizes = np.ones(len(codes))
+        if self.market == "futures":
+            for _i, _c in enumerate(codes):
+                margin_rates[_i] = self.futures_contracts[_c]["margin_rate_long"]
+                symbol_sizes[_i] = self.futures_contracts[_c]["symbol_size"]
+        idx = np.array([code_idx[_p.code] for _p in poss], dtype=np.int64)
+        self._positions_table = {
+            "version": (self._positions_version, POSITION.fields_version),
+            "positions": poss,
+            "codes": codes,
+            "code_idx": idx,
+            "is_long": np.array([_p.type == "做多" for _p in poss]),
+            "is_short": np.array([_p.type == "做空" for _p in poss]),
+            "is_buy_mmd": np.array(["buy" in _p.mmd for _p in poss]),
+            "price": np.array([_p.price for _p in poss], dtype=np.float64),
+            "amount": np.array([_p.amount for _p in poss], dtype=np.float64),
+            "balance": np.array([_p.balance for _p in poss], dtype=np.float64),
+            "release_balance": np.array(
+                [_p.release_balance for _p in poss], dtype=np.float64
+            ),
+            "margin_rate": margin_rates[idx],
+            "symbol_size": symbol_sizes[idx],
+            "max_profit_rate": np.array(
+                [_p.max_profit_rate for _p in poss], dtype=np.float64
+            ),
+            "max_loss_rate": np.array(
+                [_p.max_loss_rate for _p in poss], dtype=np.float64
+            ),
+        }
+        return self._positions_table
+
     def update_position_record(self):
         """
         更新所有持仓的盈亏情况
+
+        持仓数据按照持仓表（数组）进行批量计算，每个代码只获取一次价格，
+        最大盈利与最大亏损比例有变化的，同步更新到持仓对象中
         """
+        s_time = time.time()
+        _frame = profiler.start("position_record")
         record_dt = self.get_now_datetime().strftime(self.record_dt_format)
 
         total_hold_profit = 0
         total_hold_balance = 0
-        for _uid, pos in self.positions.items():
-            if pos.amount == 0:
-                continue
-            now_profit, hold_balance = self.position_record(pos)
-            total_hold_profit += now_profit
-            total_hold_balance += hold_balance
+        code_balances = None
+        table = self._get_positions_table()
+        if table is not None:
+            prices = [self.get_price(_c) for _c in table["codes"]]
+            idx = table["code_idx"]
+            close = np.array([_p["close"] for _p in prices], dtype=np.float64)[idx]
+            high = np.array([_p["high"] for _p in prices], dtype=np.float64)[idx]
+            low = np.array([_p["low"] for _p in prices], dtype=np.float64)[idx]
+
+            is_long = table["is_long"]
+            is_short = table["is_short"]
+            price = table["price"]
+            amount = table["amount"]
+            margin_rate = table["margin_rate"]
+
+            # 计算盈亏，做多 (现价 - 开仓价) * 数量，做空 (开仓价 - 现价) * 数量，期货再乘以合约乘数
+            direction = np.where(is_long, 1.0, np.where(is_short, -1.0, 0.0))
+            now_profit = direction * (close - price) * amount * table["symbol_size"]
+            # 最大最小盈利百分比，改为单独是价格的百分比（期货按照保证金计算），开仓价为 0 的不计算
+            has_price = price != 0
+            rate_price = np.where(has_price, price, 1.0)
+            high_profit_rate = np.round(
+                np.where(is_long, high - price, price - low)
+                / rate_price
+                / margin_rate
+                * 100,
+                4,
+            )
+            low_profit_rate = np.round(
+                np.where(is_long, low - price, price - high)
+                / rate_price
+                / margin_rate
+                * 100,
+                4,
+            )
+            has_type = (is_long | is_short) & has_price
+            max_profit_rate = np.where(
+                has_type,
+                np.maximum(table["max_profit_rate"], high_profit_rate),
+                table["max_profit_rate"],
+            )
+            max_loss_rate = np.where(
+                has_type,
+                np.minimum(table["max_loss_rate"], low_profit_rate),
+                table["max_loss_rate"],
+            )
+            # 持仓表已同步更新，不通过 __setattr__ 写入，避免持仓表被重新生成
+            poss = table["positions"]
+            for _i in np.flatnonzero(max_profit_rate != table["max_profit_rate"]):
+                object.__setattr__(
+                    poss[_i], "max_profit_rate", float(max_profit_rate[_i])
+                )
+            for _i in np.flatnonzero(max_loss_rate != table["max_loss_rate"]):
+                object.__setattr__(poss[_i], "max_loss_rate", float(max_loss_rate[_i]))
+            table["max_profit_rate"] = max_profit_rate
+            table["max_loss_rate"] = max_loss_rate
+
+            total_hold_profit = float(now_profit.sum())
+            total_hold_balance = float(table["balance"].sum())
+
+            # 持仓金额，做多为持仓市值，做空为负的持仓市值，期货为占用的保证金
+            if self.market == "futures":
+                hold_balances = table["balance"] - table["release_balance"]
+            else:
+                hold_balances = np.where(table["is_buy_mmd"], 1.0, -1.0) * amount * close
+            code_balances = np.bincount(
+                idx, weights=hold_balances, minlength=len(table["codes"])
+            )
+
+        profiler.stop(_frame)
+        self.add_times("position_record", time.time() - s_time)
 
         # 只有在交易模式下，才记录
         if self.mode != "trade":
@@ -423,21 +564,9 @@ class BackTestTrader(Trader):
 
         # 记录当前的持仓金额
         position_balance = {}
-        for _uid, pos in self.positions.items():
-            if pos.amount == 0:
-                continue
-            code_price = self.get_price(pos.code)
-            if "buy" in pos.mmd:
-                code_balance = pos.amount * code_price["close"]
-                if self.market == "futures":
-                    code_balance = pos.balance - pos.release_balance
-            else:
-                code_balance = -(pos.amount * code_price["close"])
-                if self.market == "futures":
-                    code_balance = pos.balance - pos.release_balance
-            if pos.code not in position_balance.keys():
-                position_balance[pos.code] = 0
-            position_balance[pos.code] += code_balance
+        if code_balances is not None:
+            for _c, _b in zip(table["codes"], code_balances):
+                position_balance[_c] = float(_b)
         position_balance["Cash"] = self.balance
 
         self.balance_history[record_dt] = (
@@ -749,6 +878,7 @@ class BackTestTrader(Trader):
     # 执行操作
     def execute(self, code, opt: Operation, pos: POSITION = None):
         _time = time.time()
+        _frame = profiler.start("execute", code)
         try:
             # 如果是交易模式，将 close_uid 都修改为 clear ，使用 strategy 类中的 allow_close_uid 进行控制
             if self.mode != "signal":
@@ -1249,6 +1379,8 @@ class BackTestTrader(Trader):
 
             return False
         finally:
+            self.positions_changed()
+            profiler.stop(_frame)
             self.add_times("execute", time.time() - _time)
 
     def order_draw_tv_mark(
@@ -18,6 +18,28 @@ class POSITION:
     持仓对象
     """
 
+    # 回测持仓表（批量计算持仓盈亏）使用的属性，修改这些属性会增加 fields_version，持仓表据此判断是否需要重新生成
+    table_fields = frozenset(
+        [
+            "code",
+            "mmd",
+            "type",
+            "balance",
+            "release_balance",
+            "price",
+            "amount",
+            "max_profit_rate",
+            "max_loss_rate",
+        ]
+    )
+    # 所有持仓对象 table_fields 属性的修改次数
+    fields_version = 0
+
+    def __setattr__(self, name, value):
+        if name in POSITION.table_fields:
+            POSITION.fields_version += 1
+        object.__setattr__(self, name, value)
+
     def __init__(
         self,
         code: str,
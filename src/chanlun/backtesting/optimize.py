@@ -1,8 +1,10 @@
 """
 策略参数优化
 """
+import math
+import random
 from itertools import product
-from typing import List
+from typing import Callable, Dict, List, Union
 
 
 class OptimizationSetting:
@@ -32,3 +34,272 @@ class OptimizationSetting:
             settings.append(setting)
 
         return settings
+
+    def total_num(self) -> int:
+        """
+        参数组合的总数量
+        """
+        return math.prod(len(_v) for _v in self.cl_config_params.values())
+
+    def random_cl_settings(self, num: int, rng: random.Random = None) -> List[dict]:
+        """
+        随机抽取 num 个不重复的参数组合（不生成全部的组合，参数多的时候也不会占用大量内存）
+        """
+        rng = rng or random.Random()
+        total = self.total_num()
+        if num >= total:
+            settings = self.generate_cl_settings()
+            rng.shuffle(settings)
+            return settings
+        return [self._setting_by_index(_i) for _i in rng.sample(range(total), num)]
+
+    def random_value(self, name: str, rng: random.Random = None):
+        """
+        随机获取参数的一个可选值
+        """
+        rng = rng or random.Random()
+        return rng.choice(self.cl_config_params[name])
+
+    def _setting_by_index(self, index: int) -> dict:
+        """
+        按照组合的序号（与 generate_cl_settings 的顺序一致），获取参数组合
+        """
+        setting = {}
+        for name, values in reversed(list(self.cl_config_params.items())):
+            index, _i = divmod(index, len(values))
+            setting[name] = values[_i]
+        return {_k: setting[_k] for _k in self.cl_config_params.keys()}
+
+
+# 回测评估方法：传入参数组合列表与回测周期比例（只回测最近的一部分时间，1 为全部回测时间），返回每个参数组合的回测结果
+# 回测结果格式：{"end_balance": 评价指标值, "params": 参数组合, "save_file": 落地文件}
+EvaluateFun = Callable[[List[dict], float], List[dict]]
+
+
+def setting_key(setting: dict) -> str:
+    """
+    参数组合的唯一标识
+    """
+    return str(sorted(setting.items(), key=lambda _s: _s[0]))
+
+
+class SearchStrategy:
+    """
+    参数搜索策略基类，search 方法返回全部回测时间下的回测结果
+    """
+
+    def search(
+        self, setting: OptimizationSetting, evaluate_fun: EvaluateFun
+    ) -> List[dict]:
+        raise NotImplementedError
+
+    def __str__(self):
+        return self.__class__.__name__
+
+
+class GridSearch(SearchStrategy):
+    """
+    穷举搜索，回测所有的参数组合
+    """
+
+    def search(
+        self, setting: OptimizationSetting, evaluate_fun: EvaluateFun
+    ) -> List[dict]:
+        return evaluate_fun(setting.generate_cl_settings(), 1.0)
+
+
+class RandomSearch(SearchStrategy):
+    """
+    随机搜索，随机抽取 num 个参数组合，按照 batch_size 分批回测
+    设置 patience 后，连续 patience 批次最优结果没有提升，则提前结束
+    """
+
+    def __init__(
+        self,
+        num: int,
+        batch_size: int = None,
+        patience: int = None,
+        seed: int = None,
+    ):
+        self.num = num
+        self.batch_size = batch_size or num
+        self.patience = patience
+        self.rng = random.Random(seed)
+
+    def search(
+        self, setting: OptimizationSetting, evaluate_fun: EvaluateFun
+    ) -> List[dict]:
+        cl_settings = setting.random_cl_settings(self.num, self.rng)
+        results = []
+        best = None
+        no_improve = 0
+        for _i in range(0, len(cl_settings), self.batch_size):
+            batch_results = evaluate_fun(cl_settings[_i : _i + self.batch_size], 1.0)
+            results += batch_results
+            batch_best = max(_r["end_balance"] for _r in batch_results)
+            if best is None or batch_best > best:
+                best = batch_best
+                no_improve = 0
+            else:
+                no_improve += 1
+            if self.patience is not None and no_improve >= self.patience:
+                break
+        return results
+
+
+class SuccessiveHalving(SearchStrategy):
+    """
+    逐次减半搜索，先用最近 min_fidelity 比例的回测时间回测所有候选参数，
+    每轮保留最好的 1/eta 参数组合，并将回测时间扩大 eta 倍，直到回测全部时间
+    num 为候选参数组合数量，None 则使用全部参数组合
+    """
+
+    def __init__(
+        self,
+        num: int = None,
+        min_fidelity: float = 0.25,
+        eta: int = 3,
+        seed: int = None,
+    ):
+        if not 0 < min_fidelity <= 1:
+            raise Exception(f"min_fidelity 需要在 (0, 1] 之间：{min_fidelity}")
+        if eta < 2:
+            raise Exception(f"eta 需要大于等于 2：{eta}")
+        self.num = num
+        self.min_fidelity = min_fidelity
+        self.eta = eta
+        self.rng = random.Random(seed)
+
+    def search(
+        self, setting: OptimizationSetting, evaluate_fun: EvaluateFun
+    ) -> List[dict]:
+        if self.num is None:
+            cl_settings = setting.generate_cl_settings()
+        else:
+            cl_settings = setting.random_cl_settings(self.num, self.rng)
+        fidelity = self.min_fidelity
+        while True:
+            results = evaluate_fun(cl_settings, fidelity)
+            if fidelity >= 1 or len(cl_settings) <= 1:
+                break
+            results.sort(reverse=True, key=lambda _r: _r["end_balance"])
+            keep_num = max(1, math.ceil(len(results) / self.eta))
+            cl_settings = [_r["params"] for _r in results[:keep_num]]
+            fidelity = min(1.0, fidelity * self.eta)
+        if fidelity < 1:
+            results = evaluate_fun(cl_settings, 1.0)
+        return results
+
+
+class GeneticSearch(SearchStrategy):
+    """
+    遗传算法搜索，每代种群通过 锦标赛选择、均匀交叉、随机变异 生成下一代，保留 elite 个最优参数组合
+    连续 patience 代最优结果没有提升，则提前结束
+    fidelity 为每代回测时间的比例，小于 1 时，最后会将最优的 top_num 个参数组合用全部回测时间再回测一次
+    """
+
+    def __init__(
+        self,
+        population: int = 20,
+        generations: int = 10,
+        mutation_rate: float = 0.2,
+        elite: int = 2,
+        patience: int = 3,
+        fidelity: float = 1.0,
+        top_num: int = 5,
+        seed: int = None,
+    ):
+        self.population = population
+        self.generations = generations
+        self.mutation_rate = mutation_rate
+        self.elite = elite
+        self.patience = patience
+        self.fidelity = fidelity
+        self.top_num = top_num
+        self.rng = random.Random(seed)
+
+    def search(
+        self, setting: OptimizationSetting, evaluate_fun: EvaluateFun
+    ) -> List[dict]:
+        # 已经回测过的参数组合结果，避免重复回测
+        evaluated: Dict[str, dict] = {}
+        population = setting.random_cl_settings(self.population, self.rng)
+        best = None
+        no_improve = 0
+        for _g in range(self.generations):
+            new_settings = [_s for _s in population if setting_key(_s) not in evaluated]
+            for _r in evaluate_fun(new_settings, self.fidelity):
+                evaluated[setting_key(_r["params"])] = _r
+            scored = sorted(
+                [evaluated[setting_key(_s)] for _s in population],
+                reverse=True,
+                key=lambda _r: _r["end_balance"],
+            )
+            if best is None or scored[0]["end_balance"] > best:
+                best = scored[0]["end_balance"]
+                no_improve = 0
+            else:
+                no_improve += 1
+            if no_improve >= self.patience or len(evaluated) >= setting.total_num():
+                break
+            population = self._next_population(setting, scored)
+
+        results = sorted(
+            evaluated.values(), reverse=True, key=lambda _r: _r["end_balance"]
+        )
+        if self.fidelity < 1:
+            results = evaluate_fun(
+                [_r["params"] for _r in results[: self.top_num]], 1.0
+            )
+        return results
+
+    def _next_population(
+        self, setting: OptimizationSetting, scored: List[dict]
+    ) -> List[dict]:
+        """
+        根据当前种群的回测结果，生成下一代种群
+        """
+        next_population = [_r["params"] for _r in scored[: self.elite]]
+        keys = set(setting_key(_s) for _s in next_population)
+        # 防止参数空间较小时，无法生成足够多不重复的参数组合
+        max_try = self.population * 10
+        while len(next_population) < self.population and max_try > 0:
+            max_try -= 1
+            father = self._tournament(scored)
+            mother = self._tournament(scored)
+            child = {
+                _k: (father[_k] if self.rng.random() < 0.5 else mother[_k])
+                for _k in father.keys()
+            }
+            for _k in child.keys():
+                if self.rng.random() < self.mutation_rate:
+                    child[_k] = setting.random_value(_k, self.rng)
+            if setting_key(child) in keys:
+                continue
+            keys.add(setting_key(child))
+            next_population.append(child)
+        return next_population
+
+    def _tournament(self, scored: List[dict], size: int = 3) -> dict:
+        """
+        锦标赛选择，随机抽取 size 个参数组合，返回其中结果最好的
+        """
+        candidates = self.rng.sample(scored, min(size, len(scored)))
+        return max(candidates, key=lambda _r: _r["end_balance"])["params"]
+
+
+def get_search_strategy(search: Union[str, SearchStrategy, None]) -> SearchStrategy:
+    """
+    获取参数搜索策略，支持传入策略对象，或者名称 grid / random / halving / genetic（使用默认参数，random 默认抽取 100 个）
+    """
+    if isinstance(search, SearchStrategy):
+        return search
+    if search is None or search == "grid":
+        return GridSearch()
+    if search == "random":
+        return RandomSearch(100)
+    if search == "halving":
+        return SuccessiveHalving()
+    if search == "genetic":
+        return GeneticSearch()
+    raise Exception(f"不支持的参数搜索策略：{search}")
@@ -2,6 +2,7 @@
 import datetime
 import math
 from abc import ABCMeta, abstractmethod
+from collections.abc import Sequence
 from dataclasses import dataclass
 from enum import Enum
 from typing import Dict, List, Tuple, Union
@@ -88,6 +89,8 @@ class Kline:
     原始K线对象
     """
 
+    __slots__ = ("index", "date", "h", "l", "o", "c", "a")
+
     def __init__(
         self,
         index: int,
@@ -110,11 +113,191 @@ class Kline:
         return f"index: {self.index} date: {self.date} h: {self.h} l: {self.l} o: {self.o} c:{self.c} a:{self.a}"
 
 
+class KlineStore(Sequence):
+    """
+    原始K线的列式存储
+
+    时间（ns 整数）与 高、低、开、收、量 分别保存在 numpy 数组中，按索引访问时返回 Kline 对象
+    返回的 Kline 对象只是当时数据的快照，修改其属性不会影响存储中的数据，需要更新数据使用 update 方法
+    """
+
+    __slots__ = ("_dates", "_values", "_size", "tz")
+
+    # 数据列，与 Kline 对象属性对应
+    columns = ("h", "l", "o", "c", "a")
+
+    def __init__(self):
+        self._dates: np.ndarray = np.empty(0, dtype=np.int64)
+        self._values: np.ndarray = np.empty((0, len(self.columns)), dtype=np.float64)
+        self._size: int = 0
+        self.tz = None  # K线时间的时区，None 表示无时区
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[Kline, List[Kline]]:
+        if isinstance(i, slice):
+            return self._to_klines(*i.indices(self._size))
+        if i < 0:
+            i += self._size
+        if i < 0 or i >= self._size:
+            raise IndexError("KlineStore index out of range")
+        h, l, o, c, a = self._values[i].tolist()
+        return Kline(
+            index=i, date=self._to_date(self._dates[i]), h=h, l=l, o=o, c=c, a=a
+        )
+
+    def __iter__(self):
+        # 分批转换，避免一次创建过多对象
+        for start in range(0, self._size, 5000):
+            yield from self._to_klines(start, min(start + 5000, self._size), 1)
+
+    def __getstate__(self):
+        return {
+            "dates": self._dates[: self._size].copy(),
+            "values": self._values[: self._size].copy(),
+            "tz": self.tz,
+        }
+
+    def __setstate__(self, state):
+        self._dates = state["dates"]
+        self._values = state["values"]
+        self._size = len(self._dates)
+        self.tz = state["tz"]
+
+    def _to_date(self, value) -> pd.Timestamp:
+        return pd.Timestamp(int(value), tz=self.tz)
+
+    def _to_klines(self, start: int, stop: int, step: int) -> List[Kline]:
+        indexs = range(start, stop, step)
+        if len(indexs) == 0:
+            return []
+        dates = pd.DatetimeIndex(self._dates[start:stop:step].view("M8[ns]"))
+        if self.tz is not None:
+            dates = dates.tz_localize("UTC").tz_convert(self.tz)
+        return [
+            Kline(index=i, date=d, h=h, l=l, o=o, c=c, a=a)
+            for i, d, (h, l, o, c, a) in zip(
+                indexs, dates, self._values[start:stop:step].tolist()
+            )
+        ]
+
+    def extend(self, dates: pd.DatetimeIndex, values: np.ndarray):
+        """
+        追加K线数据
+
+        :param dates: K线时间
+        :param values: K线数据数组，列依次为 h l o c a
+        """
+        n = len(dates)
+        if n == 0:
+            return
+        if self._size == 0:
+            self.tz = dates.tz
+        need = self._size + n
+        if need > len(self._dates):
+            # 按倍数扩容，减少追加时的内存复制
+            capacity = max(need, len(self._dates) * 2, 64)
+            new_dates = np.empty(capacity, dtype=np.int64)
+            new_dates[: self._size] = self._dates[: self._size]
+            new_values = np.empty((capacity, len(self.columns)), dtype=np.float64)
+            new_values[: self._size] = self._values[: self._size]
+            self._dates, self._values = new_dates, new_values
+        self._dates[self._size : need] = dates.as_unit("ns").asi8
+        self._values[self._size : need] = values
+        self._size = need
+
+    def update(self, i: int, values: np.ndarray):
+        """
+        更新指定索引的K线数据（h l o c a）
+        """
+        if i < 0:
+            i += self._size
+        if not self._values.flags.writeable:
+            # 从快照文件映射的只读数据，更新前先复制
+            self._values = self._values.copy()
+        self._values[i] = values
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        获取指定列的数据数组（h l o c a），返回的是只读视图
+        """
+        col = self._values[: self._size, self.columns.index(name)]
+        col.flags.writeable = False
+        return col
+
+    def date_values(self) -> np.ndarray:
+        """
+        获取K线时间的 ns 整数数组（有时区的为 UTC 时间），返回的是只读视图
+        """
+        dates = self._dates[: self._size]
+        dates.flags.writeable = False
+        return dates
+
+    @staticmethod
+    def frame_arrays(klines: pd.DataFrame) -> Tuple[pd.DatetimeIndex, np.ndarray]:
+        """
+        将K线 DataFrame 转换为时间与数据数组（列依次为 h l o c a），与 extend 的参数一致
+        """
+        dates = pd.DatetimeIndex(pd.to_datetime(klines["date"]))
+        values = klines[["high", "low", "open", "close", "volume"]].to_numpy(
+            dtype=np.float64
+        )
+        return dates, values
+
+    def first_diff(self, dates: pd.DatetimeIndex, values: np.ndarray) -> int:
+        """
+        与给定的K线比较重叠部分的时间与数据，返回第一根有差异的K线索引，没有差异返回K线数量
+
+        给定K线的开始时间，在已有K线中的位置作为比较的起点，已有K线中找不到开始时间的（更早或之间有断档），返回对应位置
+        """
+        if self._size == 0 or len(dates) == 0:
+            return 0
+        cd_dates = self._dates[: self._size]
+        dates_ns = dates.as_unit("ns").asi8
+        start = int(np.searchsorted(cd_dates, dates_ns[0]))
+        if start >= self._size or cd_dates[start] != dates_ns[0]:
+            return start
+        n = min(self._size - start, len(dates_ns))
+        diff = (cd_dates[start : start + n] != dates_ns[:n]) | (
+            self._values[start : start + n] != values[:n]
+        ).any(axis=1)
+        diff_indexs = np.flatnonzero(diff)
+        if len(diff_indexs) > 0:
+            return start + int(diff_indexs[0])
+        return start + n
+
+    def index_of(self, date: datetime.datetime) -> int:
+        """
+        二分查找时间对应的K线索引，不存在返回 -1
+        """
+        value = pd.Timestamp(date).as_unit("ns").value
+        i = int(np.searchsorted(self._dates[: self._size], value))
+        if i < self._size and self._dates[i] == value:
+            return i
+        return -1
+
+
 class CLKline:
     """
     缠论K线对象
     """
 
+    __slots__ = (
+        "k_index",
+        "date",
+        "h",
+        "l",
+        "o",
+        "c",
+        "a",
+        "klines",
+        "index",
+        "n",
+        "q",
+        "up_qs",
+    )
+
     def __init__(
         self,
         k_index: int,
@@ -153,6 +336,8 @@ class FX:
     分型对象
     """
 
+    __slots__ = ("type", "k", "klines", "val", "index", "done")
+
     def __init__(
         self,
         _type: str,
@@ -294,6 +479,8 @@ class LINE:
     线的基本定义，笔和线段继承此对象
     """
 
+    __slots__ = ("start", "end", "high", "low", "zs_high", "zs_low", "type", "index")
+
     def __init__(self, start: FX, end: FX, _type: str, index: int):
         self.start: FX = start  # 线的起始位置，以分型来记录
         self.end: FX = end  # 线的结束位置，以分型来记录
@@ -351,6 +538,23 @@ class ZS:
     中枢对象（笔中枢，线段中枢）
     """
 
+    __slots__ = (
+        "zs_type",
+        "start",
+        "lines",
+        "end",
+        "zg",
+        "zd",
+        "gg",
+        "dd",
+        "type",
+        "index",
+        "line_num",
+        "level",
+        "done",
+        "real",
+    )
+
     def __init__(
         self,
         zs_type: str,
@@ -480,6 +684,15 @@ class BI(LINE):
     笔对象
     """
 
+    __slots__ = (
+        "mmds",
+        "bcs",
+        "default_zs_type",
+        "zs_type_mmds",
+        "zs_type_bcs",
+        "is_split",
+    )
+
     def __init__(
         self,
         start: FX,
@@ -744,6 +957,23 @@ class XD(LINE):
     线段对象
     """
 
+    __slots__ = (
+        "start_line",
+        "end_line",
+        "mmds",
+        "bcs",
+        "ding_fx",
+        "di_fx",
+        "tzxls",
+        "done",
+        "is_split",
+        "default_zs_type",
+        "zs_type_mmds",
+        "zs_type_bcs",
+        "not_del",
+        "not_yx",
+    )
+
     def __init__(
         self,
         start: FX,
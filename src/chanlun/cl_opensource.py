@@ -2,7 +2,8 @@ import datetime
 from typing import List, Union, Dict, Tuple
 import pandas as pd
 import numpy as np
-from chanlun.cl_interface import ICL, Kline, CLKline, FX, BI, XD, ZS, LINE, MACD_INFOS, Config
+from chanlun.cl_interface import ICL, Kline, KlineStore, CLKline, FX, BI, XD, ZS, LINE, MACD_INFOS, Config
+from chanlun.profiler import profiler
 
 try:
     from czsc import CZSC
@@ -19,6 +20,12 @@ class CL(ICL):
     Open Source Chanlun Implementation using CZSC
     """
 
+    # 常见的K线列名，统一转换为 date open close high low volume
+    _rename_columns = {
+        'datetime': 'date', 'time': 'date',
+        'Open': 'open', 'Close': 'close', 'High': 'high', 'Low': 'low', 'Volume': 'volume'
+    }
+
     def __init__(
         self,
         code: str,
@@ -31,7 +38,7 @@ class CL(ICL):
         self.config = config if config else {}
         self.start_datetime = start_datetime
         
-        self._klines: List[Kline] = []
+        self._klines: KlineStore = KlineStore()
         self._cl_klines: List[CLKline] = []
         self._fxs: List[FX] = []
         self._bis: List[BI] = []
@@ -40,76 +47,157 @@ class CL(ICL):
         
         self._czsc = None
         self._idx = {"macd": {"dif": [], "dea": [], "hist": []}}
+        # MACD 快慢线最后两根K线的 EMA 值（size 为计算时的K线数量），增量计算时从上次的结果延续
+        self._macd_ema: Dict[str, Union[int, list]] = {"size": 0, "fast": [], "slow": []}
+        # 已转换的 CZSC 对象缓存，增量计算时未变化的对象直接复用
+        self._czsc_objs: Dict[str, dict] = {"fx": {}, "bi": {}, "xd": {}, "zs": {}}
 
     def process_klines(self, klines: pd.DataFrame):
         """
         计算k线缠论数据
+
+        可增量多次调用，已计算过的K线会跳过，最后一根K线会进行更新，只有新增的K线才会送入 CZSC 计算
+        如果给定的K线与已计算的K线无法衔接（有断档或回退），则清空重新全量计算
+        已计算的K线只追加不删除，给定的是滑动窗口K线（前面的K线移出）时，移出的K线依然保留，
+        需要控制内存的调用方，在K线数量超出窗口后自行创建新对象重新计算（参考 web 缓存与回测的处理）
         """
         if CZSC is None:
             raise Exception("CZSC library not installed")
 
-        # 转换 K 线数据
-        raw_bars = []
-        self._klines = []
-        
         # 确保 DataFrame 列名正确
         if 'date' not in klines.columns:
             # 尝试重命名常见列名
-            klines = klines.rename(columns={
-                'datetime': 'date', 'time': 'date',
-                'Open': 'open', 'Close': 'close', 'High': 'high', 'Low': 'low', 'Volume': 'volume'
-            })
-
-        for i, row in klines.iterrows():
-            dt = pd.to_datetime(row['date'])
-            # 构建原始 Kline 对象
-            k = Kline(
-                index=i,
-                date=dt,
-                h=float(row['high']),
-                l=float(row['low']),
-                o=float(row['open']),
-                c=float(row['close']),
-                a=float(row['volume'])
-            )
-            self._klines.append(k)
+            klines = klines.rename(columns=self._rename_columns)
+
+        if len(klines) == 0:
+            return self
+
+        # 日期与 OHLCV 数据一次性转换为数组，避免逐行处理
+        dates, values = KlineStore.frame_arrays(klines)
+
+        start_pos = self._find_append_pos(dates, values)
+        if start_pos is None:
+            # 无法增量更新，全量重新计算
+            self._reset()
+            start_pos = 0
+        elif start_pos >= len(klines):
+            # 没有需要更新的K线
+            return self
+
+        _frame = profiler.start("cl_bars")
+        raw_bars = self._append_klines(dates[start_pos:], values[start_pos:])
+        profiler.stop(_frame)
+
+        # CZSC 计算分型与笔
+        _frame = profiler.start("cl_czsc")
+        if self._czsc is None:
+            # 初始化 CZSC
+            # 注意：CZSC 的初始化可能需要根据版本调整
+            self._czsc = CZSC(raw_bars)
+        else:
+            # 增量更新，时间相同的 bar 会由 CZSC 替换最后一根
+            for bar in raw_bars:
+                self._czsc.update(bar)
+        profiler.stop(_frame)
+
+        # 转换计算结果到 Chanlun-Pro 的数据结构
+        self._convert_czsc_data()
 
-            # 构建 CZSC RawBar
-            bar = RawBar(
+        # 计算 MACD 指标，只计算新增或更新的K线
+        _frame = profiler.start("cl_macd")
+        self._calculate_macd(len(self._klines) - len(raw_bars))
+        profiler.stop(_frame)
+
+        return self
+
+    def _append_klines(self, dates: pd.DatetimeIndex, values: np.ndarray) -> list:
+        """
+        将K线数组追加到原始K线存储中，并返回需要送入 CZSC 计算的 RawBar 列表
+        时间相同的K线只保留最后一根，与已有最后一根K线时间相同的，更新最后一根K线
+
+        :param dates: K线时间
+        :param values: K线数据数组，列依次为 high low open close volume
+        """
+        # 时间相同的K线只保留最后一根，一次性计算，避免逐行比较时间
+        dates_ns = dates.as_unit("ns").asi8
+        keep = np.ones(len(dates), dtype=bool)
+        keep[:-1] = dates_ns[:-1] != dates_ns[1:]
+        dates, values, dates_ns = dates[keep], values[keep], dates_ns[keep]
+
+        start_index = len(self._klines)
+        if start_index > 0 and len(dates) > 0 and dates_ns[0] == self._klines.date_values()[-1]:
+            # 更新最后一根K线
+            start_index -= 1
+            self._klines.update(-1, values[0])
+            self._klines.extend(dates[1:], values[1:])
+        else:
+            self._klines.extend(dates, values)
+
+        # 构建 CZSC RawBar
+        return [
+            RawBar(
                 symbol=self.code,
                 dt=dt,
-                id=i,
+                id=start_index + i,
                 freq=self.frequency,
-                open=k.o,
-                close=k.c,
-                high=k.h,
-                low=k.l,
-                vol=k.a,
+                open=o,
+                close=c,
+                high=h,
+                low=l,
+                vol=a,
                 amount=0
             )
-            raw_bars.append(bar)
+            for i, (dt, (h, l, o, c, a)) in enumerate(zip(dates, values.tolist()))
+        ]
 
-        # 初始化 CZSC
-        # 注意：CZSC 的初始化可能需要根据版本调整
-        self._czsc = CZSC(raw_bars)
-        
-        # 转换计算结果到 Chanlun-Pro 的数据结构
-        self._convert_czsc_data()
-        
-        # 计算 MACD 指标 (简单实现，或者使用 TA-Lib)
-        self._calculate_macd()
+    def _reset(self):
+        """
+        清空已计算的数据
+        """
+        self._klines = KlineStore()
+        self._cl_klines = []
+        self._fxs = []
+        self._bis = []
+        self._xds = []
+        self._zss = []
+        self._czsc = None
+        self._idx = {"macd": {"dif": [], "dea": [], "hist": []}}
+        self._macd_ema = {"size": 0, "fast": [], "slow": []}
+        self._czsc_objs = {"fx": {}, "bi": {}, "xd": {}, "zs": {}}
 
-    def _convert_czsc_data(self):
+    def _find_append_pos(self, dates: pd.DatetimeIndex, values: np.ndarray) -> Union[int, None]:
         """
-        将 CZSC 的对象转换为 ICL 接口定义的对象
+        查找给定K线中需要开始更新的位置（已计算的最后一根K线所在的位置）
+        返回 None 表示无法衔接，需要全量计算
         """
-        # 辅助函数：根据时间查找 K 线索引
-        date_to_index = {k.date: i for i, k in enumerate(self._klines)}
+        if self._czsc is None or len(self._klines) == 0:
+            return None
+        if str(dates.tz) != str(self._klines.tz):
+            # 时区不一致，无法比较
+            return None
+        cd_dates = self._klines.date_values()
+        dates_ns = dates.as_unit("ns").asi8
+        pos = int(np.searchsorted(dates_ns, cd_dates[-1]))
+        if pos >= len(dates_ns) or dates_ns[pos] != cd_dates[-1]:
+            # 给定的K线中没有已计算的最后一根K线，有断档
+            return None
+        if pos > 0 and len(cd_dates) >= 2 and dates_ns[pos - 1] != cd_dates[-2]:
+            # 前一根K线不一致，数据有变化
+            return None
+        # 最后一根K线没有变化，跳过
+        last_k = self._klines[-1]
+        if values[pos].tolist() == [last_k.h, last_k.l, last_k.o, last_k.c, last_k.a]:
+            pos += 1
+        return pos
 
-        def get_k_by_date(date):
-            idx = date_to_index.get(date)
-            return self._klines[idx] if idx is not None else None
+    def _convert_czsc_data(self):
+        """
+        将 CZSC 的对象转换为 ICL 接口定义的对象
 
+        按照 CZSC 对象的关键属性生成 key，之前已经转换过并且没有变化的对象直接复用，
+        增量更新时只有尾部新增或变化的对象才会重新创建
+        笔、线段、中枢的起止分型与笔，通过 key 的映射表直接查找，转换的耗时与对象数量成线性关系
+        """
         def create_cl_kline(k_index, date, h, l, o, c, a):
             # 创建一个简单的 CLKline，不包含合并细节
             return CLKline(
@@ -120,125 +208,231 @@ class CL(ICL):
                 index=0, _n=1, _q=False
             )
 
+        def fx_key(c_fx):
+            return c_fx.dt, c_fx.mark.value, c_fx.high, c_fx.low
+
+        def bi_key(c_bi):
+            return fx_key(c_bi.fx_a), fx_key(c_bi.fx_b)
+
+        def line_key(start_key, end_key, c_line):
+            return start_key, end_key, c_line.direction.value, c_line.high, c_line.low
+
+        def reusable(obj):
+            # 复用的对象，起止分型必须在本次的分型列表中
+            if obj is None:
+                return False
+            return all(
+                fx.index < len(self._fxs) and self._fxs[fx.index] is fx
+                for fx in (obj.start, obj.end)
+            )
+
+        old_objs = self._czsc_objs
+        new_objs = {"fx": {}, "bi": {}, "xd": {}, "zs": {}}
+        # CZSC 分型 key -> ICL 分型对象
+        fx_map: Dict[tuple, FX] = new_objs["fx"]
+        # CZSC 笔 key -> ICL 笔对象
+        bi_map: Dict[tuple, BI] = {}
+
         # 1. 转换分型 (FX)
+        _frame = profiler.start("cl_fx")
         self._fxs = []
         # CZSC 的 fx_list 存储在 analyzer 对象中，通常是 czsc.fx_list
         # 假设 czsc 是 CZSC 实例
         if hasattr(self._czsc, 'fx_list'):
             for i, c_fx in enumerate(self._czsc.fx_list):
-                # c_fx 属性: dt, high, low, mark (d/g)
-                k_index = date_to_index.get(c_fx.dt, 0)
-                cl_kline = create_cl_kline(k_index, c_fx.dt, c_fx.high, c_fx.low, c_fx.high, c_fx.low, 0)
-                
-                fx_type = "ding" if c_fx.mark.value == "g" else "di"
-                
-                fx = FX(
-                    _type=fx_type,
-                    k=cl_kline,
-                    klines=[cl_kline], # 简化处理
-                    val=c_fx.high if fx_type == "ding" else c_fx.low,
-                    index=i,
-                    done=True
-                )
+                key = fx_key(c_fx)
+                fx = old_objs["fx"].get(key)
+                if fx is None:
+                    # c_fx 属性: dt, high, low, mark (d/g)
+                    k_index = max(self._klines.index_of(c_fx.dt), 0)
+                    cl_kline = create_cl_kline(k_index, c_fx.dt, c_fx.high, c_fx.low, c_fx.high, c_fx.low, 0)
+
+                    fx_type = "ding" if c_fx.mark.value == "g" else "di"
+
+                    fx = FX(
+                        _type=fx_type,
+                        k=cl_kline,
+                        klines=[cl_kline], # 简化处理
+                        val=c_fx.high if fx_type == "ding" else c_fx.low,
+                        index=i,
+                        done=True
+                    )
+                fx.index = i
+                fx_map[key] = fx
                 self._fxs.append(fx)
 
+        profiler.stop(_frame)
+
         # 2. 转换笔 (BI)
+        _frame = profiler.start("cl_bi")
         self._bis = []
         if hasattr(self._czsc, 'bi_list'):
-            for i, c_bi in enumerate(self._czsc.bi_list):
+            for c_bi in self._czsc.bi_list:
                 # c_bi 属性: fx_a, fx_b, high, low, direction
-                # 查找对应的 FX 对象
-                start_fx = next((f for f in self._fxs if f.k.date == c_bi.fx_a.dt), None)
-                end_fx = next((f for f in self._fxs if f.k.date == c_bi.fx_b.dt), None)
-                
-                if start_fx and end_fx:
+                # 查找对应的 FX 对象，起止分型不在分型列表中的笔忽略
+                start_fx = fx_map.get(fx_key(c_bi.fx_a))
+                end_fx = fx_map.get(fx_key(c_bi.fx_b))
+                if start_fx is None or end_fx is None:
+                    continue
+
+                key = line_key(fx_key(c_bi.fx_a), fx_key(c_bi.fx_b), c_bi)
+                bi = old_objs["bi"].get(key)
+                if not reusable(bi):
                     bi_type = "up" if c_bi.direction.value == "up" else "down"
                     bi = BI(
                         start=start_fx,
                         end=end_fx,
                         _type=bi_type,
-                        index=i
+                        index=len(self._bis)
                     )
                     bi.high = c_bi.high
                     bi.low = c_bi.low
-                    self._bis.append(bi)
+                bi.index = len(self._bis)
+                new_objs["bi"][key] = bi
+                bi_map[bi_key(c_bi)] = bi
+                self._bis.append(bi)
+
+        profiler.stop(_frame)
 
         # 3. 转换线段 (XD)
+        _frame = profiler.start("cl_xd")
         self._xds = []
         if hasattr(self._czsc, 'xd_list'):
-             for i, c_xd in enumerate(self._czsc.xd_list):
+            for c_xd in self._czsc.xd_list:
                 # c_xd 属性: start_bi, end_bi, high, low, direction
-                # 这里的 start/end 是笔，我们需要找到对应的分型
-                # 假设 c_xd.start_bi 是笔对象，我们取它的 start_fx
                 # 注意：CZSC 的线段定义可能与 Chanlun-Pro 略有不同，这里做近似映射
-                
-                # 尝试通过时间匹配笔
-                start_bi_dt = c_xd.start_bi.fx_a.dt
-                end_bi_dt = c_xd.end_bi.fx_b.dt
-                
-                # 在 self._bis 中找到对应的笔（可选，用于设置 start_line/end_line）
-                # 这里简化，直接找分型
-                start_fx = next((f for f in self._fxs if f.k.date == start_bi_dt), None)
-                end_fx = next((f for f in self._fxs if f.k.date == end_bi_dt), None)
-
-                if start_fx and end_fx:
+                # 线段的起止笔，起始分型取起始笔的开始，结束分型取结束笔的结束
+                start_line = bi_map.get(bi_key(c_xd.start_bi))
+                end_line = bi_map.get(bi_key(c_xd.end_bi))
+                if start_line is None or end_line is None:
+                    continue
+
+                key = line_key(bi_key(c_xd.start_bi), bi_key(c_xd.end_bi), c_xd)
+                xd = old_objs["xd"].get(key)
+                if not reusable(xd):
                     xd_type = "up" if c_xd.direction.value == "up" else "down"
-                    # 创建一个虚拟的 start_line (BI)
-                    start_line = BI(start=start_fx, end=start_fx, _type="up", index=0) # 占位
-
                     xd = XD(
-                        start=start_fx,
-                        end=end_fx,
-                        start_line=start_line, # 必填
+                        start=start_line.start,
+                        end=end_line.end,
+                        start_line=start_line,
+                        end_line=end_line,
                         _type=xd_type,
-                        index=i
+                        index=len(self._xds)
                     )
                     xd.high = c_xd.high
                     xd.low = c_xd.low
-                    self._xds.append(xd)
+                xd.index = len(self._xds)
+                new_objs["xd"][key] = xd
+                self._xds.append(xd)
+
+        profiler.stop(_frame)
 
         # 4. 转换中枢 (ZS)
+        _frame = profiler.start("cl_zs")
         self._zss = []
         # CZSC 可能没有直接的 zs_list，或者叫其他名字，如 bi_zs_list
         # 假设有 bi_zs_list (笔中枢)
         if hasattr(self._czsc, 'bi_zs_list'):
-            for i, c_zs in enumerate(self._czsc.bi_zs_list):
+            for c_zs in self._czsc.bi_zs_list:
                 # c_zs 属性: start_bi, end_bi, zg, zd, gg, dd
-                start_dt = c_zs.start_bi.fx_a.dt
-                end_dt = c_zs.end_bi.fx_b.dt
-                
-                start_fx = next((f for f in self._fxs if f.k.date == start_dt), None)
-                end_fx = next((f for f in self._fxs if f.k.date == end_dt), None)
-                
-                if start_fx and end_fx:
+                start_bi = bi_map.get(bi_key(c_zs.start_bi))
+                end_bi = bi_map.get(bi_key(c_zs.end_bi))
+                if start_bi is None or end_bi is None:
+                    continue
+
+                key = (bi_key(c_zs.start_bi), bi_key(c_zs.end_bi), c_zs.zg, c_zs.zd, c_zs.gg, c_zs.dd)
+                zs = old_objs["zs"].get(key)
+                if not reusable(zs):
                     zs = ZS(
                         zs_type="bi",
-                        start=start_fx,
-                        end=end_fx,
+                        start=start_bi.start,
+                        end=end_bi.end,
                         zg=c_zs.zg,
                         zd=c_zs.zd,
                         gg=c_zs.gg,
                         dd=c_zs.dd,
                         _type="zd", # 默认为震荡
-                        index=i
+                        index=len(self._zss)
                     )
-                    self._zss.append(zs)
-
-    def _calculate_macd(self):
+                    # 中枢包含的笔
+                    for _bi in self._bis[start_bi.index : end_bi.index + 1]:
+                        zs.add_line(_bi)
+                    zs.line_num = len(zs.lines)
+                zs.index = len(self._zss)
+                new_objs["zs"][key] = zs
+                self._zss.append(zs)
+        profiler.stop(_frame)
+
+        self._czsc_objs = new_objs
+
+    def _calculate_macd(self, start_index: int = 0):
         """
         计算 MACD
+
+        参数使用配置中的 idx_macd_fast / idx_macd_slow / idx_macd_signal，EMA 初始值与 TA-Lib 一致（前 N 个值的简单平均）
+        start_index 之前的K线没有变化，从 start_index 开始延续上次的 EMA 结果计算，无法延续的则全量重新计算
+        """
+        fast = int(self.config.get("idx_macd_fast", 12))
+        slow = int(self.config.get("idx_macd_slow", 26))
+        signal = int(self.config.get("idx_macd_signal", 9))
+        # dif 与 dea 开始有值的位置
+        dif_start = max(fast, slow) - 1
+        dea_start = dif_start + signal - 1
+
+        close = self._klines.column("c")
+        macd = self._idx["macd"]
+        ema = self._macd_ema
+        # 前一根K线的 EMA 值在保存的最后两个值中的位置，不在其中的无法延续
+        prev = start_index - ema["size"] + 1
+        if dea_start < start_index and 0 <= prev < len(ema["fast"]):
+            # 增量计算，以前一根K线的 EMA 值为初始值
+            fast_ema = self._ema(close[start_index:], fast, ema["fast"][prev])
+            slow_ema = self._ema(close[start_index:], slow, ema["slow"][prev])
+            dif = fast_ema - slow_ema
+            dea = self._ema(dif, signal, macd["dea"][start_index - 1])
+        else:
+            start_index = 0
+            prev = -1
+            fast_ema = self._ema_seed(close, fast, dif_start)
+            slow_ema = self._ema_seed(close, slow, dif_start)
+            dif = fast_ema - slow_ema
+            dea = self._ema_seed(dif, signal, dea_start)
+            # 与 TA-Lib 保持一致，dea 没有值之前 dif 也不输出
+            dif[:dea_start] = np.nan
+
+        hist = (dif - dea) * 2
+        for name, vals in (("fast", fast_ema), ("slow", slow_ema)):
+            ema[name] = (ema[name][: prev + 1] + vals[-2:].tolist())[-2:]
+        ema["size"] = len(close)
+        for name, vals in (("dif", dif), ("dea", dea), ("hist", hist)):
+            del macd[name][start_index:]
+            macd[name].extend(vals.tolist())
+
+    @staticmethod
+    def _ema(values: np.ndarray, period: int, prev: float) -> np.ndarray:
+        """
+        以 prev 为前一个 EMA 值，计算 values 的 EMA
+        """
+        if len(values) == 0:
+            return np.empty(0, dtype=np.float64)
+        return (
+            pd.Series(np.concatenate(([prev], values)))
+            .ewm(alpha=2 / (period + 1), adjust=False)
+            .mean()
+            .to_numpy()[1:]
+        )
+
+    @classmethod
+    def _ema_seed(cls, values: np.ndarray, period: int, start: int) -> np.ndarray:
+        """
+        从 start 位置开始计算 values 的 EMA，start 位置的值为之前 period 个值的简单平均，之前的位置为 nan
         """
-        try:
-            import talib
-            close = np.array([k.c for k in self._klines])
-            dif, dea, hist = talib.MACD(close, fastperiod=12, slowperiod=26, signalperiod=9)
-            # talib 的 hist 通常是 (dif-dea)*2，有些库是 dif-dea
-            self._idx["macd"]["dif"] = dif.tolist()
-            self._idx["macd"]["dea"] = dea.tolist()
-            self._idx["macd"]["hist"] = (hist * 2).tolist() # 调整倍数以匹配
-        except ImportError:
-            # 手动计算 MACD
-            pass
+        result = np.full(len(values), np.nan)
+        if len(values) <= start:
+            return result
+        result[start] = values[start - period + 1 : start + 1].mean()
+        result[start + 1 :] = cls._ema(values[start + 1 :], period, result[start])
+        return result
 
     def get_code(self) -> str:
         return self.code
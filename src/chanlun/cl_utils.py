@@ -1,3 +1,4 @@
+import contextlib
 import math
 from typing import Dict, List, Tuple, Union
 
@@ -8,7 +9,7 @@ from chanlun import fun
 from chanlun.cl_interface import BI, FX, ICL, LINE, MACD_INFOS, ZS, Config, Kline
 from chanlun.db import db
 from chanlun.exchange import exchange
-from chanlun.file_db import FileCacheDB
+from chanlun.file_db import fdb
 
 
 def web_batch_get_cl_datas(
@@ -22,14 +23,35 @@ def web_batch_get_cl_datas(
     :param klines: 计算的 k线 数据，每个周期对应一个 k线DataFrame，例如 ：{'30m': klines_30m, '5m': klines_5m}
     :param cl_config: 缠论配置
     :return: 返回计算好的缠论数据对象，List 列表格式，按照传入的 klines.keys 顺序返回 如上调用：[0] 返回 30m 周期数据 [1] 返回 5m 数据
+
+    返回的是缓存对象的副本，只在当前代码中立即使用的，使用 web_batch_cl_datas 避免复制
     """
     cls = []
-    fdb = FileCacheDB()
     for f, k in klines.items():
         cls.append(fdb.get_web_cl_data(market, code, f, cl_config, k))
     return cls
 
 
+@contextlib.contextmanager
+def web_batch_cl_datas(
+    market: str, code: str, klines: Dict[str, pd.DataFrame], cl_config: dict = None
+):
+    """
+    WEB端批量计算并获取 缠论 数据，与 web_batch_get_cl_datas 相同，但是返回的是内存中共享的缓存对象（不复制）
+    对象只能在 with 中使用，离开 with 后会被其他请求更新（见 FileCacheDB.web_cl_data）
+        with web_batch_cl_datas(market, code, {'30m': klines_30m, '5m': klines_5m}, cl_config) as cds:
+            ...
+    """
+    cds = {}
+    with contextlib.ExitStack() as stack:
+        # 按照周期排序后依次获取对象的锁，多个线程同时获取相同的周期不会互相等待形成死锁
+        for f in sorted(klines.keys()):
+            cds[f] = stack.enter_context(
+                fdb.web_cl_data(market, code, f, cl_config, klines[f])
+            )
+        yield [cds[f] for f in klines.keys()]
+
+
 def cal_klines_macd_infos(start_k: Kline, end_k: Kline, cd: ICL) -> MACD_INFOS:
     """
     计算线中macd信息
@@ -15,10 +15,13 @@ from sqlalchemy import (
     Text,
     UniqueConstraint,
     create_engine,
+    event,
     func,
     inspect,
+    select,
 )
 from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import declarative_base, sessionmaker
 
 from sqlalchemy.pool import QueuePool
@@ -227,6 +230,17 @@ class DB(object):
                 max_overflow=20,
                 pool_timeout=10,
             )
+
+            @event.listens_for(self.engine, "connect")
+            def set_sqlite_pragma(dbapi_connection, connection_record):
+                # WAL 模式读写不互相阻塞，批量写入时减少同步落盘的次数
+                cursor = dbapi_connection.cursor()
+                cursor.execute("PRAGMA journal_mode=WAL")
+                cursor.execute("PRAGMA synchronous=NORMAL")
+                cursor.execute("PRAGMA temp_store=MEMORY")
+                cursor.execute("PRAGMA cache_size=-65536")
+                cursor.close()
+
         elif config.DB_TYPE == "mysql":
             self.engine = create_engine(
                 f"mysql+pymysql://{config.DB_USER}:{config.DB_PWD}@{config.DB_HOST}:{config.DB_PORT}/{config.DB_DATABASE}?charset=utf8mb4",
@@ -372,6 +386,39 @@ class DB(object):
                 query = query.limit(limit)
             return query.all()
 
+    def klines_query_df(
+        self,
+        market: str,
+        code: str,
+        frequency: str,
+        start_date: datetime.datetime = None,
+        end_date: datetime.datetime = None,
+        limit: int = 5000,
+        order: str = "desc",
+    ) -> pd.DataFrame:
+        """
+        获取k线数据，直接查询需要的列并返回 DataFrame，不创建 ORM 对象，参数同 klines_query
+        返回的列：dt o c h l v (期货市场还有 p)，顺序按照 order 参数
+        """
+        table = self.klines_tables(market, code)
+        columns = [table.dt, table.o, table.c, table.h, table.l, table.v]
+        if market == Market.FUTURES.value:
+            columns.append(table.p)
+        query = select(*columns).where(table.code == code, table.f == frequency)
+        if start_date is not None:
+            query = query.where(table.dt >= start_date)
+        if end_date is not None:
+            query = query.where(table.dt <= end_date)
+        if order == "desc":
+            query = query.order_by(table.dt.desc())
+        else:
+            query = query.order_by(table.dt.asc())
+        if limit is not None:
+            query = query.limit(limit)
+        with self.engine.connect() as conn:
+            result = conn.execute(query)
+            return pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+
     def klines_last_datetime(self, market, code, frequency):
         """
         查询k线表中最后一条记录的日期
@@ -409,68 +456,27 @@ class DB(object):
         """
         with self.Session() as session:
             table = self.klines_tables(market, code)
+            in_position = "position" in klines.columns
+            insert_klines = self._klines_to_records(code, frequency, klines)
+            update_keys = ["o", "c", "h", "l", "v"]
+            if in_position:
+                update_keys.append("p")
 
-            # 如果是 sqlite ，则慢慢更新吧
+            # sqlite 使用 INSERT ... ON CONFLICT DO UPDATE，按批次 executemany 写入
             if config.DB_TYPE == "sqlite":
-                for _, _k in klines.iterrows():
-                    _in_k = {
-                        "code": code,
-                        "f": frequency,
-                        "dt": _k["date"].replace(tzinfo=None),  # 去除时区信息
-                        "o": _k["open"],
-                        "c": _k["close"],
-                        "h": _k["high"],
-                        "l": _k["low"],
-                        "v": _k["volume"],
-                    }
-                    if "position" in _k.keys():
-                        _in_k["p"] = _k["position"]
-                    db_k = (
-                        session.query(table)
-                        .filter(
-                            table.code == code,
-                            table.f == frequency,
-                            table.dt == _in_k["dt"],
-                        )
-                        .first()
-                    )
-                    if db_k is None:
-                        session.add(table(**_in_k))
-                    else:
-                        session.query(table).filter(
-                            table.code == code,
-                            table.f == frequency,
-                            table.dt == _in_k["dt"],
-                        ).update(_in_k)
+                insert_stmt = sqlite_insert(table.__table__)
+                upsert_stmt = insert_stmt.on_conflict_do_update(
+                    index_elements=["code", "dt", "f"],
+                    set_={k: insert_stmt.excluded[k] for k in update_keys},
+                )
+                for i in range(0, len(insert_klines), 5000):
+                    session.execute(upsert_stmt, insert_klines[i : i + 5000])
                 session.commit()
                 return True
 
             # 将 klines 数据拆分为每 500 条一组，批量插入
-            group = np.arange(len(klines)) // 500
-            groups = [
-                group.reset_index(drop=True) for _, group in klines.groupby(group)
-            ]
-            in_position = "position" in klines.columns
-            for g_klines in groups:
-                insert_klines = []
-                for _, _k in g_klines.iterrows():
-                    _insert_k = {
-                        "code": code,
-                        "dt": _k["date"].replace(tzinfo=None),  # 去除时区信息
-                        "f": frequency,
-                        "o": _k["open"],
-                        "c": _k["close"],
-                        "h": _k["high"],
-                        "l": _k["low"],
-                        "v": _k["volume"],
-                    }
-                    if in_position:
-                        _insert_k["p"] = _k["position"]
-                    insert_klines.append(_insert_k)
-                insert_stmt = insert(table).values(insert_klines)
-                update_keys = ["o", "c", "h", "l", "v"]
-                if in_position:
-                    update_keys.append("p")
+            for i in range(0, len(insert_klines), 500):
+                insert_stmt = insert(table).values(insert_klines[i : i + 500])
                 update_columns = {
                     x.name: x for x in insert_stmt.inserted if x.name in update_keys
                 }
@@ -480,6 +486,30 @@ class DB(object):
 
         return True
 
+    @staticmethod
+    def _klines_to_records(code: str, frequency: str, klines: pd.DataFrame) -> List[dict]:
+        """
+        将k线 DataFrame 批量转换为数据库记录，日期去除时区信息
+        """
+        dates = pd.to_datetime(klines["date"])
+        if dates.dt.tz is not None:
+            dates = dates.dt.tz_localize(None)  # 去除时区信息
+        records = pd.DataFrame(
+            {
+                "code": code,
+                "dt": dates.to_numpy(),
+                "f": frequency,
+                "o": klines["open"].to_numpy(dtype=np.float64),
+                "c": klines["close"].to_numpy(dtype=np.float64),
+                "h": klines["high"].to_numpy(dtype=np.float64),
+                "l": klines["low"].to_numpy(dtype=np.float64),
+                "v": klines["volume"].to_numpy(dtype=np.float64),
+            }
+        )
+        if "position" in klines.columns:
+            records["p"] = klines["position"].to_numpy(dtype=np.float64)
+        return records.to_dict("records")
+
     def klines_delete(
         self,
         market: str,
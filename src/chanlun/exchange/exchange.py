@@ -149,6 +149,60 @@ class Exchange(ABC):
         """
 
 
+def timestamps_to_dates(values, tz, unit: str = "ms") -> pd.Series:
+    """
+    时间戳（默认毫秒）转换为指定时区的时间
+    相当于 values.apply(lambda x: datetime.datetime.fromtimestamp(x / 1e3).astimezone(tz))
+    """
+    return pd.to_datetime(pd.Series(values), unit=unit, utc=True).dt.tz_convert(tz)
+
+
+def zero_time_mask(dates: pd.Series, check_second: bool = True) -> pd.Series:
+    """
+    时间是否为 0点0分（0秒），日及以上周期的K线时间大多是 0点0分
+    """
+    mask = (dates.dt.hour == 0) & (dates.dt.minute == 0)
+    if check_second:
+        mask &= dates.dt.second == 0
+    return mask
+
+
+def replace_dates(dates: pd.Series, mask: pd.Series = None, **kwargs) -> pd.Series:
+    """
+    替换时间中的 year / month / day / hour / minute / second
+    相当于 dates.apply(lambda _d: _d.replace(**kwargs))，mask 不为空，只替换 mask 为 True 的时间
+    带时区的时间按照当地时间替换，与 datetime.replace 的结果一致
+    替换后是夏令时切换时不存在或者重复的当地时间，tz_localize 无法确定，这些时间使用 replace 逐个替换
+    """
+    fields = ["year", "month", "day", "hour", "minute", "second"]
+    for _k in kwargs.keys():
+        if _k not in fields:
+            raise Exception(f"不支持替换的时间字段：{_k}")
+    if len(dates) == 0:
+        return dates
+
+    tz = dates.dt.tz
+    local = dates.dt.tz_localize(None) if tz is not None else dates
+    parts = pd.DataFrame(
+        {_k: kwargs.get(_k, getattr(local.dt, _k)) for _k in fields},
+        index=local.index,
+    )
+    # 保留秒以下的部分
+    new_dates = pd.to_datetime(parts) + (local - local.dt.floor("s"))
+    if tz is not None:
+        localized = new_dates.dt.tz_localize(tz, ambiguous="NaT", nonexistent="NaT")
+        is_dst_error = localized.isna() & new_dates.notna()
+        if mask is not None:
+            is_dst_error &= mask
+        if is_dst_error.any():
+            fixed = dates[is_dst_error].apply(lambda _d: _d.replace(**kwargs))
+            localized = localized.where(~is_dst_error, fixed)
+        new_dates = localized
+    if mask is not None:
+        new_dates = dates.mask(mask, new_dates)
+    return new_dates
+
+
 def convert_stock_kline_frequency(klines: pd.DataFrame, to_f: str) -> pd.DataFrame:
     """
     转换股票 k 线到指定的周期
@@ -150,7 +150,9 @@ class ExchangeBaostock(Exchange):
             data_list.append(rs.get_row_data())
         kline = pd.DataFrame(data_list, columns=rs.fields)
         kline["date"] = pd.to_datetime(kline["date"])
-        kline["date"] = kline["date"].apply(self.__convert_date)
+        kline["date"] = replace_dates(
+            kline["date"], zero_time_mask(kline["date"]), hour=15, minute=0
+        )
         kline["open"] = pd.to_numeric(kline["open"])
         kline["close"] = pd.to_numeric(kline["close"])
         kline["high"] = pd.to_numeric(kline["high"])
@@ -196,12 +198,6 @@ class ExchangeBaostock(Exchange):
         kline.loc[:, "date"] = kline["date"].dt.tz_localize(self.tz)
         return kline[["code", "date", "open", "close", "high", "low", "volume"]]
 
-    @staticmethod
-    def __convert_date(dt: datetime.datetime):
-        if dt.hour == 0 and dt.minute == 0 and dt.second == 0:
-            return dt.replace(hour=15, minute=0)
-        return dt
-
     def ticks(self, codes: List[str]) -> Dict[str, Tick]:
         """
         获取股票列表的 Tick 信息
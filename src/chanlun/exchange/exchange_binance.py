@@ -8,7 +8,12 @@ from tenacity import retry, retry_if_result, stop_after_attempt, wait_random
 from tzlocal import get_localzone
 
 from chanlun import config, fun
-from chanlun.exchange.exchange import Exchange, Tick, convert_currency_kline_frequency
+from chanlun.exchange.exchange import (
+    Exchange,
+    Tick,
+    convert_currency_kline_frequency,
+    timestamps_to_dates,
+)
 from chanlun.exchange.exchange_db import ExchangeDB
 from chanlun.utils import config_get_proxy
 
@@ -285,9 +290,7 @@ class ExchangeBinance(Exchange):
             all_klines, columns=["date", "open", "high", "low", "close", "volume"]
         )
         kline_pd["code"] = code
-        kline_pd["date"] = kline_pd["date"].apply(
-            lambda x: datetime.datetime.fromtimestamp(x / 1e3).astimezone(self.tz)
-        )
+        kline_pd["date"] = timestamps_to_dates(kline_pd["date"], self.tz)
         kline_pd = kline_pd[["code", "date", "open", "close", "high", "low", "volume"]]
         kline_pd.drop_duplicates(subset=["date"], keep="last", inplace=True)
 
@@ -367,9 +370,7 @@ class ExchangeBinance(Exchange):
         # kline_pd.loc[:, 'code'] = code
         # kline_pd.loc[:, 'date'] = kline_pd['date'].apply(lambda x: datetime.datetime.fromtimestamp(x / 1e3))
         kline_pd["code"] = code
-        kline_pd["date"] = kline_pd["date"].apply(
-            lambda x: datetime.datetime.fromtimestamp(x / 1e3).astimezone(self.tz)
-        )
+        kline_pd["date"] = timestamps_to_dates(kline_pd["date"], self.tz)
         kline_pd = kline_pd[["code", "date", "open", "close", "high", "low", "volume"]]
         # 自定义级别，需要进行转换
         if frequency in ["10m", "2m", "3h"] and len(kline_pd) > 0:
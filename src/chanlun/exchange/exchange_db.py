@@ -15,6 +15,8 @@ from chanlun.exchange.exchange import (
     convert_futures_kline_frequency,
     convert_stock_kline_frequency,
     convert_us_kline_frequency,
+    replace_dates,
+    zero_time_mask,
 )
 
 
@@ -204,59 +206,54 @@ class ExchangeDB(Exchange):
             start_date = fun.str_to_datetime(start_date)
         if end_date is not None:
             end_date = fun.str_to_datetime(end_date)
-        klines = db.klines_query(
+        klines = db.klines_query_df(
             self.market, code, frequency, start_date, end_date, limit, order
         )
-        kline_pd = []
-        for _k in klines:
-            _kline = {
-                "code": _k.code,
-                "date": _k.dt,
-                "open": _k.o,
-                "high": _k.h,
-                "low": _k.l,
-                "close": _k.c,
-                "volume": _k.v,
-            }
-            if self.market == Market.FUTURES.value:
-                _kline["position"] = _k.p
-            kline_pd.append(_kline)
-        if len(kline_pd) == 0:
+        if len(klines) == 0:
             kline_pd = pd.DataFrame(
                 [], columns=["date", "code", "high", "low", "open", "close", "volume"]
             )
             return kline_pd
 
-        kline_pd = pd.DataFrame(kline_pd)
-        kline_pd["code"] = code
-        kline_pd["date"] = pd.to_datetime(kline_pd["date"]).dt.tz_localize(
-            self.tz
-        )  # .map(lambda d: d.to_pydatetime())
-        kline_pd["date"] = kline_pd["date"].apply(self.__convert_date)
+        kline_pd = pd.DataFrame(
+            {
+                "code": code,
+                "date": self.__convert_dates(pd.to_datetime(klines["dt"])),
+                "open": klines["o"],
+                "high": klines["h"],
+                "low": klines["l"],
+                "close": klines["c"],
+                "volume": klines["v"],
+            }
+        )
+        if self.market == Market.FUTURES.value:
+            kline_pd["position"] = klines["p"]
+        kline_pd["date"] = kline_pd["date"].dt.tz_localize(self.tz)
         kline_pd.sort_values(by="date", inplace=True)
         kline_pd = kline_pd.reset_index(drop=True)
 
         return kline_pd
 
-    def __convert_date(self, dt: datetime.datetime):
+    # 各个市场日及以上周期（时间是 0点0分）对应的交易时间
+    day_kline_times = {
+        Market.A.value: (15, 0),
+        Market.HK.value: (16, 0),
+        Market.FUTURES.value: (9, 0),
+        Market.US.value: (9, 30),
+    }
+
+    def __convert_dates(self, dates: pd.Series) -> pd.Series:
         """
-        统一各个市场的时间格式
+        统一各个市场的时间格式（不带时区的时间）
         TODO 需要根据自己数据源的数据格式进行调整
         TODO 将日及以上周期（大多数这类的时间都是 0点0分），修改为交易日结束或开始时间（根据日期是前对其还是后对其来决定是开盘时间还是收盘时间）
         """
-        if self.market == Market.A.value:
-            if dt.hour == 0 and dt.minute == 0:
-                return dt.replace(hour=15, minute=0)
-        if self.market == Market.HK.value:
-            if dt.hour == 0 and dt.minute == 0:
-                return dt.replace(hour=16, minute=0)
-        if self.market == Market.FUTURES.value:
-            if dt.hour == 0 and dt.minute == 0:
-                return dt.replace(hour=9, minute=0)
-        if self.market == Market.US.value:
-            if dt.hour == 0 and dt.minute == 0:
-                return dt.replace(hour=9, minute=30)
-        return dt
+        if self.market not in self.day_kline_times:
+            return dates
+        hour, minute = self.day_kline_times[self.market]
+        return replace_dates(
+            dates, zero_time_mask(dates, check_second=False), hour=hour, minute=minute
+        )
 
     def convert_kline_frequency(self, klines: pd.DataFrame, to_f: str) -> pd.DataFrame:
         """
@@ -179,7 +179,9 @@ class ExchangeFutu(Exchange):
                     autype=args["fq"],
                 )
             kline["date"] = pd.to_datetime(kline["time_key"]).dt.tz_localize(self.tz)
-            kline["date"] = kline["date"].apply(self.__convert_date)
+            kline["date"] = replace_dates(
+                kline["date"], zero_time_mask(kline["date"]), hour=16, minute=0
+            )
             kline = kline[["code", "date", "open", "close", "high", "low", "volume"]]
             if frequency == "120m" and len(kline) > 0:
                 kline = convert_stock_kline_frequency(kline, "120m")
@@ -191,12 +193,6 @@ class ExchangeFutu(Exchange):
 
         return None
 
-    @staticmethod
-    def __convert_date(dt):
-        if dt.hour == 0 and dt.minute == 0 and dt.second == 0:
-            return dt.replace(hour=16, minute=0)
-        return dt
-
     def ticks(self, codes: List[str]) -> Dict[str, Tick]:
         # CTX().subscribe(codes, [SubType.QUOTE], subscribe_push=False)
         ret, data = CTX().get_market_snapshot(codes)
@@ -9,7 +9,13 @@ import pytz
 from tenacity import retry, stop_after_attempt, wait_random, retry_if_result
 
 from chanlun import fun, rd
-from chanlun.exchange.exchange import Exchange, Tick, convert_us_kline_frequency
+from chanlun.exchange.exchange import (
+    Exchange,
+    Tick,
+    convert_us_kline_frequency,
+    replace_dates,
+    zero_time_mask,
+)
 
 ib_res_hkey = "ib_data_results"
 
@@ -165,16 +171,12 @@ class ExchangeIB(Exchange):
         if len(klines_df) == 0:
             return None
 
-        klines_df["date"] = klines_df["date"].apply(self.__convert_date)
+        klines_df["date"] = replace_dates(
+            klines_df["date"], zero_time_mask(klines_df["date"]), hour=9, minute=30
+        )
 
         return klines_df
 
-    @staticmethod
-    def __convert_date(dt: datetime.datetime):
-        if dt.hour == 0 and dt.minute == 0 and dt.second == 0:
-            return dt.replace(hour=9, minute=30)
-        return dt
-
     def ticks(self, codes: List[str]) -> Dict[str, Tick]:
         ticks = {}
         args = {"key": self.uid(), "codes": codes}
@@ -170,9 +170,7 @@ class ExchangePolygon(Exchange):
             klines_df = pd.DataFrame(klines_df)
             klines_df.sort_values("date", inplace=True)
             if frequency in ["y", "q", "m", "w", "d"]:
-                klines_df["date"] = klines_df["date"].apply(
-                    lambda _d: _d.replace(hour=9, minute=30)
-                )
+                klines_df["date"] = replace_dates(klines_df["date"], hour=9, minute=30)
             return klines_df
         except Exception as e:
             print("polygon.io 获取行情异常 %s Exception ：%s" % (code, str(e)))
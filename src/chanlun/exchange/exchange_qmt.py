@@ -7,7 +7,12 @@ import pytz
 from tenacity import retry, retry_if_result, stop_after_attempt, wait_random
 
 from chanlun import fun
-from chanlun.exchange.exchange import Exchange, Tick, convert_stock_kline_frequency
+from chanlun.exchange.exchange import (
+    Exchange,
+    Tick,
+    convert_stock_kline_frequency,
+    replace_dates,
+)
 from xtquant import xtdata
 
 """
@@ -248,7 +253,7 @@ class ExchangeQMT(Exchange):
 
         # 如果日线，小时设置为15点
         if frequency in ["d", "w", "m", "y"]:
-            klines_df["date"] = klines_df["date"].apply(lambda x: x.replace(hour=15))
+            klines_df["date"] = replace_dates(klines_df["date"], hour=15)
 
         # print(f"{code}-{frequency} 获取历史数据转换耗时：{time.time() - s_time}")
 
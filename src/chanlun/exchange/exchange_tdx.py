@@ -1,12 +1,13 @@
-import copy
 import datetime
+import threading
 import traceback
-import warnings
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Union
 
+import numpy as np
 import pandas as pd
 import pytz
-from pytdx.errors import TdxConnectionError
+from pytdx.errors import TdxConnectionError, TdxFunctionCallError
 from pytdx.hq import TdxHq_API
 from tenacity import retry, retry_if_result, stop_after_attempt, wait_random
 
@@ -14,7 +15,12 @@ from chanlun import fun
 from chanlun.base import Market
 from chanlun.config import get_data_path
 from chanlun.db import db
-from chanlun.exchange.exchange import Exchange, Tick, convert_stock_kline_frequency
+from chanlun.exchange.exchange import (
+    Exchange,
+    Tick,
+    convert_stock_kline_frequency,
+    replace_dates,
+)
 from chanlun.exchange.stocks_bkgn import StocksBKGN
 from chanlun.exchange.tdx_a_codes import tdx_codes_by_bj, tdx_codes_by_error
 from chanlun.file_db import FileCacheDB
@@ -29,6 +35,9 @@ class ExchangeTDX(Exchange):
 
     g_all_stocks = []
 
+    # 保存的服务器排序结果的有效时间（秒），后台线程每小时会重新检测并保存
+    best_ips_max_age = 24 * 60 * 60
+
     def __init__(self):
         # super().__init__()
 
@@ -39,6 +48,8 @@ class ExchangeTDX(Exchange):
             if self.connect_info is None:
                 self.connect_info = self.reset_tdx_ip()
                 # print(f"最优服务器：{self.connect_info}")
+            # 后台定时重新选择最优服务器
+            best_ip.start_rerank_thread("stock", callback=self._set_tdx_ip)
         except Exception:
             print(traceback.format_exc())
             print("通达信 沪深行情接口初始化失败，沪深行情不可用")
@@ -49,14 +60,37 @@ class ExchangeTDX(Exchange):
         # 文件缓存
         self.fdb = FileCacheDB()
 
+        # 日志记录
+        self.log = fun.get_logger("exchange_tdx.log")
+
         # 设置时区
         self.tz = pytz.timezone("Asia/Shanghai")
 
+        # 复权使用的除权除息事件，key 为 市场_代码，value 为 (转换日期, 事件数组)
+        self._xdxr_events: Dict[str, tuple] = {}
+
     def reset_tdx_ip(self):
         """
-        重新选择tdx最优ip，并返回
+        重新选择tdx服务器，并返回
+        优先使用保存的服务器排序结果（见 tdx_best_ip.load_best_ips），切换到当前服务器之后延迟最小的服务器
+        没有保存的排序结果，或者保存的服务器都已经切换过，重新检测服务器延迟选择最优服务器
+        """
+        ips = best_ip.load_best_ips("stock", max_age=self.best_ips_max_age)
+        ip_keys = [(_ip["ip"], int(_ip["port"])) for _ip in ips]
+        connect_info = getattr(self, "connect_info", None)
+        index = 0
+        if connect_info is not None:
+            current_key = (connect_info["ip"], int(connect_info["port"]))
+            if current_key in ip_keys:
+                index = ip_keys.index(current_key) + 1
+        if index < len(ips):
+            return self._set_tdx_ip(ips[index])
+        return self._set_tdx_ip(best_ip.select_best_ip("stock"))
+
+    def _set_tdx_ip(self, connect_info: dict):
+        """
+        设置并缓存使用的tdx服务器
         """
-        connect_info = best_ip.select_best_ip("stock")
         connect_info = {"ip": connect_info["ip"], "port": int(connect_info["port"])}
         db.cache_set("tdx_connect_ip", connect_info)
         self.connect_info = connect_info
@@ -172,6 +206,41 @@ class ExchangeTDX(Exchange):
             _type = stock[0]["type"] if stock else None
         return market, code[-6:], _type
 
+    # K线周期对应的通达信周期参数
+    frequency_map = {
+        "y": 11,
+        "m": 6,
+        "w": 9,
+        "d": 9,
+        "120m": 3,
+        "60m": 3,
+        "30m": 2,
+        "15m": 1,
+        "10m": 0,
+        "5m": 0,
+        "2m": 8,
+        "1m": 8,
+    }
+
+    @staticmethod
+    def _klines_args(frequency: str, args: dict = None) -> dict:
+        """
+        获取K线的默认参数
+        """
+        args = {} if args is None else dict(args)
+        if "fq" not in args.keys():
+            args["fq"] = "qfq"
+        if "use_cache" not in args.keys():
+            args["use_cache"] = True
+        if "pages" not in args.keys():
+            args["pages"] = 8
+        else:
+            args["pages"] = int(args["pages"])
+        # 周线数据，使用日线复权后的数据进行合并，所以多请求点数据
+        if frequency == "w":
+            args["pages"] = 12
+        return args
+
     @retry(
         stop=stop_after_attempt(3),
         wait=wait_random(min=1, max=5),
@@ -188,34 +257,7 @@ class ExchangeTDX(Exchange):
         """
         通达信，不支持按照时间查找
         """
-        if args is None:
-            args = {}
-        if "fq" not in args.keys():
-            args["fq"] = "qfq"
-        if "use_cache" not in args.keys():
-            args["use_cache"] = True
-        if "pages" not in args.keys():
-            args["pages"] = 8
-        else:
-            args["pages"] = int(args["pages"])
-
-        frequency_map = {
-            "y": 11,
-            "m": 6,
-            "w": 9,
-            "d": 9,
-            "120m": 3,
-            "60m": 3,
-            "30m": 2,
-            "15m": 1,
-            "10m": 0,
-            "5m": 0,
-            "2m": 8,
-            "1m": 8,
-        }
-        # 周线数据，使用日线复权后的数据进行合并，所以多请求点数据
-        if frequency == "w":
-            args["pages"] = 12
+        args = self._klines_args(frequency, args)
 
         market, tdx_code, _type = self.to_tdx_code(code)
         if market is None or _type is None:
@@ -224,97 +266,7 @@ class ExchangeTDX(Exchange):
         try:
             client = TdxHq_API(raise_exception=True, auto_retry=True)
             with client.connect(self.connect_info["ip"], self.connect_info["port"]):
-                if "index" in _type:
-                    get_bars = client.get_index_bars
-                else:
-                    get_bars = client.get_security_bars
-
-                ks: pd.DataFrame = self.fdb.get_tdx_klines(
-                    Market.A.value, code, frequency
-                )
-                if ks is None or len(ks) == 0:
-                    # 获取 8*700 = 5600 条数据
-                    ks = pd.concat(
-                        [
-                            client.to_df(
-                                get_bars(
-                                    frequency_map[frequency],
-                                    market,
-                                    tdx_code,
-                                    (i - 1) * 700,
-                                    700,
-                                )
-                            )
-                            for i in range(1, args["pages"] + 1)
-                        ],
-                        axis=0,
-                        sort=False,
-                    )
-                    if len(ks) == 0:
-                        return pd.DataFrame([])
-                    ks.loc[:, "date"] = pd.to_datetime(ks["datetime"])
-                    ks.sort_values("date", inplace=True)
-                else:
-                    for i in range(1, args["pages"] + 1):
-                        # print(f'{code} 使用缓存，更新获取第 {i} 页')
-                        _ks = client.to_df(
-                            get_bars(
-                                frequency_map[frequency],
-                                market,
-                                tdx_code,
-                                (i - 1) * 700,
-                                700,
-                            )
-                        )
-                        if len(_ks) == 0:
-                            break
-                        _ks.loc[:, "date"] = pd.to_datetime(_ks["datetime"])
-                        _ks.sort_values("date", inplace=True)
-                        new_start_dt = _ks.iloc[0]["date"]
-                        old_end_dt = ks.iloc[-1]["date"]
-                        ks = pd.concat([ks, _ks], ignore_index=True)
-                        # 如果请求的第一个时间大于缓存的最后一个时间，退出
-                        if old_end_dt >= new_start_dt:
-                            break
-            # TODO 如果是分钟数据，当天的数据会有问题，在 13:00，应该是 11:00
-            if len(frequency) >= 2 and frequency.endswith("m"):
-                # 将 13:00 修改为 11:30
-                def dt_1300_to_1130(_d: datetime.datetime):
-                    if _d.hour == 13 and _d.minute == 0:
-                        return _d.replace(hour=11, minute=30)
-                    return _d
-
-                ks["date"] = ks["date"].apply(dt_1300_to_1130)
-
-            # 删除重复数据
-            ks = ks.drop_duplicates(["date"], keep="last").sort_values("date")
-
-            self.fdb.save_tdx_klines(Market.A.value, code, frequency, ks)
-
-            ks.loc[:, "code"] = code
-            ks.loc[:, "volume"] = ks["vol"]
-
-            # 转换时区
-            ks["date"] = ks["date"].dt.tz_localize(self.tz)
-            if frequency in ["d", "w", "m", "q", "y"]:
-                # 将时间转换成 15:00:00
-                ks["date"] = ks["date"].apply(lambda _d: _d.replace(hour=15, minute=0))
-
-            if frequency == "m":  # 月设置为每月的一号
-                ks["date"] = ks["date"].apply(lambda _d: _d.replace(day=1))
-            if frequency == "y":  # 年设置为一月一号
-                ks["date"] = ks["date"].apply(lambda _d: _d.replace(month=1, day=1))
-            ks = ks.drop_duplicates(["date"], keep="last").sort_values("date")
-
-            if args["fq"] in ["qfq", "hfq"]:
-                ks = self.klines_fq(ks, self.xdxr(market, code, tdx_code), args["fq"])
-
-            ks.reset_index(inplace=True)
-            if frequency in ["w", "120m", "10m", "2m"]:
-                ks = convert_stock_kline_frequency(ks, frequency)
-
-            ks = ks[["code", "date", "open", "close", "high", "low", "volume"]]
-            return ks
+                return self._klines_by_client(client, code, frequency, args)
         except TdxConnectionError:
             print("连接失败，重新选择最优服务器")
             self.reset_tdx_ip()
@@ -326,6 +278,173 @@ class ExchangeTDX(Exchange):
             # print(f'请求行情用时：{time.time() - _s_time}')
         return None
 
+    def klines_many(
+        self,
+        codes: List[str],
+        frequency: str,
+        args: dict = None,
+        max_workers: int = 8,
+    ) -> Dict[str, Union[pd.DataFrame, None]]:
+        """
+        批量获取多个代码的K线数据，返回 代码 -> K线数据 的字典
+
+        使用线程池并发请求，每个线程使用一个长连接，依次请求分配到的代码，不需要每个代码重新连接服务器
+        并发数量通过 max_workers 控制，连接失败的代码，最后使用 klines 方法逐个重试
+        """
+        args = self._klines_args(frequency, args)
+        # 预先加载所有代码信息，避免多线程重复加载
+        self.all_stocks()
+
+        local = threading.local()
+        clients: List[TdxHq_API] = []
+        clients_lock = threading.Lock()
+
+        def get_client() -> TdxHq_API:
+            client = getattr(local, "client", None)
+            if client is None:
+                client = TdxHq_API(raise_exception=True, auto_retry=True)
+                client.connect(self.connect_info["ip"], self.connect_info["port"])
+                local.client = client
+                with clients_lock:
+                    clients.append(client)
+            return client
+
+        def fetch(code: str):
+            market, _, _type = self.to_tdx_code(code)
+            if market is None or _type is None:
+                return code, None, False
+            try:
+                ks = self._klines_by_client(get_client(), code, frequency, args)
+                return code, ks, False
+            except (TdxConnectionError, TdxFunctionCallError):
+                # 连接失败或者请求失败（连接已经失效），下次请求重新连接
+                local.client = None
+            except Exception as e:
+                self.log.error(f"获取行情异常 {code} Exception ：{str(e)}")
+            return code, None, True
+
+        results: Dict[str, Union[pd.DataFrame, None]] = {}
+        error_codes = []
+        try:
+            with ThreadPoolExecutor(max_workers) as executor:
+                for code, ks, is_error in executor.map(fetch, codes):
+                    results[code] = ks
+                    if is_error:
+                        error_codes.append(code)
+        finally:
+            for client in clients:
+                try:
+                    client.disconnect()
+                except Exception:
+                    pass
+
+        for code in error_codes:
+            results[code] = self.klines(code, frequency, args=args)
+        return results
+
+    def _klines_by_client(
+        self, client: TdxHq_API, code: str, frequency: str, args: dict
+    ) -> Union[pd.DataFrame, None]:
+        """
+        使用已经连接的客户端获取K线数据，args 为 _klines_args 处理后的参数
+        """
+        market, tdx_code, _type = self.to_tdx_code(code)
+        if market is None or _type is None:
+            return None
+
+        if "index" in _type:
+            get_bars = client.get_index_bars
+        else:
+            get_bars = client.get_security_bars
+
+        ks: pd.DataFrame = self.fdb.get_tdx_klines(Market.A.value, code, frequency)
+        if ks is None or len(ks) == 0:
+            # 获取 8*700 = 5600 条数据，不足 700 条说明没有更早的数据了
+            pages = []
+            for i in range(1, args["pages"] + 1):
+                _ks = client.to_df(
+                    get_bars(
+                        self.frequency_map[frequency],
+                        market,
+                        tdx_code,
+                        (i - 1) * 700,
+                        700,
+                    )
+                )
+                pages.append(_ks)
+                if len(_ks) < 700:
+                    break
+            ks = pd.concat(pages, axis=0, sort=False)
+            if len(ks) == 0:
+                return pd.DataFrame([])
+            ks.loc[:, "date"] = pd.to_datetime(ks["datetime"])
+            ks.sort_values("date", inplace=True)
+        else:
+            for i in range(1, args["pages"] + 1):
+                # print(f'{code} 使用缓存，更新获取第 {i} 页')
+                _ks = client.to_df(
+                    get_bars(
+                        self.frequency_map[frequency],
+                        market,
+                        tdx_code,
+                        (i - 1) * 700,
+                        700,
+                    )
+                )
+                if len(_ks) == 0:
+                    break
+                _ks.loc[:, "date"] = pd.to_datetime(_ks["datetime"])
+                _ks.sort_values("date", inplace=True)
+                new_start_dt = _ks.iloc[0]["date"]
+                old_end_dt = ks.iloc[-1]["date"]
+                ks = pd.concat([ks, _ks], ignore_index=True)
+                # 如果请求的第一个时间大于缓存的最后一个时间，退出
+                if old_end_dt >= new_start_dt:
+                    break
+        # TODO 如果是分钟数据，当天的数据会有问题，在 13:00，应该是 11:00
+        if len(frequency) >= 2 and frequency.endswith("m"):
+            # 将 13:00 修改为 11:30
+            ks["date"] = replace_dates(
+                ks["date"],
+                (ks["date"].dt.hour == 13) & (ks["date"].dt.minute == 0),
+                hour=11,
+                minute=30,
+            )
+
+        # 删除重复数据
+        ks = ks.drop_duplicates(["date"], keep="last").sort_values("date")
+
+        self.fdb.save_tdx_klines(Market.A.value, code, frequency, ks)
+
+        ks.loc[:, "code"] = code
+        ks.loc[:, "volume"] = ks["vol"]
+
+        # 转换时区
+        ks["date"] = ks["date"].dt.tz_localize(self.tz)
+        if frequency in ["d", "w", "m", "q", "y"]:
+            # 将时间转换成 15:00:00
+            replace = {"hour": 15, "minute": 0}
+            if frequency == "m":  # 月设置为每月的一号
+                replace["day"] = 1
+            if frequency == "y":  # 年设置为一月一号
+                replace.update(month=1, day=1)
+            ks["date"] = replace_dates(ks["date"], **replace)
+        ks = ks.drop_duplicates(["date"], keep="last").sort_values("date")
+
+        if args["fq"] in ["qfq", "hfq"]:
+            ks = self.klines_fq(
+                ks,
+                self.xdxr_events(market, code, tdx_code, client=client),
+                args["fq"],
+            )
+
+        ks.reset_index(inplace=True)
+        if frequency in ["w", "120m", "10m", "2m"]:
+            ks = convert_stock_kline_frequency(ks, frequency)
+
+        ks = ks[["code", "date", "open", "close", "high", "low", "volume"]]
+        return ks
+
     @staticmethod
     def get_monday(date):
         """
@@ -381,10 +500,10 @@ class ExchangeTDX(Exchange):
             for i in range(0, total_quotes, batch_size):
                 batch_stocks = query_stocks[i : i + batch_size]
                 try:
-                    batch_quotes = client.get_security_quotes(batch_stocks)
+                    batch_quotes = self._security_quotes(client, batch_stocks)
                 except Exception as e:
                     error_codes += batch_stocks
-                    print(f"获取数据失败: {e}")
+                    self.log.error(f"获取行情数据失败: {e}")
                     continue
                 quotes += batch_quotes
             # ('market', 0), ('code', '000001'), ('active1', 4390), ('price', 14.29), ('last_close', 14.24), ('open', 14.35),
@@ -442,6 +561,22 @@ class ExchangeTDX(Exchange):
 
         return ticks
 
+    def _security_quotes(self, client: TdxHq_API, stocks: list) -> list:
+        """
+        批量获取行情，连接已经失效的，切换服务器重新连接后重试一次，避免之后的批次都使用失效的连接
+        """
+        try:
+            return client.get_security_quotes(stocks)
+        except (TdxConnectionError, TdxFunctionCallError):
+            self.log.warning("行情连接失效，重新选择服务器并连接")
+            try:
+                client.disconnect()
+            except Exception:
+                pass
+            self.reset_tdx_ip()
+            client.connect(self.connect_info["ip"], self.connect_info["port"])
+            return client.get_security_quotes(stocks)
+
     def now_trading(self):
         """
         返回当前是否是交易时间
@@ -588,9 +723,12 @@ class ExchangeTDX(Exchange):
     def order(self, code: str, o_type: str, amount: float, args=None):
         raise Exception("交易所不支持")
 
-    def xdxr(self, market: int, project_code: str, code: str):
+    def xdxr(
+        self, market: int, project_code: str, code: str, client: TdxHq_API = None
+    ):
         """
         读取除权除息信息
+        client 为已经连接的客户端，不传则新建连接
         """
         xdxr_path = get_data_path() / "xdxr"
         if xdxr_path.is_dir() is False:
@@ -604,9 +742,12 @@ class ExchangeTDX(Exchange):
         ):
             need_update = True
         if need_update:
-            client = TdxHq_API(raise_exception=True, auto_retry=True)
-            with client.connect(self.connect_info["ip"], self.connect_info["port"]):
+            if client is not None:
                 data = client.to_df(client.get_xdxr_info(market, code))
+            else:
+                client = TdxHq_API(raise_exception=True, auto_retry=True)
+                with client.connect(self.connect_info["ip"], self.connect_info["port"]):
+                    data = client.to_df(client.get_xdxr_info(market, code))
             if len(data) > 0:
                 data.loc[:, "date"] = (
                     data["year"].map(str)
@@ -623,142 +764,126 @@ class ExchangeTDX(Exchange):
 
         return data
 
-    def klines_fq(self, fq_klines: pd.DataFrame, xdxr_data, fq_type: str):
+    def xdxr_events(
+        self, market: int, project_code: str, code: str, client: TdxHq_API = None
+    ) -> Dict[str, np.ndarray]:
         """
-        对行情进行复权处理
+        获取复权计算使用的除权除息事件数组，按代码缓存在内存中，除权除息信息每天更新后重新转换
         """
+        key = f"{market}_{project_code}"
+        now_day = fun.datetime_to_str(datetime.datetime.now(), "%Y-%m-%d")
+        cache = self._xdxr_events.get(key)
+        if cache is not None and cache[0] == now_day:
+            return cache[1]
+        events = self._xdxr_to_events(
+            self.xdxr(market, project_code, code, client=client)
+        )
+        self._xdxr_events[key] = (now_day, events)
+        return events
+
+    def _xdxr_to_events(self, xdxr_data: pd.DataFrame) -> Dict[str, np.ndarray]:
+        """
+        将除权除息信息转换为按时间排序的事件数组（时间为 UTC 纳秒）
+        suogu_* 为扩缩股事件 (category==11)，其他为除权除息事件 (category==1)
+        """
+        events = {
+            "suogu_dates": np.array([], dtype=np.int64),
+            "suogu": np.array([], dtype=float),
+            "dates": np.array([], dtype=np.int64),
+        }
+        for col in ["fenhong", "peigu", "peigujia", "songzhuangu"]:
+            events[col] = np.array([], dtype=float)
         if len(xdxr_data) == 0:
+            return events
+
+        xdxr_data = xdxr_data.sort_values("date", kind="stable")
+        dates = pd.DatetimeIndex(xdxr_data["date"]).tz_localize(self.tz).asi8
+        category = xdxr_data["category"].to_numpy()
+
+        def col_values(col: str) -> np.ndarray:
+            if col not in xdxr_data.columns:
+                return np.zeros(len(xdxr_data))
+            return xdxr_data[col].fillna(0).to_numpy(dtype=float)
+
+        suogu = col_values("suogu")
+        suogu_mask = (category == 11) & (suogu > 0)
+        events["suogu_dates"] = dates[suogu_mask]
+        events["suogu"] = suogu[suogu_mask]
+        mask = category == 1
+        events["dates"] = dates[mask]
+        for col in ["fenhong", "peigu", "peigujia", "songzhuangu"]:
+            events[col] = col_values(col)[mask]
+        return events
+
+    def klines_fq(
+        self,
+        fq_klines: pd.DataFrame,
+        xdxr_data: Union[pd.DataFrame, Dict[str, np.ndarray]],
+        fq_type: str,
+    ):
+        """
+        对行情进行复权处理
+        xdxr_data 可以是除权除息信息，或者 xdxr_events 转换后的事件数组
+
+        每个事件的复权因子只与事件前一根K线的收盘价有关，将事件因子累乘后，
+        通过 searchsorted 找到每根K线对应的累计因子，一次乘法完成所有价格的复权
+        """
+        events = (
+            xdxr_data
+            if isinstance(xdxr_data, dict)
+            else self._xdxr_to_events(xdxr_data)
+        )
+        if len(events["suogu_dates"]) == 0 and len(events["dates"]) == 0:
             return fq_klines
 
-        # 先处理扩缩股数据 (category==11)
-        suogu_info = copy.deepcopy(xdxr_data.query("category==11"))
-        if len(suogu_info) > 0:
-            # 处理扩缩股数据，对日期之前的行情数据进行缩股处理
-            suogu_info.loc[:, "idx_date"] = (
-                suogu_info["date"].dt.tz_localize(self.tz).dt.tz_convert("UTC")
-            )
-            suogu_info.set_index("idx_date", inplace=True)
-
-            fq_klines = fq_klines.assign(if_trade=1)
-            fq_klines.loc[:, "idx_date"] = fq_klines["date"].dt.tz_convert("UTC")
-            fq_klines.set_index("idx_date", inplace=True)
-
-            # 对每个扩缩股事件，将日期之前的行情数据除以suogu值
-            for idx, row in suogu_info.iterrows():
-                if "suogu" in row and row["suogu"] > 0:
-                    # 找到该日期之前的所有K线数据
-                    before_data = fq_klines.loc[fq_klines.index < idx]
-                    if len(before_data) > 0:
-                        # 对价格数据进行缩股处理
-                        for col in ["open", "high", "low", "close"]:
-                            if col in before_data.columns:
-                                fq_klines.loc[fq_klines.index < idx, col] = (
-                                    fq_klines.loc[fq_klines.index < idx, col]
-                                    / row["suogu"]
-                                )
-                        # 对成交量数据进行扩股处理（成交量应该乘以suogu）
-                        if "volume" in before_data.columns:
-                            fq_klines.loc[fq_klines.index < idx, "volume"] = (
-                                fq_klines.loc[fq_klines.index < idx, "volume"]
-                                * row["suogu"]
-                            )
-                        elif "vol" in before_data.columns:
-                            fq_klines.loc[fq_klines.index < idx, "vol"] = (
-                                fq_klines.loc[fq_klines.index < idx, "vol"]
-                                * row["suogu"]
-                            )
-
-            # 重置索引，准备后续处理
-            fq_klines = fq_klines.reset_index(drop=True)
-            fq_klines = fq_klines.drop(columns=["idx_date"], errors="ignore")
-
-        # 再处理除权除息数据 (category==1)
-        info = copy.deepcopy(xdxr_data.query("category==1"))
-        if len(info) == 0:
+        fq_klines = fq_klines.reset_index(drop=True)
+        times = pd.DatetimeIndex(fq_klines["date"]).asi8
+        price_cols = ["open", "high", "low", "close"]
+        prices = fq_klines[price_cols].to_numpy(dtype=float)
+
+        # 先处理扩缩股数据，日期之前的价格除以 suogu 值，成交量乘以 suogu 值
+        if len(events["suogu_dates"]) > 0:
+            suogu_cum = np.append(np.cumprod(events["suogu"][::-1])[::-1], 1.0)
+            factor = suogu_cum[
+                np.searchsorted(events["suogu_dates"], times, side="right")
+            ]
+            prices = prices / factor[:, None]
+            vol_col = "volume" if "volume" in fq_klines.columns else "vol"
+            if vol_col in fq_klines.columns:
+                fq_klines[vol_col] = fq_klines[vol_col].to_numpy() * factor
+            fq_klines[price_cols] = prices
+
+        # 再处理除权除息数据，只计算K线时间范围内并且前面有K线的事件
+        if len(events["dates"]) == 0:
             return fq_klines
-        info.loc[:, "idx_date"] = (
-            info["date"].dt.tz_localize(self.tz).dt.tz_convert("UTC")
-        )
-        info.set_index("idx_date", inplace=True)
-
-        # 如果之前没有处理扩缩股，需要重新设置索引
-        if "idx_date" not in fq_klines.columns:
-            fq_klines = fq_klines.assign(if_trade=1)
-            fq_klines.loc[:, "idx_date"] = fq_klines["date"].dt.tz_convert("UTC")
-            fq_klines.set_index("idx_date", inplace=True)
-
-        if len(info) > 0:
-            # 有除权数据
-            with warnings.catch_warnings():
-                warnings.filterwarnings("ignore", category=FutureWarning)
-                data = pd.concat(
-                    [
-                        fq_klines,
-                        info.loc[
-                            fq_klines.index[0] : fq_klines.index[-1], ["category"]
-                        ],
-                    ],
-                    axis=1,
-                )
-                data["if_trade"].fillna(value=0, inplace=True)
-                data = data.fillna(method="ffill")
-                data = pd.concat(
-                    [
-                        data,
-                        info.loc[
-                            fq_klines.index[0] : fq_klines.index[-1],
-                            ["fenhong", "peigu", "peigujia", "songzhuangu"],
-                        ],
-                    ],
-                    axis=1,
-                )
-        else:
-            data = pd.concat(
-                [
-                    fq_klines,
-                    info.loc[
-                        :, ["category", "fenhong", "peigu", "peigujia", "songzhuangu"]
-                    ],
-                ],
-                axis=1,
+        dates = events["dates"]
+        pre_idx = np.searchsorted(times, dates, side="left") - 1
+        mask = (dates <= times[-1]) & (pre_idx >= 0)
+        dates = dates[mask]
+        pre_close = prices[pre_idx[mask], 3]
+        fenhong = events["fenhong"][mask]
+        peigu = events["peigu"][mask]
+        peigujia = events["peigujia"][mask]
+        songzhuangu = events["songzhuangu"][mask]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # 除权除息后的前收盘价与除权前收盘价的比值
+            ratio = (pre_close * 10 - fenhong + peigu * peigujia) / (
+                (10 + peigu + songzhuangu) * pre_close
             )
+        ratio[~np.isfinite(ratio)] = 1.0
 
-        # 数据补全
-        data = data.fillna(0)
-
-        # 计算前日收盘
-        data["preclose"] = (
-            data["close"].shift(1) * 10
-            - data["fenhong"]
-            + data["peigu"] * data["peigujia"]
-        ) / (10 + data["peigu"] + data["songzhuangu"])
-
-        # 前复权
+        pos = np.searchsorted(dates, times, side="right")
         if fq_type == "qfq":
-            data["adj"] = (
-                (data["preclose"].shift(-1) / data["close"]).fillna(1)[::-1].cumprod()
-            )
-            # ohlc 数据进行复权计算
-            for col in ["open", "high", "low", "close"]:
-                data[col] = round(data[col] * data["adj"], 3)
-
-        # 后复权
-        if fq_type == "hfq":
-            data["adj"] = (
-                (data["close"] / data["preclose"].shift(-1))
-                .cumprod()
-                .shift(1)
-                .fillna(1)
-            )
-            # ohlc 数据进行复权计算
-            for col in ["open", "high", "low", "close"]:
-                data[col] = round(data[col] / data["adj"], 3)
-
-        # data['volume'] = data['volume'] / data['adj'] if 'volume' in data.columns else data['vol'] / data['adj']
+            # 前复权，乘以之后所有事件的因子
+            adj = np.append(np.cumprod(ratio[::-1])[::-1], 1.0)[pos]
+        else:
+            # 后复权，乘以之前所有事件的因子
+            adj = np.insert(np.cumprod(ratio), 0, 1.0)[pos]
+        fq_klines[price_cols] = np.round(prices * adj[:, None], 3)
 
-        data = data.query("if_trade==1 and open != 0")
+        fq_klines = fq_klines[fq_klines["open"] != 0]
 
-        return data[["code", "date", "open", "close", "high", "low", "volume"]]
+        return fq_klines[["code", "date", "open", "close", "high", "low", "volume"]]
 
 
 if __name__ == "__main__":
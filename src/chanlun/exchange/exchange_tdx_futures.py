@@ -16,6 +16,7 @@ from chanlun.exchange.exchange import (
     Exchange,
     Tick,
     convert_tdx_futures_kline_frequency,
+    replace_dates,
 )
 from chanlun.file_db import FileCacheDB
 from chanlun.tools import tdx_best_ip as best_ip
@@ -263,7 +264,8 @@ class ExchangeTDXFutures(Exchange):
             klines.sort_values("date", inplace=True)
 
             if frequency in {"y", "q", "m", "w", "d"}:
-                klines["date"] = klines["date"].apply(self.__convert_date)
+                # 通达信行情是后对其的，统一将 日以上级别的行情日期转换成 23点
+                klines["date"] = replace_dates(klines["date"], hour=23, minute=0)
 
             # 将 volume 转换成 float类型
             klines[["volume"]] = klines[["volume"]].astype(float)
@@ -424,11 +426,6 @@ class ExchangeTDXFutures(Exchange):
             return True
         return False
 
-    @staticmethod
-    def __convert_date(dt: datetime.datetime):
-        # 通达信行情是后对其的，统一将 日以上级别的行情日期转换成 23点
-        return dt.replace(hour=23, minute=0)
-
     def balance(self):
         raise Exception("交易所不支持")
 
@@ -1,32 +1,82 @@
+import atexit
+import contextlib
 import datetime
 import hashlib
+import json
+import mmap
+import os
 import pathlib
 import pickle
 import random
+import struct
+import threading
 import time
-from decimal import Decimal
-from typing import Union
+from collections import OrderedDict
+from typing import Dict, List, Tuple, Union
 
+import numpy as np
 import pandas as pd
 import pytz
 
 from chanlun import cl, fun
 from chanlun.base import Market
-from chanlun.cl_interface import ICL
+from chanlun.cl_interface import ICL, KlineStore
 from chanlun.config import get_data_path
-from chanlun.db import db
 from chanlun.exchange import Exchange
 
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+
+class KlinesFileChanged(Exception):
+    """
+    读取K线缓存的过程中，缓存文件被其他进程更新（文件与元数据不一致）
+    """
+
 
 class FileCacheDB(object):
     """
     文件数据对象
     """
 
+    # 缠论数据快照的文件标识与格式版本，格式有变动需要增加版本号，旧版本的快照文件会被忽略并重新计算
+    cl_snapshot_magic = b"CLSNAP\x00\x00"
+    cl_snapshot_version = 2
+
+    # 内存中缓存的缠论数据对象，超出数量或估算的内存占用后，淘汰最久未使用的对象
+    cl_cache_max_num = 500
+    cl_cache_max_bytes = 1024 * 1024 * 1024
+    # 缠论数据对象每根K线估算的内存占用（包括 CZSC 的计算数据与转换后的对象）
+    cl_cache_kline_bytes = 2048
+    # 内存中有更新的缠论数据对象，定时写入快照文件的间隔（秒）
+    cl_cache_flush_interval = 60
+    # K线缓存后台整理的间隔（秒）
+    klines_maintain_interval = 60 * 60
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __new__(cls):
+        # 进程内单例，避免每次使用都重新检查目录，并共享内存中缓存的缠论数据对象
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = super().__new__(cls)
+                cls._instance._initialized = False
+        return cls._instance
+
     def __init__(self):
         """
         初始化，判断文件并进行创建
         """
+        with self._instance_lock:
+            if self._initialized:
+                return
+            self._init()
+            self._initialized = True
+
+    def _init(self):
         self.home_path = pathlib.Path.home()
         self.project_path = get_data_path()
         if self.project_path.is_dir() is False:
@@ -40,6 +90,10 @@ class FileCacheDB(object):
         self.cache_pkl_path = self.project_path / "cache_pkl"
         if self.cache_pkl_path.is_dir() is False:
             self.cache_pkl_path.mkdir()
+        # 回测中共享的缠论数据快照
+        self.backtest_cl_path = self.project_path / "backtest_cl"
+        if self.backtest_cl_path.is_dir() is False:
+            self.backtest_cl_path.mkdir()
 
         # 遍历 enum 中的值
         for market in Market:
@@ -49,6 +103,9 @@ class FileCacheDB(object):
             market_klines_path = self.klines_path / market.value
             if market_klines_path.is_dir() is False:
                 market_klines_path.mkdir()
+            market_backtest_cl_path = self.backtest_cl_path / market.value
+            if market_backtest_cl_path.is_dir() is False:
+                market_backtest_cl_path.mkdir()
 
         # 设置时区
         self.tz = pytz.timezone("Asia/Shanghai")
@@ -98,12 +155,29 @@ class FileCacheDB(object):
             "idx_macd_signal",
         ]
 
-        # 缠论的更新时间，如果与当前保存不一致，需要清空缓存的计算结果，重新计算
+        # 缠论的更新时间，记录在快照文件中，与当前不一致的快照不再使用，重新计算
         self.cl_update_date = "2025-06-15"
-        cache_cl_update_date = db.cache_get("__cl_update_date")
-        if cache_cl_update_date != self.cl_update_date:
-            db.cache_set("__cl_update_date", self.cl_update_date)
-            self.clear_all_cl_data()
+
+        # 内存中缓存的缠论数据对象，key 为快照文件路径，value 为 (快照文件路径, 缠论数据对象)
+        self._cl_cache: OrderedDict[str, Tuple[pathlib.Path, ICL]] = OrderedDict()
+        # 有更新还未写入快照文件的 key
+        self._cl_cache_dirty: set = set()
+        self._cl_cache_lock = threading.RLock()
+        # 每个 key 的计算锁，同一个缠论数据对象同时只能有一个线程更新、读取或写入
+        # value 为 [锁, 使用中的数量]，没有使用的 key 会删除，不会随着缓存过的 key 一直增加
+        self._cl_key_locks: Dict[str, list] = {}
+        self._cl_flush_thread: Union[threading.Thread, None] = None
+        # K线缓存的后台整理线程（合并追加数据、清理不活跃的缓存）
+        self._klines_maintain_thread: Union[threading.Thread, None] = None
+        # 执行K线缓存整理的进程锁定的文件，多个进程只有锁定成功的进程执行整理
+        self._klines_maintain_lock_fp = None
+        atexit.register(self.flush_cl_cache)
+
+    def _tdx_klines_file(self, market: str, code: str, frequency: str) -> pathlib.Path:
+        """
+        K线缓存的文件前缀，实际文件为 .meta.json（元数据）、.base.npz（基础数据）、.tail.npz（追加数据）
+        """
+        return self.klines_path / market / f"{code.replace('.', '_')}_{frequency}"
 
     def get_tdx_klines(
         self, market: str, code: str, frequency: str
@@ -111,48 +185,117 @@ class FileCacheDB(object):
         """
         获取缓存在文件中的股票数据
         """
-        file_pathname = (
-            self.klines_path / market / f"{code.replace('.', '_')}_{frequency}.csv"
-        )
-        if file_pathname.is_file() is False:
-            return None
-        try:
-            _klines = pd.read_csv(file_pathname)
-        except Exception:
-            file_pathname.unlink()
+        self._start_klines_maintain_thread()
+        file_prefix = self._tdx_klines_file(market, code, frequency)
+        meta_pathname = file_prefix.with_name(f"{file_prefix.name}.meta.json")
+        if meta_pathname.is_file() is False:
+            # 兼容旧版本的 csv 缓存文件，保存时会转换为新的格式
+            return self._get_tdx_klines_csv(file_prefix.with_name(f"{file_prefix.name}.csv"))
+        # 其他进程可能正在整理或写入缓存（读取期间文件被替换或删除），重新读取一次，仍然失败的返回 None
+        # 只有文件内容损坏的才删除缓存
+        _klines = None
+        with self._cl_key_lock(str(meta_pathname)):
+            for _ in range(2):
+                try:
+                    meta_text = meta_pathname.read_text(encoding="utf-8")
+                    _klines = self._read_tdx_klines(file_prefix, json.loads(meta_text))
+                    if meta_pathname.read_text(encoding="utf-8") != meta_text:
+                        raise KlinesFileChanged(str(meta_pathname))
+                    # 更新文件时间，避免使用中的缓存被清理
+                    os.utime(meta_pathname)
+                    break
+                except (OSError, KlinesFileChanged):
+                    _klines = None
+                except Exception:
+                    self._delete_tdx_klines(file_prefix)
+                    return None
+        if _klines is None:
             return None
-        if len(_klines) > 0:
-            _klines["date"] = pd.to_datetime(_klines["date"])
-            # 如果 date 有 Nan 则返回 None
-            if _klines["date"].isnull().any():
-                return None
-            # 不返回最后一行
-            _klines = _klines.iloc[0:-1:]
-
-        # 加一个随机概率，去清理历史的缓存，避免太多占用空间
-        if random.randint(0, 1000) <= 5:
-            self.clear_tdx_old_klines(market)
-        return _klines
+        # 不返回最后一行
+        return _klines.iloc[0:-1:]
 
     def save_tdx_klines(
         self, market: str, code: str, frequency: str, kline: pd.DataFrame
     ):
         """
         保存通达信k线数据对象到文件中
+
+        传入的K线是在缓存K线的基础上增加新K线，只将缓存最后一根K线（可能未完成）及之后的K线重新写入追加文件（整个文件替换，不是在文件末尾追加），
+        不重写基础数据；追加文件由后台线程定期合并到基础数据中；列或者之前的数据有变化的，重新全量写入
         """
-        file_pathname = (
-            self.klines_path / market / f"{code.replace('.', '_')}_{frequency}.csv"
-        )
-        kline.to_csv(file_pathname, index=False)
+        file_prefix = self._tdx_klines_file(market, code, frequency)
+        meta_pathname = file_prefix.with_name(f"{file_prefix.name}.meta.json")
+        if len(kline) == 0:
+            return True
+        kline = kline.reset_index(drop=True)
+        dates = pd.DatetimeIndex(kline["date"])
+        tz = None if dates.tz is None else str(dates.tz)
+        dates = dates.asi8
+        with self._cl_key_lock(str(meta_pathname)):
+            meta = None
+            if meta_pathname.is_file():
+                try:
+                    meta = json.loads(meta_pathname.read_text(encoding="utf-8"))
+                except Exception:
+                    meta = None
+            if (
+                meta is not None
+                and meta["columns"] == list(kline.columns)
+                and meta["tz"] == tz
+            ):
+                start = int(np.searchsorted(dates, meta["base_last_date"], side="left"))
+                if (
+                    start == meta["base_rows"] - 1
+                    and start < len(dates)
+                    and dates[start] == meta["base_last_date"]
+                ):
+                    self._write_klines_npz(
+                        file_prefix.with_name(f"{file_prefix.name}.tail.npz"),
+                        kline.iloc[start:],
+                        dates[start:],
+                    )
+                    meta["tail_rows"] = len(kline) - start
+                    self._write_klines_meta(meta_pathname, meta)
+                    return True
+            self._write_tdx_klines_base(file_prefix, kline, dates, tz)
         return True
 
-    def clear_tdx_old_klines(self, market):
+    def compact_tdx_klines(self, file_prefix: pathlib.Path):
+        """
+        将追加文件合并到基础数据中
+        """
+        meta_pathname = file_prefix.with_name(f"{file_prefix.name}.meta.json")
+        with self._cl_key_lock(str(meta_pathname)):
+            try:
+                meta = json.loads(meta_pathname.read_text(encoding="utf-8"))
+                if meta["tail_rows"] == 0:
+                    return True
+                kline = self._read_tdx_klines(file_prefix, meta)
+                self._write_tdx_klines_base(
+                    file_prefix, kline, pd.DatetimeIndex(kline["date"]).asi8, meta["tz"]
+                )
+            except (OSError, KlinesFileChanged):
+                # 文件正在被其他进程更新，下次整理时再合并
+                return False
+            except Exception:
+                self._delete_tdx_klines(file_prefix)
+        return True
+
+    def clear_tdx_old_klines(self, market, days: int = 15):
         """
         删除15天前的k线数据，不活跃的，减少占用空间
         """
         del_lt_times = fun.datetime_to_int(datetime.datetime.now()) - (
-            15 * 24 * 60 * 60
+            days * 24 * 60 * 60
         )
+        for filename in (self.klines_path / market).glob("*.meta.json"):
+            try:
+                if filename.stat().st_mtime < del_lt_times:
+                    self._delete_tdx_klines(
+                        filename.with_name(filename.name[: -len(".meta.json")])
+                    )
+            except Exception:
+                pass
         for filename in (self.klines_path / market).glob("*.csv"):
             try:
                 if filename.stat().st_mtime < del_lt_times:
@@ -161,6 +304,187 @@ class FileCacheDB(object):
                 pass
         return True
 
+    def maintain_tdx_klines(self):
+        """
+        清理不活跃的K线缓存，并合并有追加数据的K线缓存
+        """
+        for market in Market:
+            self.clear_tdx_old_klines(market.value)
+            for filename in (self.klines_path / market.value).glob("*.tail.npz"):
+                self.compact_tdx_klines(
+                    filename.with_name(filename.name[: -len(".tail.npz")])
+                )
+        return True
+
+    def _start_klines_maintain_thread(self):
+        with self._cl_cache_lock:
+            if self._klines_maintain_thread is None:
+                self._klines_maintain_thread = threading.Thread(
+                    target=self._run_maintain_tdx_klines, daemon=True
+                )
+                self._klines_maintain_thread.start()
+
+    def _lock_klines_maintain(self) -> bool:
+        """
+        锁定K线缓存的整理锁文件，多个进程同时运行，只有锁定成功的进程执行整理
+        锁在进程退出后自动释放，之后由其他进程接替
+        """
+        if self._klines_maintain_lock_fp is not None:
+            return True
+        fp = open(self.klines_path / "maintain.lock", "a+")
+        try:
+            if os.name == "nt":
+                fp.seek(0)
+                msvcrt.locking(fp.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            fp.close()
+            return False
+        self._klines_maintain_lock_fp = fp
+        return True
+
+    def _run_maintain_tdx_klines(self):
+        while True:
+            time.sleep(self.klines_maintain_interval)
+            try:
+                if self._lock_klines_maintain():
+                    self.maintain_tdx_klines()
+            except Exception as e:
+                print(f"K线缓存整理异常 - {e}")
+
+    def _read_tdx_klines(self, file_prefix: pathlib.Path, meta: dict) -> pd.DataFrame:
+        """
+        读取基础数据与追加数据，追加数据的第一根K线替换基础数据的最后一根K线
+        """
+        columns = self._read_klines_npz(
+            file_prefix.with_name(f"{file_prefix.name}.base.npz"), meta["columns"]
+        )
+        base_dates = columns["date"]
+        if (
+            len(base_dates) != meta["base_rows"]
+            or int(base_dates[-1]) != meta["base_last_date"]
+        ):
+            raise KlinesFileChanged(str(file_prefix))
+        if meta["tail_rows"] > 0:
+            tail_columns = self._read_klines_npz(
+                file_prefix.with_name(f"{file_prefix.name}.tail.npz"), meta["columns"]
+            )
+            tail_dates = tail_columns["date"]
+            if (
+                len(tail_dates) != meta["tail_rows"]
+                or int(tail_dates[0]) != meta["base_last_date"]
+            ):
+                raise KlinesFileChanged(str(file_prefix))
+            columns = {
+                _c: np.concatenate([columns[_c][:-1], tail_columns[_c]])
+                for _c in meta["columns"]
+            }
+        dates = pd.to_datetime(columns["date"])
+        if meta["tz"] is not None:
+            dates = dates.tz_localize("UTC").tz_convert(meta["tz"])
+        columns["date"] = dates
+        return pd.DataFrame(columns, columns=meta["columns"])
+
+    def _write_tdx_klines_base(
+        self, file_prefix: pathlib.Path, kline: pd.DataFrame, dates: np.ndarray, tz
+    ):
+        """
+        全量写入基础数据，并删除追加数据与旧版本的 csv 文件
+        """
+        self._write_klines_npz(
+            file_prefix.with_name(f"{file_prefix.name}.base.npz"), kline, dates
+        )
+        self._write_klines_meta(
+            file_prefix.with_name(f"{file_prefix.name}.meta.json"),
+            {
+                "columns": list(kline.columns),
+                "tz": tz,
+                "base_rows": len(kline),
+                "base_last_date": int(dates[-1]),
+                "tail_rows": 0,
+            },
+        )
+        for suffix in [".tail.npz", ".csv"]:
+            file_prefix.with_name(f"{file_prefix.name}{suffix}").unlink(missing_ok=True)
+        return True
+
+    def _delete_tdx_klines(self, file_prefix: pathlib.Path):
+        for suffix in [".meta.json", ".base.npz", ".tail.npz", ".csv"]:
+            try:
+                file_prefix.with_name(f"{file_prefix.name}{suffix}").unlink(
+                    missing_ok=True
+                )
+            except Exception:
+                pass
+        return True
+
+    @staticmethod
+    def _write_klines_npz(
+        file_pathname: pathlib.Path, kline: pd.DataFrame, dates: np.ndarray
+    ):
+        """
+        按列保存K线数据，时间保存为 int64 纳秒，数值列保留原类型，其他列转为字符串（读取时不需要 pickle）
+        """
+        arrays = {}
+        for _i, _c in enumerate(kline.columns):
+            if _c == "date":
+                arrays[f"c{_i}"] = np.asarray(dates, dtype=np.int64)
+                continue
+            values = kline[_c].to_numpy()
+            if values.dtype.kind not in "biufM":
+                values = kline[_c].astype(str).to_numpy(dtype=str)
+            arrays[f"c{_i}"] = values
+        # 临时文件名加上进程号，多个进程同时写入同一个代码的缓存，不会互相覆盖临时文件
+        tmp_pathname = file_pathname.with_name(f"{file_pathname.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp_pathname, "wb") as fp:
+                np.savez(fp, **arrays)
+            os.replace(tmp_pathname, file_pathname)
+        finally:
+            if tmp_pathname.is_file():
+                tmp_pathname.unlink()
+        return True
+
+    @staticmethod
+    def _read_klines_npz(
+        file_pathname: pathlib.Path, columns: List[str]
+    ) -> Dict[str, np.ndarray]:
+        with np.load(file_pathname, allow_pickle=False) as data:
+            return {_c: data[f"c{_i}"] for _i, _c in enumerate(columns)}
+
+    @staticmethod
+    def _write_klines_meta(file_pathname: pathlib.Path, meta: dict):
+        tmp_pathname = file_pathname.with_name(f"{file_pathname.name}.{os.getpid()}.tmp")
+        try:
+            tmp_pathname.write_text(json.dumps(meta), encoding="utf-8")
+            os.replace(tmp_pathname, file_pathname)
+        finally:
+            if tmp_pathname.is_file():
+                tmp_pathname.unlink()
+        return True
+
+    @staticmethod
+    def _get_tdx_klines_csv(file_pathname: pathlib.Path) -> Union[None, pd.DataFrame]:
+        """
+        读取旧版本 csv 格式的K线缓存
+        """
+        if file_pathname.is_file() is False:
+            return None
+        try:
+            _klines = pd.read_csv(file_pathname)
+        except Exception:
+            file_pathname.unlink()
+            return None
+        if len(_klines) > 0:
+            _klines["date"] = pd.to_datetime(_klines["date"])
+            # 如果 date 有 Nan 则返回 None
+            if _klines["date"].isnull().any():
+                return None
+            # 不返回最后一行
+            _klines = _klines.iloc[0:-1:]
+        return _klines
+
     def get_web_cl_data(
         self,
         market: str,
@@ -171,85 +495,88 @@ class FileCacheDB(object):
     ) -> ICL:
         """
         获取web缓存的的缠论数据对象
+
+        返回的是内存中缓存对象的副本，其他请求对缓存对象的更新不会影响返回的对象
+        只在当前线程中立即使用的，可以使用 web_cl_data 避免复制
         """
-        unique_md5_str = (
-            f'{[f"{k}:{v}" for k, v in cl_config.items() if k in self.config_keys]}'
-        )
-        key = hashlib.md5(unique_md5_str.encode("UTF-8")).hexdigest()
+        with self.web_cl_data(market, code, frequency, cl_config, klines) as cd:
+            return pickle.loads(pickle.dumps(cd, protocol=5))
+
+    @contextlib.contextmanager
+    def web_cl_data(
+        self,
+        market: str,
+        code: str,
+        frequency: str,
+        cl_config: dict,
+        klines: pd.DataFrame,
+    ):
+        """
+        获取web缓存的的缠论数据对象，返回的是内存中共享的缓存对象（不复制）
+
+        对象只能在 with 中使用，with 期间持有该对象的锁，其他线程不会更新或写入该对象；
+        离开 with 后对象随时会被其他请求原地更新，不能再继续使用；with 中不能再获取同一个对象，会死锁
+            with fdb.web_cl_data(market, code, frequency, cl_config, klines) as cd:
+                chart_data = cl_data_to_tv_chart(cd, cl_config)
+        """
+        key = self.cl_config_key(cl_config)
 
         file_pathname = (
             self.cl_data_path
             / market
-            / f"{market}_{code.replace('/', '_').replace('.', '_')}_{frequency}_{key}.pkl"
+            / f"{market}_{code.replace('/', '_').replace('.', '_')}_{frequency}_{key}.snap"
         )
+        cache_key = str(file_pathname)
+        with self._cl_key_lock(cache_key):
+            yield self._get_web_cl_data(
+                file_pathname, cache_key, code, frequency, cl_config, klines
+            )
+        self._evict_cl_cache()
+
+        # 加一个随机概率，去清理历史的缓存，避免太多占用空间
+        if random.randint(0, 1000) <= 5:
+            self.clear_old_web_cl_data()
+
+    def _get_web_cl_data(
+        self,
+        file_pathname: pathlib.Path,
+        cache_key: str,
+        code: str,
+        frequency: str,
+        cl_config: dict,
+        klines: pd.DataFrame,
+    ) -> ICL:
+        """
+        优先使用内存中缓存的缠论数据对象，没有则读取快照文件，验证后增量更新K线
+        """
         cd: ICL = cl.CL(code, frequency, cl_config)
         try:
-            if file_pathname.is_file():
+            with self._cl_cache_lock:
+                cache_item = self._cl_cache.get(cache_key)
+                if cache_item is not None:
+                    self._cl_cache.move_to_end(cache_key)
+            if cache_item is not None:
+                cd = cache_item[1]
+            elif file_pathname.is_file():
                 # print(f'{market}-{code}-{frequency} {key} K-Nums {len(klines)} 使用缓存')
-                try_num = 0
-                while True:
-                    try:
-                        with open(file_pathname, "rb") as fp:
-                            cd = pickle.load(fp)
-                        break
-                    except Exception as e:
-                        try_num += 1
-                        time.sleep(0.5)
-                        if try_num > 5:
-                            raise e
-                # 判断缓存中的最后k线是否大于给定的最新一根k线时间，如果小于说明直接有断档，不连续，重新全量重新计算
+                snapshot_cd = self.load_cl_snapshot(file_pathname)
+                if snapshot_cd is not None:
+                    cd = snapshot_cd
+            # 比较缓存中的K线与给定的K线，找到第一根有差异的K线
+            # 给定K线的开始时间不在缓存中（有断档或错位）、中间有缺失、或者数据有变（比如复权会产生变化），则重新全量计算
+            # 最后一根K线可能还未完成，有变化的由增量计算进行更新
+            # 给定的K线是滑动窗口（前面的K线会移出），缓存对象中累计的K线超过给定数量的两倍后重新计算，避免缓存对象无限增长
+            src_klines = cd.get_src_klines()
+            if len(src_klines) > 0 and len(klines) > 0:
+                dates, values = KlineStore.frame_arrays(klines)
                 if (
-                    len(cd.get_src_klines()) > 0
-                    and len(klines) > 0
-                    and (
-                        cd.get_src_klines()[-1].date < klines.iloc[0]["date"]
-                        or cd.get_src_klines()[0].date > klines.iloc[0]["date"]
-                    )
+                    len(src_klines) > len(klines) * 2
+                    or src_klines.first_diff(dates, values) < len(src_klines) - 1
                 ):
-                    # print(
-                    #     f"{market}-{code}-{frequency} {key} K-Nums {len(klines)} 历史数据有错位，重新计算"
-                    # )
+                    # print(f"{market}--{code}--{frequency} {key} 计算前的数据有差异，重新计算")
                     cd = cl.CL(code, frequency, cl_config)
-                # 判断缓存中的数据，与给定的K线数据是否有差异，有则表示数据有变（比如复权会产生变化），则重新全量计算
-                if len(cd.get_src_klines()) >= 2 and len(klines) >= 2:
-                    cd_pre_kline = cd.get_src_klines()[-2]
-                    src_klines = klines[klines["date"] == cd_pre_kline.date]
-                    # 计算后的数据没有最开始的日期或者 开高低收其中有不同的，则重新计算
-                    if (
-                        len(src_klines) == 0
-                        or Decimal(src_klines.iloc[0]["close"])
-                        != Decimal(cd_pre_kline.c)
-                        or Decimal(src_klines.iloc[0]["high"])
-                        != Decimal(cd_pre_kline.h)
-                        or Decimal(src_klines.iloc[0]["low"]) != Decimal(cd_pre_kline.l)
-                        or Decimal(src_klines.iloc[0]["open"])
-                        != Decimal(cd_pre_kline.o)
-                        or Decimal(src_klines.iloc[0]["volume"])
-                        != Decimal(cd_pre_kline.a)
-                    ):
-                        # print(
-                        #     f"{market}--{code}--{frequency} {key}",
-                        #     cd_pre_kline,
-                        #     src_klines.iloc[0].to_dict(),
-                        # )
-                        # print(
-                        #     f"{market}--{code}--{frequency} {key} 计算前的数据有差异，重新计算"
-                        # )
-                        # print(cd_pre_kline, src_klines)
-                        cd = cl.CL(code, frequency, cl_config)
-                # 判断缓存中的最近一百根时间范围内的数量是否一致
-                if len(cd.get_src_klines()) >= 100 and len(klines) >= 100:
-                    _valid_cd_klines = cd.get_src_klines()[-100:]
-                    _valid_src_klines = klines[
-                        (klines["date"] >= _valid_cd_klines[0].date)
-                        & (klines["date"] <= _valid_cd_klines[-1].date)
-                    ]
-                    if len(_valid_cd_klines) != len(_valid_src_klines):
-                        # print(
-                        #     f"{market}--{code}--{frequency} {key} 计算后的缠论数据有丢失数据 [{len(_valid_cd_klines)} - {len(_valid_src_klines)}]，重新计算"
-                        # )
-                        cd = cl.CL(code, frequency, cl_config)
         except Exception:
+            cd = cl.CL(code, frequency, cl_config)
             if file_pathname.is_file():
                 # print(
                 #     f"获取 web 缓存的缠论数据对象异常 {market} {code} {frequency} - {e}，尝试删除缓存文件重新计算"
@@ -261,23 +588,97 @@ class FileCacheDB(object):
 
         cd.process_klines(klines)
 
+        # 更新后的对象放入内存缓存，由后台线程或淘汰时写入快照文件
+        with self._cl_cache_lock:
+            self._cl_cache[cache_key] = (file_pathname, cd)
+            self._cl_cache.move_to_end(cache_key)
+            self._cl_cache_dirty.add(cache_key)
+            if self._cl_flush_thread is None:
+                self._cl_flush_thread = threading.Thread(
+                    target=self._run_flush_cl_cache, daemon=True
+                )
+                self._cl_flush_thread.start()
+
+        return cd
+
+    @contextlib.contextmanager
+    def _cl_key_lock(self, cache_key: str):
+        """
+        获取 key 的锁，最后一个使用者释放后删除，淘汰或不再使用的 key 不会一直占用
+        """
+        with self._cl_cache_lock:
+            item = self._cl_key_locks.get(cache_key)
+            if item is None:
+                item = self._cl_key_locks[cache_key] = [threading.Lock(), 0]
+            item[1] += 1
         try:
-            with open(file_pathname, "wb") as fp:
-                pickle.dump(cd, fp)
-        except Exception as e:
-            print(f"写入缓存异常 {market} {code} {frequency} - {e}")
+            with item[0]:
+                yield
+        finally:
+            with self._cl_cache_lock:
+                item[1] -= 1
+                if item[1] == 0:
+                    del self._cl_key_locks[cache_key]
+
+    def _write_cl_cache(self, cache_key: str, file_pathname: pathlib.Path, cd: ICL):
+        """
+        将内存中的缠论数据对象写入快照文件
+        """
+        with self._cl_key_lock(cache_key):
+            try:
+                self.dump_cl_snapshot(file_pathname, cd)
+            except Exception as e:
+                print(f"写入缓存异常 {file_pathname.name} - {e}")
 
-        # 加一个随机概率，去清理历史的缓存，避免太多占用空间
-        if random.randint(0, 1000) <= 5:
-            self.clear_old_web_cl_data()
+    def _evict_cl_cache(self):
+        """
+        淘汰超出数量或估算内存占用的缠论数据对象，有更新的写入快照文件
+        """
+        evicted: List[Tuple[str, pathlib.Path, ICL, bool]] = []
+        with self._cl_cache_lock:
+            cache_bytes = sum(
+                len(_cd.get_src_klines()) * self.cl_cache_kline_bytes
+                for _, _cd in self._cl_cache.values()
+            )
+            while len(self._cl_cache) > 1 and (
+                len(self._cl_cache) > self.cl_cache_max_num
+                or cache_bytes > self.cl_cache_max_bytes
+            ):
+                cache_key, (file_pathname, cd) = self._cl_cache.popitem(last=False)
+                cache_bytes -= len(cd.get_src_klines()) * self.cl_cache_kline_bytes
+                dirty = cache_key in self._cl_cache_dirty
+                self._cl_cache_dirty.discard(cache_key)
+                evicted.append((cache_key, file_pathname, cd, dirty))
+        for cache_key, file_pathname, cd, dirty in evicted:
+            if dirty:
+                self._write_cl_cache(cache_key, file_pathname, cd)
+        return True
 
-        return cd
+    def flush_cl_cache(self):
+        """
+        将内存中有更新的缠论数据对象写入快照文件
+        """
+        with self._cl_cache_lock:
+            dirty_items = [
+                (cache_key, *self._cl_cache[cache_key])
+                for cache_key in self._cl_cache_dirty
+            ]
+            self._cl_cache_dirty.clear()
+        for cache_key, file_pathname, cd in dirty_items:
+            self._write_cl_cache(cache_key, file_pathname, cd)
+        return True
+
+    def _run_flush_cl_cache(self):
+        while True:
+            time.sleep(self.cl_cache_flush_interval)
+            self.flush_cl_cache()
 
     def clear_web_cl_data(self, market: str, code: str):
         """
         清除指定市场下标的缠论缓存对象
         """
-        for filename in (self.cl_data_path / market).glob("*.pkl"):
+        self._clear_cl_cache(f"{market}_{code.replace('/', '_').replace('.', '_')}")
+        for filename in self._cl_data_files(self.cl_data_path / market):
             try:
                 if f"{market}_{code.replace('/', '_').replace('.', '_')}" in str(
                     filename
@@ -295,7 +696,7 @@ class FileCacheDB(object):
             15 * 24 * 60 * 60
         )
         for _market in Market:
-            for filename in (self.cl_data_path / _market.value).glob("*.pkl"):
+            for filename in self._cl_data_files(self.cl_data_path / _market.value):
                 try:
                     if filename.stat().st_mtime < del_lt_times:
                         filename.unlink()
@@ -304,12 +705,32 @@ class FileCacheDB(object):
                     pass
         return True
 
+    @staticmethod
+    def _cl_data_files(path: pathlib.Path):
+        """
+        缠论数据缓存文件（快照文件与旧版本的 pkl 文件）
+        """
+        yield from path.glob("*.snap")
+        yield from path.glob("*.pkl")
+
+    def _clear_cl_cache(self, match: str = None):
+        """
+        清除内存中缓存的缠论数据对象，match 不为空则只清除 key 中包含 match 的
+        """
+        with self._cl_cache_lock:
+            for cache_key in list(self._cl_cache.keys()):
+                if match is None or match in cache_key:
+                    del self._cl_cache[cache_key]
+                    self._cl_cache_dirty.discard(cache_key)
+        return True
+
     def clear_all_cl_data(self):
         """
         删除所有缓存的计算结果文件
         """
+        self._clear_cl_cache()
         for _market in Market:
-            for filename in (self.cl_data_path / _market.value).glob("*.pkl"):
+            for filename in self._cl_data_files(self.cl_data_path / _market.value):
                 try:
                     filename.unlink()
                 except Exception:
@@ -325,30 +746,201 @@ class FileCacheDB(object):
         建议定时频繁的进行读取，保持更新，避免太多时间不读取，后续造成数据缺失情况
         """
 
-        key = hashlib.md5(
-            f'{[f"{k}:{v}" for k, v in cl_config.items() if k in self.config_keys]}'.encode(
-                "UTF-8"
-            )
-        ).hexdigest()
+        key = self.cl_config_key(cl_config)
         filename = (
             self.cl_data_path
-            / f'{market}_{code.replace("/", "_")}_{frequency}_{key}.pkl'
+            / f'{market}_{code.replace("/", "_")}_{frequency}_{key}.snap'
         )
-        cd: ICL
-        if filename.is_file() is False:
+        cd: ICL = None
+        if filename.is_file():
+            try:
+                cd = self.load_cl_snapshot(filename)
+            except Exception:
+                # 快照文件损坏，删除后重新计算
+                cd = None
+                filename.unlink(missing_ok=True)
+        if cd is None:
             cd = cl.CL(code, frequency, cl_config)
-        else:
-            with open(filename, "rb") as fp:
-                cd = pickle.load(fp)
         limit = 200000
         if len(cd.get_klines()) > 10000:
             limit = 1000
         klines = db_ex.klines(code, frequency, args={"limit": limit})
         cd.process_klines(klines)
-        with open(filename, "wb") as fp:
-            pickle.dump(cd, fp)
+        self.dump_cl_snapshot(filename, cd)
+        return cd
+
+    def cl_config_key(self, cl_config: dict) -> str:
+        """
+        缠论配置的唯一标识，只包含影响缠论计算的配置项（config_keys）
+        """
+        return hashlib.md5(
+            f'{[f"{k}:{v}" for k, v in cl_config.items() if k in self.config_keys]}'.encode(
+                "UTF-8"
+            )
+        ).hexdigest()
+
+    @staticmethod
+    def klines_fingerprint(klines: pd.DataFrame) -> str:
+        """
+        K线数据的指纹，时间与 开高低收量 都一致的K线数据，计算的缠论数据也一致
+        """
+        md5 = hashlib.md5()
+        md5.update(pd.DatetimeIndex(klines["date"]).asi8.tobytes())
+        md5.update(
+            np.ascontiguousarray(
+                klines[["open", "high", "low", "close", "volume"]].to_numpy(
+                    dtype=np.float64
+                )
+            ).tobytes()
+        )
+        return md5.hexdigest()
+
+    def get_backtest_cl_data(
+        self,
+        market: str,
+        code: str,
+        frequency: str,
+        cl_config: dict,
+        klines: pd.DataFrame,
+    ) -> ICL:
+        """
+        获取回测中使用K线数据计算的缠论数据对象
+
+        计算结果按 代码、周期、缠论配置项（config_keys）、K线数据指纹 保存为快照文件，
+        参数优化中缠论配置相同（只有策略参数或不影响计算的配置不同）的回测，以及修改策略后重新回测，都可以直接读取，不需要重新计算
+        """
+        file_pathname = (
+            self.backtest_cl_path
+            / market
+            / f"{code.replace('/', '_').replace('.', '_')}_{frequency}_{self.cl_config_key(cl_config)}_{self.klines_fingerprint(klines)}.snap"
+        )
+        cd: Union[ICL, None] = None
+        if file_pathname.is_file():
+            try:
+                cd = self.load_cl_snapshot(file_pathname)
+                # 更新文件时间，避免使用中的快照被清理
+                os.utime(file_pathname)
+            except Exception:
+                # 快照文件损坏，删除后重新计算
+                cd = None
+                file_pathname.unlink(missing_ok=True)
+        if cd is None:
+            cd = cl.CL(code, frequency, cl_config).process_klines(klines)
+            self.dump_cl_snapshot(file_pathname, cd)
+
+        # 加一个随机概率，去清理历史的缓存，避免太多占用空间
+        if random.randint(0, 1000) <= 5:
+            self.clear_old_backtest_cl_data()
+
         return cd
 
+    def clear_old_backtest_cl_data(self, days: int = 15):
+        """
+        清除时间超过 days 天的回测缠论数据快照
+        """
+        del_lt_times = fun.datetime_to_int(datetime.datetime.now()) - (
+            days * 24 * 60 * 60
+        )
+        for _market in Market:
+            for filename in (self.backtest_cl_path / _market.value).glob("*.snap"):
+                try:
+                    if filename.stat().st_mtime < del_lt_times:
+                        filename.unlink()
+                except Exception:
+                    pass
+        return True
+
+    @staticmethod
+    def _snapshot_align(offset: int) -> int:
+        # 快照中的数据块按 64 字节对齐
+        return (offset + 63) // 64 * 64
+
+    def dump_cl_snapshot(self, file_pathname: pathlib.Path, cd: ICL):
+        """
+        将缠论数据对象写入快照文件
+
+        文件内容：标识(8) + 头信息长度(4) + 头信息(json) + 数组数据块 + 对象数据(pickle)
+        K线等数组数据通过 pickle 5 的带外缓冲区单独写入，读取时直接映射文件内容，不需要复制和解析
+        先写入临时文件再重命名替换，读取时不会读到写了一半的文件
+        """
+        buffers = []
+        payload = pickle.dumps(
+            cd, protocol=5, buffer_callback=lambda b: buffers.append(b.raw())
+        )
+        blocks = []
+        offset = 0
+        for buf in buffers:
+            offset = self._snapshot_align(offset)
+            blocks.append([offset, buf.nbytes])
+            offset += buf.nbytes
+        payload_block = [self._snapshot_align(offset), len(payload)]
+        header = json.dumps(
+            {
+                "version": self.cl_snapshot_version,
+                "cl_update_date": self.cl_update_date,
+                "buffers": blocks,
+                "payload": payload_block,
+            }
+        ).encode("UTF-8")
+        data_start = self._snapshot_align(len(self.cl_snapshot_magic) + 4 + len(header))
+
+        tmp_pathname = file_pathname.with_name(f"{file_pathname.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp_pathname, "wb") as fp:
+                fp.write(self.cl_snapshot_magic)
+                fp.write(struct.pack("<I", len(header)))
+                fp.write(header)
+                for (block_offset, _), buf in zip(
+                    blocks + [payload_block], buffers + [payload]
+                ):
+                    fp.write(b"\x00" * (data_start + block_offset - fp.tell()))
+                    fp.write(buf)
+            os.replace(tmp_pathname, file_pathname)
+        finally:
+            if tmp_pathname.is_file():
+                tmp_pathname.unlink()
+        return True
+
+    def load_cl_snapshot(self, file_pathname: pathlib.Path) -> Union[ICL, None]:
+        """
+        读取快照文件中的缠论数据对象，格式版本或缠论更新时间不一致的返回 None
+        文件为空或内容不完整（被截断）的抛出 ValueError，由调用方删除文件后重新计算
+
+        数组数据直接引用映射的文件内容（只读），Windows 下映射的文件无法被替换，所以读取全部内容
+        """
+        magic_len = len(self.cl_snapshot_magic)
+        with open(file_pathname, "rb") as fp:
+            if os.fstat(fp.fileno()).st_size < magic_len + 4:
+                raise ValueError(f"快照文件不完整 {file_pathname}")
+            if os.name == "nt":
+                data = memoryview(fp.read())
+            else:
+                data = memoryview(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ))
+        if data[:magic_len] != self.cl_snapshot_magic:
+            return None
+        (header_len,) = struct.unpack_from("<I", data, magic_len)
+        if magic_len + 4 + header_len > len(data):
+            raise ValueError(f"快照文件不完整 {file_pathname}")
+        header = json.loads(bytes(data[magic_len + 4 : magic_len + 4 + header_len]))
+        if (
+            header["version"] != self.cl_snapshot_version
+            or header["cl_update_date"] != self.cl_update_date
+        ):
+            return None
+        data_start = self._snapshot_align(magic_len + 4 + header_len)
+        # 切片越界不会报错，需要检查每个数据块都在文件内，避免读取到不完整的数组
+        for offset, size in header["buffers"] + [header["payload"]]:
+            if data_start + offset + size > len(data):
+                raise ValueError(f"快照文件不完整 {file_pathname}")
+        buffers = [
+            data[data_start + offset : data_start + offset + size]
+            for offset, size in header["buffers"]
+        ]
+        offset, size = header["payload"]
+        return pickle.loads(
+            data[data_start + offset : data_start + offset + size], buffers=buffers
+        )
+
     def cache_pkl_to_file(self, filename: str, data: object):
         """
         将缓存数据持久化到文件中
@@ -1,4 +1,4 @@
-from chanlun.cl_utils import query_cl_chart_config, web_batch_get_cl_datas
+from chanlun.cl_utils import query_cl_chart_config, web_batch_cl_datas
 from tqdm.auto import tqdm
 from concurrent.futures import ProcessPoolExecutor
 from multiprocessing import get_context
@@ -6,14 +6,19 @@ from chanlun.exchange.exchange_tdx import ExchangeTDX
 
 ex = ExchangeTDX()
 cache_freqs = ["d", "30m"]
+# 每批次并发获取K线的代码数量
+batch_size = 200
 
 
-def process_cache_code_cd(code):
+def process_cache_code_cd(code, klines):
     cl_config = query_cl_chart_config("a", "SH.000001")
     for f in cache_freqs:
         try:
-            klines = ex.klines(code, f)
-            web_batch_get_cl_datas("a", code, {f: klines}, cl_config)
+            if klines[f] is None:
+                continue
+            # 只需要计算并写入缓存，不需要取出对象
+            with web_batch_cl_datas("a", code, {f: klines[f]}, cl_config):
+                pass
         except Exception as e:
             print(f"Error : {code} {f}")
 
@@ -33,6 +38,14 @@ if __name__ == "__main__":
         ]
         print("cache_codes:", len(cache_codes))
         bar = tqdm(total=len(cache_codes))
-        for _ in executor.map(process_cache_code_cd, cache_codes):
-            bar.update(1)
+        for i in range(0, len(cache_codes), batch_size):
+            batch_codes = cache_codes[i : i + batch_size]
+            # 批量并发获取K线，再交给进程池计算
+            batch_klines = {f: ex.klines_many(batch_codes, f) for f in cache_freqs}
+            for _ in executor.map(
+                process_cache_code_cd,
+                batch_codes,
+                [{f: batch_klines[f][_c] for f in cache_freqs} for _c in batch_codes],
+            ):
+                bar.update(1)
     print("Done")
@@ -0,0 +1,187 @@
+"""
+回测性能分析
+
+记录各个阶段（数据获取、周期转换、缠论计算、策略开平仓、执行操作、持仓记录等）的耗时与调用次数，可按代码区分
+默认不开启，不开启时 start / stop / stage 只做一次判断后直接返回
+
+使用方法：
+    from chanlun.profiler import profiler
+
+    profiler.enable()
+    with profiler.stage("klines", code):
+        ...
+    token = profiler.start("cl_fx")
+    ...
+    profiler.stop(token)
+    profiler.print_report()
+    profiler.save_folded("profile.folded")  # 可以使用 flamegraph.pl / speedscope 生成火焰图
+"""
+
+import contextlib
+import time
+from typing import Dict, List, Tuple, Union
+
+import prettytable as pt
+
+
+class _Frame:
+    """
+    正在执行中的阶段
+    """
+
+    __slots__ = ("name", "code", "stack", "start", "child_time")
+
+    def __init__(self, name: str, code: Union[str, None], stack: tuple):
+        self.name = name
+        self.code = code
+        self.stack = stack
+        self.start = time.perf_counter()
+        self.child_time = 0.0
+
+
+class Profiler:
+    """
+    阶段耗时统计
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._frames: List[_Frame] = []
+        # (阶段, 代码) -> [调用次数, 总耗时]
+        self._stats: Dict[Tuple[str, Union[str, None]], list] = {}
+        # 调用栈 -> 自身耗时（不包括子阶段），用于生成火焰图
+        self._folded: Dict[tuple, float] = {}
+
+    def enable(self):
+        """
+        开启并清空之前的统计
+        """
+        self.reset()
+        self.enabled = True
+        return True
+
+    def disable(self):
+        self.enabled = False
+        self._frames = []
+        return True
+
+    def reset(self):
+        self._frames = []
+        self._stats = {}
+        self._folded = {}
+        return True
+
+    def start(self, name: str, code: str = None) -> Union[_Frame, None]:
+        """
+        开始记录阶段，返回的对象传给 stop 结束记录；code 为空的继承上级阶段的代码
+        """
+        if not self.enabled:
+            return None
+        parent = self._frames[-1] if self._frames else None
+        if code is None and parent is not None:
+            code = parent.code
+        label = name if code is None or (parent and parent.code == code) else f"{name}[{code}]"
+        frame = _Frame(name, code, (parent.stack if parent else ()) + (label,))
+        self._frames.append(frame)
+        return frame
+
+    def stop(self, frame: Union[_Frame, None]):
+        """
+        结束记录阶段
+        """
+        if frame is None or not self.enabled:
+            return None
+        use_time = time.perf_counter() - frame.start
+        # 子阶段异常没有结束的，一并出栈
+        while self._frames and self._frames[-1] is not frame:
+            self._frames.pop()
+        if self._frames:
+            self._frames.pop()
+        if self._frames:
+            self._frames[-1].child_time += use_time
+
+        stat = self._stats.get((frame.name, frame.code))
+        if stat is None:
+            self._stats[(frame.name, frame.code)] = [1, use_time]
+        else:
+            stat[0] += 1
+            stat[1] += use_time
+        self._folded[frame.stack] = (
+            self._folded.get(frame.stack, 0.0) + use_time - frame.child_time
+        )
+        return None
+
+    @contextlib.contextmanager
+    def _stage(self, name: str, code: str = None):
+        frame = self.start(name, code)
+        try:
+            yield frame
+        finally:
+            self.stop(frame)
+
+    def stage(self, name: str, code: str = None):
+        """
+        with 方式记录阶段耗时
+        """
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._stage(name, code)
+
+    def stats(self, by_code: bool = False) -> List[dict]:
+        """
+        统计结果，按总耗时倒序
+        @param by_code: 是否按代码区分，False 则合并所有代码的同一阶段
+        """
+        merged: Dict[tuple, list] = {}
+        for (name, code), (num, use_time) in self._stats.items():
+            key = (name, code if by_code else None)
+            if key not in merged:
+                merged[key] = [0, 0.0]
+            merged[key][0] += num
+            merged[key][1] += use_time
+        total_time = sum(self._folded.values())
+        rows = [
+            {
+                "stage": name,
+                "code": code,
+                "num": num,
+                "times": use_time,
+                "avg_ms": use_time / num * 1000,
+                "rate": use_time / total_time * 100 if total_time > 0 else 0,
+            }
+            for (name, code), (num, use_time) in merged.items()
+        ]
+        rows.sort(key=lambda _r: _r["times"], reverse=True)
+        return rows
+
+    def print_report(self, by_code: bool = False, top: int = None):
+        """
+        打印统计表格，占比为阶段总耗时（包括子阶段）占所有记录时间的百分比
+        """
+        tb = pt.PrettyTable()
+        tb.field_names = ["阶段", "代码", "调用次数", "总耗时(秒)", "平均耗时(毫秒)", "占比"]
+        for row in self.stats(by_code)[:top]:
+            tb.add_row(
+                [
+                    row["stage"],
+                    row["code"] or "",
+                    row["num"],
+                    f"{row['times']:.3f}",
+                    f"{row['avg_ms']:.3f}",
+                    f"{row['rate']:.2f}%",
+                ]
+            )
+        print(tb)
+        return True
+
+    def save_folded(self, file_pathname: str):
+        """
+        保存火焰图使用的折叠调用栈格式（每行：阶段1;阶段2;阶段3 自身耗时微秒）
+        """
+        with open(file_pathname, "w", encoding="utf-8") as fp:
+            for stack, use_time in self._folded.items():
+                fp.write(f"{';'.join(stack)} {int(use_time * 1000000)}\n")
+        return True
+
+
+profiler = Profiler()
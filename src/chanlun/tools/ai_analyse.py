@@ -8,7 +8,7 @@ import talib
 
 from chanlun.cl_interface import BI, ICL, XD
 from chanlun.exchange import get_exchange, Market
-from chanlun.cl_utils import query_cl_chart_config, web_batch_get_cl_datas
+from chanlun.cl_utils import query_cl_chart_config, web_batch_cl_datas
 from chanlun import config, fun
 import json, datetime
 from chanlun.db import db, TableByAIAnalyse
@@ -60,12 +60,13 @@ class AIAnalyse:
         cl_config = query_cl_chart_config(self.market, code)
         stock = self.ex.stock_info(code)
         klines = self.ex.klines(code, frequency)
-        cds = web_batch_get_cl_datas(self.market, code, {frequency: klines}, cl_config)
-        cd = cds[0]
-        try:
-            prompt = self.prompt(cd=cd)
-        except Exception as e:
-            return {"ok": False, "msg": f"获取缠论当前 Prompt 异常：{e}"}
+        with web_batch_cl_datas(
+            self.market, code, {frequency: klines}, cl_config
+        ) as cds:
+            try:
+                prompt = self.prompt(cd=cds[0])
+            except Exception as e:
+                return {"ok": False, "msg": f"获取缠论当前 Prompt 异常：{e}"}
 
         analyse_res = self.req_llm_ai_model(prompt)
 
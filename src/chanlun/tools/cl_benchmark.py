@@ -0,0 +1,154 @@
+# coding: utf-8
+"""
+缠论计算性能测试
+
+使用随机生成的K线数据，测试缠论计算各个环节的耗时，运行方式：
+    python -m chanlun.tools.cl_benchmark
+"""
+
+import os
+
+# CZSC 默认只保留最近的 50 笔，测试时保留所有笔，使计算的数据量与K线数量成正比（需要在导入 czsc 之前设置）
+os.environ.setdefault("czsc_max_bi_num", "1000000")
+
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+
+from chanlun.cl_interface import Kline
+from chanlun.cl_opensource import CL, RawBar
+
+
+def random_klines(n: int, seed: int = 0) -> pd.DataFrame:
+    """
+    生成随机游走的K线数据
+    """
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 1, n))
+    close = close - min(close.min(), 0) + 10
+    _open = close + rng.normal(0, 0.3, n)
+    high = np.maximum(_open, close) + rng.random(n)
+    low = np.minimum(_open, close) - rng.random(n)
+    return pd.DataFrame(
+        {
+            "code": "TEST",
+            "date": pd.date_range(
+                "2010-01-01", periods=n, freq="5min", tz="Asia/Shanghai"
+            ),
+            "open": _open,
+            "high": high,
+            "low": low,
+            "close": close,
+            "volume": rng.random(n) * 10000,
+        }
+    )
+
+
+def bench_convert(sizes=(5000, 20000, 50000)):
+    """
+    测试 CZSC 对象转换为 ICL 对象的耗时
+    """
+    for n in sizes:
+        cd = CL("TEST", "5m", {}).process_klines(random_klines(n))
+        # 清空已转换对象的缓存，强制全部重新转换
+        cd._czsc_objs = {"fx": {}, "bi": {}, "xd": {}, "zs": {}}
+        s_time = time.perf_counter()
+        cd._convert_czsc_data()
+        use_time = time.perf_counter() - s_time
+        print(
+            f"[convert] K线 {n} 分型 {len(cd.get_fxs())} 笔 {len(cd.get_bis())} 转换耗时 {use_time:.4f}s"
+        )
+
+
+def _iterrows_bars(code: str, frequency: str, klines: pd.DataFrame):
+    """
+    逐行遍历 DataFrame 构建 Kline 与 RawBar，作为批量转换的对比基准
+    """
+    _klines = []
+    raw_bars = []
+    for i, row in klines.iterrows():
+        dt = pd.to_datetime(row["date"])
+        k = Kline(
+            index=i,
+            date=dt,
+            h=float(row["high"]),
+            l=float(row["low"]),
+            o=float(row["open"]),
+            c=float(row["close"]),
+            a=float(row["volume"]),
+        )
+        _klines.append(k)
+        raw_bars.append(
+            RawBar(
+                symbol=code,
+                dt=dt,
+                id=i,
+                freq=frequency,
+                open=k.o,
+                close=k.c,
+                high=k.h,
+                low=k.l,
+                vol=k.a,
+                amount=0,
+            )
+        )
+    return _klines, raw_bars
+
+
+def bench_ingest(sizes=(5000, 20000, 50000)):
+    """
+    测试 DataFrame 转换为 Kline 与 RawBar 的耗时（逐行遍历 与 数组批量转换）
+    """
+    for n in sizes:
+        klines = random_klines(n)
+
+        s_time = time.perf_counter()
+        _iterrows_bars("TEST", "5m", klines)
+        iterrows_time = time.perf_counter() - s_time
+
+        s_time = time.perf_counter()
+        cd = CL("TEST", "5m", {})
+        dates = pd.DatetimeIndex(pd.to_datetime(klines["date"]))
+        values = klines[["high", "low", "open", "close", "volume"]].to_numpy(
+            dtype=np.float64
+        )
+        cd._append_klines(dates, values)
+        array_time = time.perf_counter() - s_time
+
+        print(
+            f"[ingest] K线 {n} iterrows {iterrows_time:.4f}s 数组 {array_time:.4f}s 提速 {iterrows_time / array_time:.1f}x"
+        )
+
+
+def _pickle_round_trip(obj):
+    s_time = time.perf_counter()
+    data = pickle.dumps(obj)
+    pickle.loads(data)
+    return len(data), time.perf_counter() - s_time
+
+
+def bench_pickle(sizes=(5000, 20000, 50000)):
+    """
+    测试缠论对象序列化的大小与耗时（列式K线存储 与 Kline 对象列表）
+    """
+    for n in sizes:
+        cd = CL("TEST", "5m", {}).process_klines(random_klines(n))
+        store_size, store_time = _pickle_round_trip(cd)
+
+        store = cd._klines
+        cd._klines = list(store)
+        list_size, list_time = _pickle_round_trip(cd)
+        cd._klines = store
+
+        print(
+            f"[pickle] K线 {n} 列式存储 {store_size / 1024 / 1024:.2f}MB {store_time:.4f}s "
+            f"对象列表 {list_size / 1024 / 1024:.2f}MB {list_time:.4f}s"
+        )
+
+
+if __name__ == "__main__":
+    bench_ingest()
+    bench_convert()
+    bench_pickle()
@@ -0,0 +1,97 @@
+# coding: utf-8
+"""
+数据库K线读取性能测试
+
+在配置的数据库中写入随机生成的K线（测试完成后删除），对比 ORM 逐个对象转换 与 直接查询列 两种读取方式的耗时，运行方式：
+    python -m chanlun.tools.db_benchmark
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from chanlun.base import Market
+from chanlun.db import db
+from chanlun.exchange.exchange_db import ExchangeDB
+
+BENCH_CODE = "BENCH_TEST"
+
+
+def random_klines(n: int, seed: int = 0) -> pd.DataFrame:
+    """
+    生成随机游走的小时K线数据（0点0分的K线会进行交易时间的转换）
+    """
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 1, n))
+    close = close - min(close.min(), 0) + 10
+    _open = close + rng.normal(0, 0.3, n)
+    return pd.DataFrame(
+        {
+            "code": BENCH_CODE,
+            "date": pd.date_range("2000-01-01", periods=n, freq="h"),
+            "open": _open,
+            "high": np.maximum(_open, close) + rng.random(n),
+            "low": np.minimum(_open, close) - rng.random(n),
+            "close": close,
+            "volume": rng.random(n) * 10000,
+        }
+    )
+
+
+def orm_klines(ex: ExchangeDB, frequency: str, limit: int) -> pd.DataFrame:
+    """
+    通过 ORM 对象逐个转换读取K线，作为直接查询列的对比基准
+    """
+    klines = db.klines_query(ex.market, BENCH_CODE, frequency, limit=limit)
+    kline_pd = pd.DataFrame(
+        [
+            {
+                "code": _k.code,
+                "date": _k.dt,
+                "open": _k.o,
+                "high": _k.h,
+                "low": _k.l,
+                "close": _k.c,
+                "volume": _k.v,
+            }
+            for _k in klines
+        ]
+    )
+    kline_pd["date"] = pd.to_datetime(kline_pd["date"]).dt.tz_localize(ex.tz)
+    kline_pd["date"] = kline_pd["date"].apply(
+        lambda dt: dt.replace(hour=15, minute=0)
+        if dt.hour == 0 and dt.minute == 0
+        else dt
+    )
+    kline_pd.sort_values(by="date", inplace=True)
+    return kline_pd.reset_index(drop=True)
+
+
+def bench_klines(sizes=(10000, 50000, 100000)):
+    """
+    测试 ExchangeDB.klines 读取K线的耗时（ORM 对象 与 直接查询列）
+    """
+    ex = ExchangeDB(Market.A.value)
+    frequency = "60m"
+    try:
+        db.klines_insert(ex.market, BENCH_CODE, frequency, random_klines(max(sizes)))
+        for n in sizes:
+            s_time = time.perf_counter()
+            orm_df = orm_klines(ex, frequency, n)
+            orm_time = time.perf_counter() - s_time
+
+            s_time = time.perf_counter()
+            df = ex.klines(BENCH_CODE, frequency, args={"limit": n})
+            df_time = time.perf_counter() - s_time
+
+            assert orm_df["date"].equals(df["date"])
+            print(
+                f"[klines] K线 {n} ORM {orm_time:.4f}s 直接查询 {df_time:.4f}s 提速 {orm_time / df_time:.1f}x"
+            )
+    finally:
+        db.klines_delete(ex.market, BENCH_CODE)
+
+
+if __name__ == "__main__":
+    bench_klines()
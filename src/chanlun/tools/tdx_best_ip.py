@@ -3,6 +3,11 @@
 # by yutianst
 
 import datetime
+import inspect
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, wait
 
 from pytdx.exhq import TdxExHq_API
 from pytdx.hq import TdxHq_API
@@ -183,33 +188,135 @@ def ping(ip, port=7709, type_="stock"):
         return datetime.timedelta(9, 9, 0)
 
 
-def select_best_ip(_type="stock"):
-    """目前这里给的是单线程的选优, 如果需要多进程的选优/ 最优ip缓存 可以参考
-    https://github.com/QUANTAXIS/QUANTAXIS/blob/master/QUANTAXIS/QAFetch/QATdx.py#L106
-
+def select_best_ips(_type="stock", timeout: float = 3, max_workers: int = None):
+    """
+    并发检测所有服务器的延迟，返回可用服务器列表（按延迟从小到大排序，ping 为延迟秒数）
+    所有检测共用 timeout 秒的截止时间，超时未返回的服务器视为不可用，总耗时不超过 timeout
 
     Keyword Arguments:
-        _type {str} -- [description] (default: {'stock'})
-
-    Returns:
-        [type] -- [description]
+        _type {str} -- stock 股票服务器 future 扩展市场服务器 (default: {'stock'})
+        timeout {float} -- 检测的截止时间（秒）
+        max_workers {int} -- 最大并发数量，默认同时检测所有服务器
     """
-
     ip_list = stock_ip if _type == "stock" else future_ip
 
-    data = [ping(x["ip"], x["port"], _type) for x in ip_list]
+    executor = ThreadPoolExecutor(max_workers or len(ip_list))
+    futures = {
+        executor.submit(ping, x["ip"], x["port"], _type): x for x in ip_list
+    }
+    done, _ = wait(futures.keys(), timeout=timeout)
+    # 不等待超时的检测结束
+    executor.shutdown(wait=False)
+
     results = []
-    for i in range(len(data)):
+    for future in done:
+        data = future.result()
         # 删除ping不通的数据
-        if data[i] < datetime.timedelta(0, 9, 0):
-            results.append((data[i], ip_list[i]))
+        if data < datetime.timedelta(0, 9, 0):
+            results.append(dict(futures[future], ping=data.total_seconds()))
 
     # 按照ping值从小大大排序
-    results = [x[1] for x in sorted(results, key=lambda x: x[0])]
+    return sorted(results, key=lambda x: x["ping"])
 
+
+def select_best_ip(_type="stock", timeout: float = 3):
+    """
+    返回延迟最小的服务器，并将所有可用服务器的排序结果保存到缓存中（见 save_best_ips）
+    """
+    results = select_best_ips(_type, timeout)
+    if len(results) == 0:
+        raise Exception(f"没有可用的 {_type} 服务器")
+    save_best_ips(_type, results)
     return results[0]
 
 
+def save_best_ips(_type: str, ips: list):
+    """
+    保存服务器的排序结果与检测时间
+    """
+    from chanlun.db import db
+
+    db.cache_set(
+        f"tdx_best_ips_{_type}",
+        {"update_time": int(time.time()), "ips": ips},
+    )
+    return True
+
+
+def load_best_ips(_type: str, max_age: int = None) -> list:
+    """
+    读取保存的服务器排序结果，设置 max_age（秒）则超过时间的结果不返回
+    """
+    from chanlun.db import db
+
+    cache = db.cache_get(f"tdx_best_ips_{_type}")
+    if cache is None:
+        return []
+    if max_age is not None and time.time() - cache["update_time"] > max_age:
+        return []
+    return cache["ips"]
+
+
+# 后台重新选择服务器的线程与回调，每种服务器类型只启动一个线程
+_rerank_threads = {}
+_rerank_callbacks = {}
+_rerank_lock = threading.Lock()
+
+
+def _callback_ref(callback):
+    """
+    回调的引用，对象的方法使用弱引用，对象释放后回调自动失效，不会因为注册了回调而无法释放
+    """
+    if inspect.ismethod(callback):
+        return weakref.WeakMethod(callback)
+    return lambda: callback
+
+
+def _rerank_callback_list(_type: str) -> list:
+    """
+    返回还有效的回调，并移除已经失效的回调
+    """
+    with _rerank_lock:
+        callbacks = [_ref() for _ref in _rerank_callbacks.get(_type, [])]
+        _rerank_callbacks[_type] = [
+            _ref
+            for _ref, _callback in zip(_rerank_callbacks.get(_type, []), callbacks)
+            if _callback is not None
+        ]
+        return [_callback for _callback in callbacks if _callback is not None]
+
+
+def start_rerank_thread(_type: str = "stock", interval: int = 3600, callback=None):
+    """
+    启动后台线程，每 interval 秒重新检测服务器延迟并保存排序结果
+    callback 不为空，会使用最优的服务器调用 callback(best_ip)；同一类型多次调用只启动一个线程，回调都会执行
+    同一个回调只注册一次，对象的方法只保存弱引用
+    """
+    if callback is not None and callback not in _rerank_callback_list(_type):
+        with _rerank_lock:
+            _rerank_callbacks[_type].append(_callback_ref(callback))
+    with _rerank_lock:
+        if _type in _rerank_threads and _rerank_threads[_type].is_alive():
+            return _rerank_threads[_type]
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    best_ip = select_best_ip(_type)
+                    for _callback in _rerank_callback_list(_type):
+                        _callback(best_ip)
+                except Exception as e:
+                    print(f"重新选择 {_type} 服务器异常：{e}")
+
+        thread = threading.Thread(
+            target=run, name=f"tdx_rerank_{_type}", daemon=True
+        )
+        thread.start()
+        _rerank_threads[_type] = thread
+        return thread
+
+
 if __name__ == "__main__":
     print(len(stock_ip))
     ip = select_best_ip("stock")
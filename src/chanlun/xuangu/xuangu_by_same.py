@@ -17,7 +17,7 @@ from tqdm.auto import tqdm
 from chanlun import cl, fun
 from chanlun.base import Market
 from chanlun.cl_interface import ICL
-from chanlun.cl_utils import query_cl_chart_config, web_batch_get_cl_datas
+from chanlun.cl_utils import query_cl_chart_config, web_batch_cl_datas
 from chanlun.exchange import get_exchange
 
 
@@ -113,10 +113,10 @@ class XuanguBySame:
 
         try:
             klines = get_exchange(Market(self.market)).klines(code, frequency)
-            cd = web_batch_get_cl_datas(
+            with web_batch_cl_datas(
                 self.market, code, {frequency: klines}, cl_config
-            )[0]
-            features = self.extract_cd_features(cd)
+            ) as cds:
+                features = self.extract_cd_features(cds[0])
             if features is None:
                 return None
 
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 测试直接使用 src 目录下的 chanlun 包
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
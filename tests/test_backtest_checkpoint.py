@@ -0,0 +1,204 @@
+import datetime
+
+import pytest
+
+from chanlun.backtesting.backtest import BackTest
+from chanlun.file_db import fdb
+
+CODES = ["SH.600000", "SZ.000001"]
+DATES = [datetime.datetime(2024, 1, 1) + datetime.timedelta(days=i) for i in range(20)]
+
+
+class FakeBar:
+    def update(self, n=1):
+        pass
+
+
+class FakeCL:
+    """
+    模拟的缠论数据对象，记录每次计算的收盘价
+    """
+
+    def __init__(self, code):
+        self.code = code
+        self.closes = []
+
+
+class FakeKlines:
+    """
+    内存中的回放数据，按照 DATES 逐日回放
+    """
+
+    def __init__(self):
+        self.load_data_to_cache = True
+        self.loop_datetime_list = {}
+        self.loop_index = {}
+        self.now_date = None
+        self.cl_datas = {}
+        self.bar = FakeBar()
+
+    def init(self, base_code, frequency, codes=None):
+        self.loop_datetime_list = {frequency: DATES}
+        self.loop_index = {frequency: 0}
+
+    def next(self, frequency=""):
+        if self.loop_index[frequency] >= len(DATES):
+            return False
+        self.now_date = DATES[self.loop_index[frequency]]
+        self.loop_index[frequency] += 1
+        return True
+
+    def trade_codes(self, codes):
+        return codes
+
+    def get_cl_data(self, code):
+        cd = self.cl_datas.setdefault(f"{code}_d", FakeCL(code))
+        cd.closes.append(self.now_date.day * (CODES.index(code) + 1))
+        return cd
+
+
+class FakeStrategy:
+    def __init__(self):
+        self.loops = 0
+
+    def on_bt_loop_start(self, bt):
+        self.loops += 1
+
+    def is_filter_opts(self):
+        return False
+
+    def filter_opts(self, opts, trader):
+        return opts
+
+    def clear(self):
+        pass
+
+
+class FakeTrader:
+    """
+    记录每次执行时的缠论数据与策略状态，断点恢复不完整的会导致记录不一致
+    """
+
+    def __init__(self):
+        self.datas = None
+        self.strategy = None
+        self.buffer_opts = []
+        self.records = []
+
+    def set_strategy(self, strategy):
+        self.strategy = strategy
+
+    def update_position_record(self):
+        pass
+
+    def run(self, code, is_filter=False):
+        cd = self.datas.get_cl_data(code)
+        self.records.append(
+            (
+                self.datas.now_date,
+                code,
+                len(cd.closes),
+                sum(cd.closes),
+                self.strategy.loops,
+            )
+        )
+
+    def run_buffer_opts(self):
+        self.buffer_opts = []
+
+    def end(self):
+        pass
+
+    def save_to_pkl(self, key):
+        return {"records": list(self.records)}
+
+    def load_from_pkl(self, key, save_infos=None):
+        self.records = list(save_infos["records"])
+
+
+def make_backtest(save_file):
+    bt = BackTest()
+    bt.save_file = str(save_file)
+    bt.base_code = CODES[0]
+    bt.codes = CODES
+    bt.frequencys = ["d"]
+    bt.load_data_to_cache = True
+    bt.checkpoint_interval = 3
+    bt.strategy = FakeStrategy()
+    bt.datas = FakeKlines()
+    bt.trader = FakeTrader()
+    bt.trader.set_strategy(bt.strategy)
+    bt.trader.datas = bt.datas
+    return bt
+
+
+class Interrupt(Exception):
+    pass
+
+
+def interrupt_at(loop_date):
+    def callback(bt):
+        if bt.datas.now_date == loop_date:
+            raise Interrupt()
+
+    return callback
+
+
+def test_resume_same_as_uninterrupted(tmp_path):
+    bt_full = make_backtest(tmp_path / "full.pkl")
+    bt_full.run()
+
+    bt = make_backtest(tmp_path / "resume.pkl")
+    with pytest.raises(Interrupt):
+        bt.run(loop_callback_fun=interrupt_at(DATES[10]))
+    assert bt._checkpoint_path().is_dir()
+
+    bt_resume = make_backtest(tmp_path / "resume.pkl")
+    bt_resume.run(resume=True)
+
+    assert bt_resume.trader.records == bt_full.trader.records
+    assert bt_resume.strategy.loops == bt_full.strategy.loops
+    assert bt_resume._checkpoint_path().exists() is False
+
+
+def test_save_checkpoint_keeps_previous_generation(tmp_path, monkeypatch):
+    bt = make_backtest(tmp_path / "bt.pkl")
+    bt.datas.init(bt.base_code, "d")
+    bt.next_frequency = "d"
+    for _ in range(3):
+        bt.datas.next("d")
+        for code in CODES:
+            bt.trader.run(code)
+    assert bt.save_checkpoint()
+    path = bt._checkpoint_path()
+    assert [_p.name for _p in path.glob("gen_*")] == ["gen_1"]
+
+    bt.datas.next("d")
+    for code in CODES:
+        bt.trader.run(code)
+
+    def broken_dump(file_pathname, cd):
+        file_pathname.write_bytes(b"broken")
+        raise OSError("disk full")
+
+    # 写入新一代快照的过程中失败，上一代的断点仍然可以完整恢复
+    monkeypatch.setattr(fdb, "dump_cl_snapshot", broken_dump)
+    with pytest.raises(OSError):
+        bt.save_checkpoint()
+    monkeypatch.undo()
+
+    bt_load = make_backtest(tmp_path / "bt.pkl")
+    bt_load.datas.init(bt_load.base_code, "d")
+    bt_load.next_frequency = "d"
+    assert bt_load.load_checkpoint()
+    assert bt_load.datas.now_date == DATES[2]
+    assert bt_load.datas.loop_index == {"d": 3}
+    assert len(bt_load.trader.records) == 6
+    assert {k: cd.closes for k, cd in bt_load.datas.cl_datas.items()} == {
+        "SH.600000_d": [1, 2, 3],
+        "SZ.000001_d": [2, 4, 6],
+    }
+
+    # 保存成功后只保留最新一代的快照
+    assert bt.save_checkpoint()
+    assert sorted(_p.name for _p in path.glob("gen_*")) == ["gen_3"]
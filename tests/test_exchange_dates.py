@@ -0,0 +1,190 @@
+import datetime
+
+import pandas as pd
+import pytest
+import pytz
+
+from chanlun.exchange.exchange import (
+    replace_dates,
+    timestamps_to_dates,
+    zero_time_mask,
+)
+
+SH = pytz.timezone("Asia/Shanghai")
+NY = pytz.timezone("US/Eastern")
+
+
+def naive_dates(values):
+    return pd.Series(pd.to_datetime(values, format="mixed"))
+
+
+def tz_dates(values, tz):
+    return naive_dates(values).dt.tz_localize(tz)
+
+
+def assert_same_dates(new, old):
+    """
+    时间点与当地时间（包含时区偏移）都一致
+    """
+    new = pd.Series(new).tolist()
+    old = pd.Series(old).tolist()
+    assert [str(_d) for _d in new] == [str(_d) for _d in old]
+    assert new == old
+
+
+def test_tdx_minute_1300_to_1130():
+    dates = naive_dates(
+        ["2024-01-02 11:30", "2024-01-02 13:00", "2024-01-02 13:05", "2024-01-02 15:00"]
+    )
+
+    def dt_1300_to_1130(_d):
+        if _d.hour == 13 and _d.minute == 0:
+            return _d.replace(hour=11, minute=30)
+        return _d
+
+    new = replace_dates(
+        dates, (dates.dt.hour == 13) & (dates.dt.minute == 0), hour=11, minute=30
+    )
+    assert_same_dates(new, dates.apply(dt_1300_to_1130))
+
+
+@pytest.mark.parametrize("frequency", ["d", "w", "m", "q", "y"])
+def test_tdx_day_and_above(frequency):
+    dates = tz_dates(["2023-12-29", "2024-01-31", "2024-02-29", "2024-07-15"], SH)
+
+    old = dates.apply(lambda _d: _d.replace(hour=15, minute=0))
+    if frequency == "m":
+        old = old.apply(lambda _d: _d.replace(day=1))
+    if frequency == "y":
+        old = old.apply(lambda _d: _d.replace(month=1, day=1))
+
+    replace = {"hour": 15, "minute": 0}
+    if frequency == "m":
+        replace["day"] = 1
+    if frequency == "y":
+        replace.update(month=1, day=1)
+    assert_same_dates(replace_dates(dates, **replace), old)
+
+
+@pytest.mark.parametrize("hour, minute", [(15, 0), (16, 0), (9, 0), (9, 30)])
+def test_db_day_kline_times(hour, minute):
+    dates = naive_dates(
+        [
+            "2024-03-08 00:00",
+            "2024-03-08 00:00:30",
+            "2024-03-08 10:00",
+            "2024-03-11 00:00",
+            "2024-11-04 00:00",
+        ]
+    )
+    is_day = (dates.dt.hour == 0) & (dates.dt.minute == 0)
+    old = dates.mask(is_day, dates + pd.Timedelta(hours=hour, minutes=minute))
+    new = replace_dates(
+        dates, zero_time_mask(dates, check_second=False), hour=hour, minute=minute
+    )
+    assert_same_dates(new, old)
+
+
+@pytest.mark.parametrize("tz", [SH, NY])
+def test_binance_timestamps(tz):
+    timestamps = pd.Series(
+        [
+            1704067200000,
+            1704067200123,
+            # US/Eastern 夏令时开始与结束前后
+            1710050400000,
+            1710054000000,
+            1730613600000,
+            1730617200000,
+            1730620800000,
+        ]
+    )
+    old = timestamps.apply(
+        lambda x: datetime.datetime.fromtimestamp(x / 1e3).astimezone(tz)
+    )
+    assert_same_dates(timestamps_to_dates(timestamps, tz), old)
+
+
+def test_tdx_futures_2300():
+    dates = tz_dates(["2024-01-02", "2024-01-03 15:00", "2024-06-28"], SH)
+    old = dates.apply(lambda _d: _d.replace(hour=23, minute=0))
+    assert_same_dates(replace_dates(dates, hour=23, minute=0), old)
+
+
+def convert_zero_time(dates, hour, minute):
+    def convert(dt):
+        if dt.hour == 0 and dt.minute == 0 and dt.second == 0:
+            return dt.replace(hour=hour, minute=minute)
+        return dt
+
+    return dates.apply(convert)
+
+
+def test_ib_zero_time_0930():
+    # 包含夏令时开始与结束的当天
+    dates = tz_dates(
+        [
+            "2024-03-08 00:00",
+            "2024-03-10 00:00",
+            "2024-03-11 00:00",
+            "2024-03-11 10:00",
+            "2024-11-03 00:00",
+            "2024-11-04 00:00:30",
+        ],
+        NY,
+    )
+    new = replace_dates(dates, zero_time_mask(dates), hour=9, minute=30)
+    assert_same_dates(new, convert_zero_time(dates, 9, 30))
+
+
+def test_baostock_zero_time_1500():
+    dates = naive_dates(["2024-01-02", "2024-01-02 10:30", "2024-01-03"])
+    new = replace_dates(dates, zero_time_mask(dates), hour=15, minute=0)
+    assert_same_dates(new, convert_zero_time(dates, 15, 0))
+
+
+def test_futu_zero_time_1600():
+    dates = tz_dates(["2024-01-02", "2024-01-02 10:30", "2024-01-03"], SH)
+    new = replace_dates(dates, zero_time_mask(dates), hour=16, minute=0)
+    assert_same_dates(new, convert_zero_time(dates, 16, 0))
+
+
+def test_qmt_hour_15():
+    dates = tz_dates(["2024-01-02 00:00", "2024-01-03 08:00"], "UTC").dt.tz_convert(SH)
+    old = dates.apply(lambda x: x.replace(hour=15))
+    assert_same_dates(replace_dates(dates, hour=15), old)
+
+
+def test_polygon_0930():
+    dates = pd.Series(
+        [
+            datetime.datetime.fromtimestamp(_t, tz=pytz.utc).astimezone(NY)
+            for _t in [1709874000, 1710043200, 1710129600, 1730606400, 1730696400]
+        ]
+    )
+    old = dates.apply(lambda _d: _d.replace(hour=9, minute=30))
+    assert_same_dates(replace_dates(dates, hour=9, minute=30), old)
+
+
+def test_replace_dst_nonexistent_and_ambiguous():
+    dates = tz_dates(
+        ["2024-03-10 00:00", "2024-11-03 00:00", "2024-11-03 00:00", "2024-07-01"],
+        NY,
+    )
+    # 2024-03-10 02:30 不存在，2024-11-03 01:30 重复
+    old = dates.apply(lambda _d: _d.replace(hour=2, minute=30))
+    assert_same_dates(replace_dates(dates, hour=2, minute=30), old)
+    old = dates.apply(lambda _d: _d.replace(hour=1, minute=30))
+    assert_same_dates(replace_dates(dates, hour=1, minute=30), old)
+
+    mask = pd.Series([True, False, True, False])
+    old = dates.where(~mask, dates.apply(lambda _d: _d.replace(hour=1, minute=30)))
+    assert_same_dates(replace_dates(dates, mask, hour=1, minute=30), old)
+
+
+def test_replace_keeps_sub_second():
+    dates = pd.Series([pd.Timestamp("2024-01-02 00:00:00.123456", tz=SH)])
+    old = dates.apply(lambda _d: _d.replace(hour=15))
+    new = replace_dates(dates, hour=15)
+    assert str(new.iloc[0]) == "2024-01-02 15:00:00.123456+08:00"
+    assert_same_dates(new, old)
@@ -0,0 +1,26 @@
+import gc
+
+from chanlun.tools import tdx_best_ip as best_ip
+
+
+class Receiver:
+    def __init__(self):
+        self.ips = []
+
+    def set_ip(self, ip):
+        self.ips.append(ip)
+
+
+def test_rerank_callback_registered_once_and_weak(monkeypatch):
+    monkeypatch.setattr(best_ip, "_rerank_callbacks", {})
+    monkeypatch.setattr(best_ip, "_rerank_threads", {})
+
+    receiver = Receiver()
+    best_ip.start_rerank_thread("test", interval=3600, callback=receiver.set_ip)
+    best_ip.start_rerank_thread("test", interval=3600, callback=receiver.set_ip)
+    assert best_ip._rerank_callback_list("test") == [receiver.set_ip]
+
+    del receiver
+    gc.collect()
+    assert best_ip._rerank_callback_list("test") == []
+    assert best_ip._rerank_callbacks["test"] == []
@@ -35,11 +35,11 @@ from chanlun.cl_utils import (
     kcharts_frequency_h_l_map,
     query_cl_chart_config,
     set_cl_chart_config,
-    web_batch_get_cl_datas,
 )
 from chanlun.config import get_data_path
 from chanlun.db import db
 from chanlun.exchange import get_exchange
+from chanlun.file_db import fdb
 from chanlun.exchange.stocks_bkgn import StocksBKGN
 from chanlun.tools.ai_analyse import AIAnalyse
 from chanlun.zixuan import ZiXuan
@@ -512,32 +512,27 @@ def create_app(test_config=None):
         ):
             # 如果开启并设置的该级别的低级别数据，获取低级别数据，并在转换成高级图表展示
             # s_time = time.time()
+            cl_frequency = frequency_low
             klines = ex.klines(code, frequency_low)
             # __log.info(f'{code} - {frequency_low} enable low to high get klines time : {time.time() - s_time}')
-            # s_time = time.time()
-            cd = web_batch_get_cl_datas(
-                market, code, {frequency_low: klines}, cl_config
-            )[0]
-            # __log.info(f'{code} - {frequency_low} enable low to high get cd time : {time.time() - s_time}')
         else:
             kchart_to_frequency = None
             # s_time = time.time()
+            cl_frequency = frequency
             klines = ex.klines(code, frequency)
             # __log.info(f'{code} - {frequency} get klines time : {time.time() - s_time}')
-            # s_time = time.time()
-            cd = web_batch_get_cl_datas(market, code, {frequency: klines}, cl_config)[0]
-            # __log.info(f'{code} - {frequency} get cd time : {time.time() - s_time}')
 
         # 如果图表指定返回的时间太早，直接返回无数据
         if int(_to) < fun.datetime_to_int(klines.iloc[0]["date"]):
             return {"s": "no_data"}
 
-        # 将缠论数据，转换成 tv 画图的坐标数据
+        # 计算缠论数据，并转换成 tv 画图的坐标数据（在缓存对象的锁内转换，不需要复制缠论数据对象）
         # s_time = time.time()
-        cl_chart_data = cl_data_to_tv_chart(
-            cd, cl_config, to_frequency=kchart_to_frequency
-        )
-        # __log.info(f'{code} - {frequency} to tv chart data time : {time.time() - s_time}')
+        with fdb.web_cl_data(market, code, cl_frequency, cl_config, klines) as cd:
+            cl_chart_data = cl_data_to_tv_chart(
+                cd, cl_config, to_frequency=kchart_to_frequency
+            )
+        # __log.info(f'{code} - {frequency} get cd and to tv chart data time : {time.time() - s_time}')
 
         # 根据 from_time 和 to_time 来获取对应的K线数据
         if firstDataRequest == "false":